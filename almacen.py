@@ -0,0 +1,173 @@
+"""Estado de inventario compartido por todas las sesiones de un proceso."""
+import threading
+import time
+
+import pandas as pd
+
+from busqueda import IndiceBusqueda
+from conversiones import _convertir_a_numero
+from historial import HistorialMovimientos
+from metricas import metricas
+from tabla import TablaInventario
+from vencimientos import IndiceVencimientos
+
+
+def semaforo(total, minimo):
+    if total <= minimo: return "🔴 Crítico"
+    elif total <= 1.5*minimo: return "🟡 Advertencia"
+    else: return "🟢 Óptimo"
+
+
+class AlmacenInventario:
+    """Una única copia en memoria de inventario, stock mínimo y movimientos.
+
+    Todas las sesiones de Streamlit leen los mismos objetos. Quien modifica el
+    estado lo hace dentro de `lock` y llama a `marcar_cambio(codigos)`, de modo
+    que las demás sesiones pueden detectar por `version` que los datos
+    cambiaron. `resumen` guarda por código nombre, marca, total, cantidad de lotes,
+    vencimiento más próximo y estado del semáforo, y se actualiza solo para
+    los códigos tocados, igual que los índices de `vencimientos` y `busqueda`.
+
+    Cada producto tiene además su propia versión: una terminal anota la que
+    vio al armar el carrito y al confirmar solo revisa los productos cuya
+    versión cambió. `lock` se toma solo para tocar la memoria; los guardados
+    en el backend van fuera de él, ordenados por `lock_guardado`.
+
+    Los guardados que quedaron pendientes se reintentan desde las sesiones;
+    `puede_reintentar()` y `anotar_reintento(ok)` espacian esos reintentos
+    con espera exponencial para que no vayan a la red en cada rerun.
+    """
+
+    def __init__(self):
+        self.inventario = TablaInventario()
+        self.stock_minimo = {}
+        self.movimientos = HistorialMovimientos()
+        self.resumen = {}
+        self.vencimientos = IndiceVencimientos()
+        self.busqueda = IndiceBusqueda()
+        self.version = 0
+        self.versiones = {}
+        self.epoca = 0
+        self.cargado = False
+        self.lock = threading.RLock()
+        self.lock_guardado = threading.RLock()
+        self.reintentos_fallidos = 0
+        self.proximo_reintento = 0.0
+        self._memo = {}
+
+    def _actualizar_resumen(self, codigo, indexar=True):
+        lotes = self.inventario.get(codigo) or []
+        if indexar:
+            self.vencimientos.actualizar(codigo, lotes)
+            if lotes:
+                self.busqueda.agregar(codigo, lotes[0].get("nombre"), lotes[0].get("marca"))
+            else:
+                self.busqueda.quitar(codigo)
+        if not lotes and codigo not in self.stock_minimo:
+            self.resumen.pop(codigo, None)
+            return
+        total = sum(l["cantidad"] for l in lotes)
+        minimo = _convertir_a_numero(self.stock_minimo.get(codigo))
+        vencimientos = [l["fecha_vencimiento"] for l in lotes if l.get("fecha_vencimiento")]
+        self.resumen[codigo] = {
+            "nombre": lotes[0].get("nombre") if lotes else None,
+            "marca": lotes[0].get("marca") if lotes else None,
+            "total": total,
+            "lotes": len(lotes),
+            "vencimiento_proximo": min(vencimientos) if vencimientos else "",
+            "stock_min": minimo,
+            "estado": semaforo(total, minimo),
+        }
+
+    def marcar_cambio(self, codigos=None):
+        """Registra una escritura; sin `codigos` se recalcula el resumen completo"""
+        with self.lock:
+            if codigos is None:
+                # Tras una recarga completa ninguna versión anotada vale
+                self.epoca += 1
+                self.versiones.clear()
+                self.resumen.clear()
+                self.vencimientos.reconstruir(self.inventario)
+                self.busqueda.reconstruir(self.inventario.productos())
+                for codigo in set(self.inventario) | set(self.stock_minimo):
+                    self._actualizar_resumen(codigo, indexar=False)
+            else:
+                for codigo in codigos:
+                    self._actualizar_resumen(codigo)
+                    self.versiones[codigo] = self.versiones.get(codigo, 0) + 1
+            self.version += 1
+            return self.version
+
+    def puede_reintentar(self):
+        return time.monotonic() >= self.proximo_reintento
+
+    def anotar_reintento(self, ok, espera_inicial=5, espera_maxima=300):
+        """Resultado de un reintento de guardado: si falló, el próximo espera el doble"""
+        if ok:
+            self.reintentos_fallidos = 0
+            self.proximo_reintento = 0.0
+            return
+        espera = min(espera_maxima, espera_inicial * 2 ** self.reintentos_fallidos)
+        self.reintentos_fallidos += 1
+        self.proximo_reintento = time.monotonic() + espera
+
+    def consumir_fifo(self, codigo, cantidad):
+        """Descuenta `cantidad` desde el lote que vence primero; se llama dentro de `lock`"""
+        with metricas.medir("consumir_fifo"):
+            return self.inventario.consumir_fifo(codigo, cantidad)
+
+    def version_producto(self, codigo):
+        return (self.epoca, self.versiones.get(codigo, 0))
+
+    def cambiados(self, leidas):
+        """Códigos cuya versión ya no es la anotada en `leidas` (codigo -> version_producto)"""
+        return [c for c, v in leidas.items() if self.version_producto(c) != v]
+
+    def instantanea(self, codigos=None):
+        """Copia de los lotes (de `codigos` o de todo) para guardar sin tener tomado `lock`"""
+        with self.lock:
+            codigos = list(self.inventario) if codigos is None else codigos
+            return {c: self.inventario.get(c, []) for c in codigos}
+
+    def stock_total(self, codigo):
+        item = self.resumen.get(codigo)
+        return item["total"] if item else 0
+
+    def memo(self, clave, calcular):
+        """Devuelve el resultado de `calcular()` guardado mientras no cambie la versión"""
+        version, valor = self._memo.get(clave, (None, None))
+        if version != self.version:
+            valor = calcular()
+            self._memo[clave] = (self.version, valor)
+        return valor
+
+    def reporte_stock(self):
+        """Niveles de stock por producto, armado desde el resumen (una vez por versión)"""
+        def armar():
+            filas = [
+                (c, r["stock_min"], r["nombre"] or 'Sin nombre', r["total"], r["estado"])
+                for c, r in list(self.resumen.items())
+            ]
+            df = pd.DataFrame(filas, columns=['codigo', 'stock_min', 'nombre', 'stock_total_calc', 'Estado'])
+            df['stock_total_calc'] = df['stock_total_calc'].astype(int)
+            df['stock_min'] = df['stock_min'].astype(int)
+            return df.sort_values(by=['Estado', 'stock_total_calc'])
+        return self.memo("reporte_stock", armar)
+
+    def selector_productos(self):
+        """Códigos ordenados por nombre y sus etiquetas para los selectores (una vez por versión)"""
+        def armar():
+            productos = self.busqueda.ordenados()
+            etiquetas = {c: f"{i+1}) {n} - {m} (Código: {c})" for i, (c, n, m) in enumerate(productos)}
+            return [c for c, _, _ in productos], etiquetas
+        return self.memo("selector_productos", armar)
+
+    def reemplazar(self, inventario, stock_minimo, movimientos):
+        """Reemplaza todo el estado en el lugar, sin romper las referencias existentes"""
+        with self.lock:
+            self.inventario.reemplazar(inventario)
+            self.stock_minimo.clear()
+            self.stock_minimo.update(stock_minimo)
+            self.movimientos.reemplazar(movimientos)
+            self.cargado = True
+            return self.marcar_cambio()
@@ -1,9 +1,23 @@
 import streamlit as st #libreria para la aplicacion web
+from streamlit.runtime.scriptrunner import get_script_run_ctx # para saber si se corre en el hilo de la pagina
 import pandas as pd #libreria para la lectura de los .xlsx
 import gspread #libreria para el acceso a google sheets
 from datetime import datetime, timedelta # libreria para establecer la hora
 import matplotlib.pyplot as plt # libreria para generar los graficos
 import numpy as np # libreria para calculos matematicos avanzados
+import os # libreria para leer la configuracion del entorno
+import time # libreria para medir tiempos
+from almacen import AlmacenInventario # estado compartido entre sesiones
+from conversiones import normalizar_fecha
+from diario import Diario
+from historial import FRECUENCIAS
+from importacion import TAMANO_BLOQUE, exportar, validar_archivo
+from instantanea import InstantaneaDisco, Reconciliador
+from cliente_sheets import CUPO_POR_MINUTO, ClienteSheets
+from metricas import metricas
+from repositorio import ( # backends de almacenamiento (SQLite local y Google Sheets)
+    RepositorioSQLite, RepositorioSheets, EspejoSheets,
+)
 
 st.set_page_config(
     layout="wide", 
@@ -11,6 +25,7 @@ st.set_page_config(
     page_icon="📦",
     initial_sidebar_state="collapsed"
 )
+inicio_ejecucion = time.perf_counter()
 
 st.markdown("""
     <style>
@@ -82,23 +97,24 @@ def check_login():
 if not check_login():
     st.stop()
 
-# --- INICIALIZACIÓN DE ESTADO (SOLUCIÓN 2) ---
-# Inicializamos las variables en session_state para que persistan en memoria
-# y no tengamos que llamar a la API cada vez que se recarga la página.
-if 'inventario' not in st.session_state:
-    st.session_state.inventario = {}
-if 'stock_minimo' not in st.session_state:
-    st.session_state.stock_minimo = {}
-if 'movimientos' not in st.session_state:
-    st.session_state.movimientos = []
-if 'data_loaded' not in st.session_state:
-    st.session_state.data_loaded = False
+# --- INICIALIZACIÓN DE ESTADO ---
+# El inventario se guarda una sola vez por proceso (st.cache_resource) y todas
+# las sesiones leen la misma copia: abrir más terminales no vuelve a cargar
+# ni a duplicar los datos. Cada escritura incrementa almacen.version.
+@st.cache_resource
+def obtener_almacen():
+    """Inventario en memoria compartido por todas las sesiones del servidor"""
+    return AlmacenInventario()
+
+almacen = obtener_almacen()
 
 # Creamos alias locales para facilitar la lectura del código, 
-# pero estos apuntan directamente a la memoria de sesión.
-inventario = st.session_state.inventario
-stock_minimo = st.session_state.stock_minimo
-movimientos = st.session_state.movimientos
+# pero estos apuntan directamente a la memoria compartida.
+# Las escrituras se hacen con almacen.lock. inventario es una TablaInventario:
+# se lee como el dict codigo -> lotes de siempre, pero se modifica con sus métodos.
+inventario = almacen.inventario
+stock_minimo = almacen.stock_minimo
+movimientos = almacen.movimientos
 
 with st.sidebar:
     st.write(f"👤 **{st.session_state.usuario_actual}**")
@@ -106,14 +122,13 @@ with st.sidebar:
     
     # Botón manual para forzar la actualización desde la nube
     if st.button("🔄 Actualizar Datos"):
-        st.session_state.data_loaded = False # Forzará la recarga
+        almacen.cargado = False # Forzará la recarga para todas las sesiones
         st.rerun()
         
     st.divider()
     if st.button("Cerrar Sesión"):
         st.session_state.logged_in = False
         st.session_state.rol = None
-        st.session_state.data_loaded = False
         st.rerun()
 
 st.title("📦 Sistema de Gestión de Inventario B&M")
@@ -121,160 +136,153 @@ st.markdown("---")
 
 GOOGLE_SHEET_ID = "1Zu-Dq6UCYRKMTWNsxj8FsMzzpAdtvl-qb40CVEmwl44"
 
-INVENTARIO_WS = 'inventario'
-STOCK_MINIMO_WS = 'stock_minimo'
-MOVIMIENTOS_WS = 'movimientos'
-
-inventario_headers = ["codigo", "nombre", "marca", "cantidad", "fecha_vencimiento", "precio_costo", "precio_venta"]
-stock_minimo_headers = ['codigo', 'stock_min']
-movimientos_headers = ["timestamp", "tipo", "codigo", "nombre", "cantidad", "fecha_vencimiento", "precio_costo", "precio_venta"]
+# "sqlite" guarda todo en una base local y copia a Sheets en segundo plano;
+# "sheets" lee y escribe directamente en la planilla como antes.
+BACKEND = os.environ.get("INVENTARIO_BACKEND", "sqlite")
+RUTA_SQLITE = os.environ.get("INVENTARIO_DB", "inventario.db")
+# Copia local del historial de la nube: cada recarga solo descarga las filas nuevas
+RUTA_COPIA_MOVIMIENTOS = os.environ.get("INVENTARIO_COPIA_MOVIMIENTOS", "movimientos_nube.csv")
+# Diario local: cada entrada o salida se escribe aquí (con fsync) antes de ir al backend
+RUTA_DIARIO = os.environ.get("INVENTARIO_DIARIO", "inventario_diario.jsonl")
+# Copia comprimida del último estado cargado: al reiniciar se arranca desde ella sin esperar a la red
+RUTA_INSTANTANEA = os.environ.get("INVENTARIO_INSTANTANEA", "inventario_instantanea.npz")
+# Filas por página en las tablas grandes; solo se envía al navegador la página visible
+TAMANO_PAGINA = int(os.environ.get("INVENTARIO_TAMANO_PAGINA", "100"))
 
 @st.cache_resource(ttl=3600)
 def obtener_conexion():
-    """Conecta con Google Sheets usando st.secrets"""
+    """Conecta con Google Sheets usando st.secrets (los errores no se cachean)"""
+    credentials = dict(st.secrets["gcp_service_account"])
+    if "private_key" in credentials:
+        credentials["private_key"] = credentials["private_key"].replace("\\n", "\n")
+    gc = gspread.service_account_from_dict(credentials)
+    sh = gc.open_by_key(GOOGLE_SHEET_ID)
+    # Pestañas recordadas, lecturas compartidas, cupo por minuto y reintentos ante 429;
+    # cada llamada a la API queda contada y medida para el panel de rendimiento.
+    # En el hilo de la página (con contexto de Streamlit) los reintentos esperan poco
+    return ClienteSheets(sh, interactivo=lambda: get_script_run_ctx(suppress_warning=True) is not None)
+
+def sheets_configurado():
     try:
-        credentials = dict(st.secrets["gcp_service_account"])
-        if "private_key" in credentials:
-            credentials["private_key"] = credentials["private_key"].replace("\\n", "\n")
-        gc = gspread.service_account_from_dict(credentials)
-        sh = gc.open_by_key(GOOGLE_SHEET_ID)
-        return sh
-    except Exception as e:
-        st.error(f"Error de conexión: {e}")
-        st.stop()
-
-def check_worksheets(sh):
-    """Asegura que las pestañas existan y tengan headers"""
-    try:
-        titulos_actuales = [ws.title for ws in sh.worksheets()]
-        if INVENTARIO_WS not in titulos_actuales:
-            ws = sh.add_worksheet(title=INVENTARIO_WS, rows=100, cols=10)
-            ws.append_row(inventario_headers)
-        if STOCK_MINIMO_WS not in titulos_actuales:
-            ws = sh.add_worksheet(title=STOCK_MINIMO_WS, rows=100, cols=5)
-            ws.append_row(stock_minimo_headers)
-        if MOVIMIENTOS_WS not in titulos_actuales:
-            ws = sh.add_worksheet(title=MOVIMIENTOS_WS, rows=100, cols=10)
-            ws.append_row(movimientos_headers)
-    except Exception as e:
-        st.error(f"Error verificando pestañas: {e}")
+        return "gcp_service_account" in st.secrets
+    except Exception:
+        return False
 
-def normalizar_fecha(fecha_obj) -> str:
-    if not fecha_obj: return ""
-    try:
-        if isinstance(fecha_obj, str):
-            fecha_obj = fecha_obj.strip()
-            if ' ' in fecha_obj: fecha_obj = fecha_obj.split(' ')[0]
-            if 'T' in fecha_obj: fecha_obj = fecha_obj.split('T')[0]
-            return fecha_obj
-        if hasattr(fecha_obj, 'strftime'):
-            return fecha_obj.strftime("%Y-%m-%d")
-        return str(fecha_obj).split(' ')[0]
-    except: return ""
-
-def _convertir_a_numero(valor, por_defecto=0):
-    if valor is None or valor == '': return por_defecto
-    try: return int(valor)
-    except (ValueError, TypeError):
-        try: return float(valor)
-        except (ValueError, TypeError): return por_defecto
+def espejo_configurado():
+    """True si la base local se copia a una planilla (sin crear el espejo ni arrancar su hilo)"""
+    return BACKEND != "sheets" and sheets_configurado()
+
+@st.cache_resource
+def obtener_repositorio_sheets():
+    """Acceso directo a las pestañas de Google Sheets, compartido por el servidor"""
+    return RepositorioSheets(obtener_conexion, avisar=st.error, ruta_copia_movimientos=RUTA_COPIA_MOVIMIENTOS)
+
+@st.cache_resource
+def obtener_repositorio():
+    """Almacenamiento principal según INVENTARIO_BACKEND"""
+    if BACKEND == "sheets":
+        return obtener_repositorio_sheets()
+    return RepositorioSQLite(RUTA_SQLITE)
+
+@st.cache_resource
+def _crear_espejo():
+    return EspejoSheets(obtener_repositorio(), obtener_repositorio_sheets())
+
+def obtener_espejo():
+    """Hilo que copia la base local a Sheets; None si no hay planilla configurada.
+
+    Tampoco se crea antes de que la carga desde el backend termine (con la
+    importación inicial de la planilla): su primera exportación compararía
+    una base todavía vacía con la planilla y borraría sus filas.
+    """
+    if not espejo_configurado() or not almacen.cargado or not obtener_reconciliador().al_dia:
+        return None
+    return _crear_espejo()
+
+@st.cache_resource
+def obtener_diario():
+    return Diario(RUTA_DIARIO)
 
 def stock_total(codigo: str) -> int:
-    # Lee directamente de la memoria local, no consume cuota API
-    return sum(l["cantidad"] for l in inventario.get(codigo, []))
-
-def ordenar_lotes_fifo(lotes):
-    def clave(l):
-        fv = l.get("fecha_vencimiento", "")
-        if not fv: return (datetime.max, 1)
-        try: return (datetime.fromisoformat(fv), 0)
-        except Exception: return (datetime.max, 1)
-    return sorted(lotes, key=clave)
-
-def _escribir_sheet(ws_name, headers, datos):
-    """Sobreescribe una pestaña completa con nuevos datos"""
+    # Lee el total ya calculado en el resumen por producto, no recorre los lotes
+    return almacen.stock_total(codigo)
+
+def leer_backend():
+    """Lee todo del almacenamiento principal, sin tocar la memoria compartida"""
+    repo = obtener_repositorio()
+    if isinstance(repo, RepositorioSQLite) and espejo_configurado() and repo.esta_vacio():
+        # Primera ejecución con base local: se importa lo que ya hay en la nube. El espejo
+        # se crea recién después: exportar una base vacía borraría la planilla
+        repo.importar(*obtener_repositorio_sheets().cargar())
+    return repo.cargar()
+
+def aplicar_backend(datos):
+    """Reemplaza la memoria compartida con lo leído y reaplica el diario (con almacen.lock)"""
+    almacen.reemplazar(*datos)
+    reproducir_diario()
+
+@st.cache_resource
+def obtener_reconciliador():
+    """Instantánea en disco y el hilo que la pone al día con el backend"""
+    origen = f"sheets:{GOOGLE_SHEET_ID}" if BACKEND == "sheets" else f"sqlite:{os.path.abspath(RUTA_SQLITE)}"
+    # El hilo usa el repositorio y el diario: se crean acá, desde la sesión (el espejo no,
+    # porque en la primera ejecución tiene que esperar a que se importe la planilla)
+    obtener_repositorio(), obtener_diario()
+    return Reconciliador(almacen, InstantaneaDisco(RUTA_INSTANTANEA, origen), leer_backend, aplicar_backend)
+
+def cargar_todo():
+    """Carga datos del almacenamiento principal a la memoria compartida del servidor."""
     try:
-        sh = obtener_conexion()
-        ws = sh.worksheet(ws_name)
-        ws.clear()
-        ws.append_row(headers)
-        if datos:
-            datos_limpios = []
-            for fila in datos:
-                fila_expandida = list(fila) + ["" for _ in range(len(headers) - len(fila))]
-                fila_str = [str(celda) if celda is not None else "" for celda in fila_expandida[:len(headers)]]
-                datos_limpios.append(fila_str)
-            ws.append_rows(datos_limpios, value_input_option='USER_ENTERED')
+        with metricas.medir("cargar_todo"):
+            aplicar_backend(leer_backend())
+        obtener_reconciliador().cargado()
+        # Con la base local ya importada y cargada el espejo puede arrancar
+        _avisar_espejo()
     except Exception as e:
-        st.error(f"Error guardando en {ws_name}: {e}")
-
-def cargar_todo_desde_nube():
-    """Carga datos desde Sheets a memoria session_state."""
-    # Limpiamos los diccionarios en memoria antes de rellenar
-    st.session_state.inventario.clear()
-    st.session_state.stock_minimo.clear()
-    del st.session_state.movimientos[:] # Limpieza de lista
-    
-    sh = obtener_conexion()
-    check_worksheets(sh)
-    
-    try:
-        ws_inv = sh.worksheet(INVENTARIO_WS)
-        vals_inv = ws_inv.get_all_values()
-        if len(vals_inv) > 1:
-            for fila in vals_inv[1:]: # Saltar header
-                fila += [""] * (len(inventario_headers) - len(fila))
-                codigo, nombre, marca, cant, fv, pc, pv = fila[:len(inventario_headers)]
-                
-                if not codigo: continue
-                
-                lote = {
-                    'nombre': nombre,
-                    'marca': marca,
-                    'cantidad': _convertir_a_numero(cant),
-                    'fecha_vencimiento': normalizar_fecha(fv),
-                    'precio_costo': _convertir_a_numero(pc),
-                    'precio_venta': _convertir_a_numero(pv)
-                }
-                
-                if codigo not in st.session_state.inventario: 
-                    st.session_state.inventario[codigo] = []
-                st.session_state.inventario[codigo].append(lote)
-    except Exception as e: st.error(f"Error leyendo inventario: {e}")
-
+        # Sin conexión: si hay datos (en memoria o en disco) se siguen mostrando en solo lectura
+        if almacen.version or obtener_reconciliador().arrancar_desde_disco():
+            obtener_reconciliador().sin_conexion(e)
+        else:
+            st.error(f"Error de conexión: {e}")
+            st.stop()
+
+def _avisar_espejo():
+    espejo = obtener_espejo()
+    if espejo is not None:
+        espejo.notificar()
+
+def guardar_inventario(codigos=None):
+    # Guarda una foto de la memoria compartida; codigos limita a los productos tocados.
+    # La foto se toma con almacen.lock (sin red) y se escribe fuera de él; lock_guardado
+    # hace que los guardados lleguen al backend en el mismo orden que las fotos.
+    repo = obtener_repositorio()
     try:
-        ws_min = sh.worksheet(STOCK_MINIMO_WS)
-        vals_min = ws_min.get_all_values()
-        if len(vals_min) > 1:
-            for fila in vals_min[1:]:
-                if fila and fila[0]:
-                    st.session_state.stock_minimo[fila[0]] = _convertir_a_numero(fila[1] if len(fila)>1 else 0)
-    except Exception as e: st.error(f"Error leyendo stock minimo: {e}")
+        with almacen.lock_guardado, metricas.medir("guardar_inventario"):
+            foto = almacen.instantanea(None if codigos is None or repo.guarda_completo else codigos)
+            repo.guardar_inventario(foto, codigos)
+        ok = True
+    except Exception as e:
+        st.error(f"Error guardando inventario: {e}")
+        ok = False
+    _avisar_espejo()
+    return ok
 
+def guardar_stock_minimo(codigos=None):
+    repo = obtener_repositorio()
     try:
-        ws_mov = sh.worksheet(MOVIMIENTOS_WS)
-        vals_mov = ws_mov.get_all_values()
-        if len(vals_mov) > 1:
-            for fila in vals_mov[1:]:
-                st.session_state.movimientos.append(fila[:len(movimientos_headers)])
-    except Exception as e: st.error(f"Error leyendo movimientos: {e}")
-    
-    st.session_state.data_loaded = True
-    
-def guardar_inventario():
-    # Guarda lo que está en memoria (session_state) a la nube
-    filas = []
-    for codigo, lotes in inventario.items():
-        for d in lotes:
-            filas.append([
-                codigo, d.get('nombre',""), d.get('marca',""), d.get('cantidad',0),
-                d.get('fecha_vencimiento',""), d.get('precio_costo',0), d.get('precio_venta',0)
-            ])
-    _escribir_sheet(INVENTARIO_WS, inventario_headers, filas)
-
-def guardar_stock_minimo():
-    filas = [[k, v] for k, v in stock_minimo.items()]
-    _escribir_sheet(STOCK_MINIMO_WS, stock_minimo_headers, filas)
+        with almacen.lock_guardado, metricas.medir("guardar_stock_minimo"):
+            with almacen.lock:
+                if codigos is None or repo.guarda_completo:
+                    foto = dict(stock_minimo)
+                else:
+                    foto = {c: stock_minimo[c] for c in codigos if c in stock_minimo}
+            repo.guardar_stock_minimo(foto, codigos)
+        ok = True
+    except Exception as e:
+        st.error(f"Error guardando stock minimo: {e}")
+        ok = False
+    _avisar_espejo()
+    return ok
 
 def registrar_movimiento(tipo, codigo, nombre, cantidad, fecha_vencimiento, precio_costo, precio_venta):
     nueva_fila = [
@@ -287,32 +295,271 @@ def registrar_movimiento(tipo, codigo, nombre, cantidad, fecha_vencimiento, prec
         precio_costo if precio_costo is not None else 0,
         precio_venta if precio_venta is not None else 0,
     ]
+    # Se encola en el repositorio; la escritura real se hace en vaciar_movimientos()
+    movimientos.append(nueva_fila)
     try:
-        sh = obtener_conexion()
-        ws = sh.worksheet(MOVIMIENTOS_WS)
-        fila_str = [str(x) for x in nueva_fila]
-        ws.append_row(fila_str)
-        # También actualizamos la memoria local
-        st.session_state.movimientos.append(nueva_fila) 
+        obtener_repositorio().agregar_movimiento(nueva_fila)
     except Exception as e:
-        st.error(f"Error registrando movimiento: {e}")
-        
+        st.error(f"Error registrando movimiento (se reintentará): {e}")
+    return nueva_fila
+
+def vaciar_movimientos():
+    """Persiste en una sola operación todos los movimientos encolados"""
+    repo = obtener_repositorio()
+    try:
+        with metricas.medir("vaciar_movimientos"):
+            repo.vaciar_movimientos()
+        ok = True
+    except Exception as e:
+        st.error(f"Error registrando movimientos ({len(repo.movimientos_pendientes())} pendientes, se reintentará): {e}")
+        ok = False
+    _avisar_espejo()
+    return ok
+
+def persistir(codigos):
+    """Guarda en el backend los productos tocados y los movimientos encolados; True si todo salió bien"""
+    # Aproximado: incluye las llamadas que el espejo haga al mismo tiempo
+    llamadas = metricas.total("sheets.llamadas")
+    with metricas.medir("persistir"):
+        ok_inventario = guardar_inventario(codigos)
+        ok_minimo = guardar_stock_minimo(codigos)
+        ok_movimientos = vaciar_movimientos()
+    metricas.registrar("llamadas a Sheets por guardado", metricas.total("sheets.llamadas") - llamadas)
+    return ok_movimientos and ok_inventario and ok_minimo
+
+def anotar_operacion(tipo, codigos, filas):
+    """Escribe en el diario el estado final de los productos tocados y sus movimientos.
+
+    Guardar el estado (y no la diferencia) permite reaplicar la operación sin
+    contarla dos veces. Devuelve el número de secuencia, o None si falló.
+    """
+    try:
+        return obtener_diario().registrar(
+            tipo=tipo,
+            lotes={c: [{k: v for k, v in l.items() if k != 'vence'} for l in inventario.get(c, [])] for c in codigos},
+            stock_minimo={c: stock_minimo[c] for c in codigos if c in stock_minimo},
+            movimientos=filas,
+        )
+    except OSError as e:
+        st.error(f"No se pudo escribir el diario local: {e}")
+        return None
+
+def confirmar_operacion(seq, codigos):
+    if persistir(codigos) and seq is not None:
+        obtener_diario().confirmar(seq)
+
+def movimiento_guardado(fila):
+    """True si el backend ya tiene este movimiento (mismo segundo, código, tipo, cantidad y lote)"""
+    ts = pd.to_datetime(fila[0], errors="coerce")
+    if pd.isna(ts):
+        return False
+    df = movimientos.consultar(desde=ts, hasta=ts + pd.Timedelta(seconds=1), codigo=str(fila[2]), tipo=fila[1])
+    return bool(((df["cantidad"] == float(fila[4])) & (df["fecha_vencimiento"] == str(fila[5] or ""))).any())
+
+def reproducir_diario():
+    """Reaplica sobre lo recién cargado las operaciones del diario que el backend no confirmó.
+
+    Las pendientes ya no traen los productos que una operación posterior dejó
+    guardados (el diario se los quita al confirmarla), así que reaplicarlas
+    en orden no pisa un estado más nuevo.
+    """
+    pendientes = obtener_diario().pendientes()
+    if not pendientes:
+        return
+    repo = obtener_repositorio()
+    codigos = set()
+    for evento in pendientes:
+        for codigo, lotes in evento["lotes"].items():
+            inventario.fijar_lotes(codigo, lotes)
+            codigos.add(codigo)
+        stock_minimo.update(evento["stock_minimo"])
+        filas = evento["movimientos"]
+        # Los movimientos de una operación se guardan juntos: si está el primero, están todos
+        if filas and not movimiento_guardado(filas[0]):
+            movimientos.extend(filas)
+            for fila in filas:
+                repo.agregar_movimiento(fila)
+    almacen.marcar_cambio(codigos)
+    reintentar_diario()
+
+def reintentar_diario():
+    """Vuelve a guardar desde memoria los productos de las operaciones sin confirmar"""
+    # Si otra terminal está guardando, lo pendiente probablemente es suyo: se deja para después
+    # Devuelve si se pudo guardar, o None si no se intentó
+    if not almacen.lock_guardado.acquire(blocking=False):
+        return None
+    try:
+        pendientes = obtener_diario().pendientes()
+        codigos = sorted({c for evento in pendientes for c in evento["lotes"]})
+        if not pendientes:
+            return True
+        ok = persistir(codigos)
+        if ok:
+            for evento in pendientes:
+                obtener_diario().confirmar(evento["seq"])
+        return ok
+    finally:
+        almacen.lock_guardado.release()
+
+def importar_lotes(lotes):
+    """Aplica lotes ya validados con la regla del formulario y los guarda en un solo commit"""
+    with almacen.lock:
+        filas = []
+        for l in lotes.itertuples(index=False):
+            existente = inventario[l.codigo][0] if l.codigo in inventario else None
+            # Igual que en el formulario, un producto existente conserva nombre, marca y precios
+            precio_costo = (existente['precio_costo'] if existente and not l.precio_costo else l.precio_costo)
+            precio_venta = (existente['precio_venta'] if existente and not l.precio_venta else l.precio_venta)
+            precio_costo = int(precio_costo) if float(precio_costo).is_integer() else float(precio_costo)
+            precio_venta = int(precio_venta) if float(precio_venta).is_integer() else float(precio_venta)
+            inventario.agregar_lote(l.codigo, {
+                'nombre': l.nombre, 'marca': l.marca, 'cantidad': int(l.cantidad),
+                'fecha_vencimiento': l.fecha_vencimiento, 'precio_costo': precio_costo, 'precio_venta': precio_venta
+            })
+            if not pd.isna(l.stock_min):
+                stock_minimo[l.codigo] = int(l.stock_min)
+            elif existente is None and l.codigo not in stock_minimo:
+                stock_minimo[l.codigo] = 0
+            nombre = inventario[l.codigo][0]['nombre']
+            filas.append(registrar_movimiento("entrada", l.codigo, nombre, int(l.cantidad), l.fecha_vencimiento, precio_costo, precio_venta))
+        codigos = list(dict.fromkeys(lotes["codigo"]))
+        almacen.marcar_cambio(codigos)
+        seq = anotar_operacion("importacion", codigos, filas)
+    confirmar_operacion(seq, codigos)
+    return len(filas)
+
+def bloques_inventario():
+    # Foto del inventario tomada de una vez (los arreglos son compactos) y escrita por bloques
+    with almacen.lock:
+        df = inventario.dataframe().copy()
+    df['fecha_vencimiento'] = df['fecha_vencimiento'].dt.strftime('%Y-%m-%d').fillna('')
+    for inicio in range(0, len(df), TAMANO_BLOQUE):
+        yield df.iloc[inicio:inicio + TAMANO_BLOQUE]
+
+def bloques_movimientos():
+    # Un mes por vez, con el timestamp en el mismo formato que se guarda
+    for df in movimientos.por_mes():
+        yield df.assign(timestamp=df['timestamp'].dt.strftime('%Y-%m-%dT%H:%M:%S'))
+
+def botones_exportar(nombre, bloques):
+    """Botones de descarga CSV y XLSX; el archivo se arma recién al hacer clic"""
+    c_csv, c_xlsx = st.columns(2)
+    with c_csv:
+        st.download_button("⬇️ Exportar CSV", data=lambda: exportar(bloques()), file_name=f"{nombre}.csv",
+                           mime="text/csv", on_click="ignore", key=f"exportar_{nombre}_csv")
+    with c_xlsx:
+        st.download_button("⬇️ Exportar XLSX", data=lambda: exportar(bloques(), "xlsx", nombre), file_name=f"{nombre}.xlsx",
+                           mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                           on_click="ignore", key=f"exportar_{nombre}_xlsx")
+
+def memo_sesion(nombre, parametros, calcular):
+    """Último resultado de `calcular()` en esta sesión; se recalcula si cambian
+    los parámetros o almacen.version"""
+    clave = (almacen.version, parametros)
+    guardado = st.session_state.get(nombre)
+    if guardado is None or guardado[0] != clave:
+        guardado = (clave, calcular())
+        st.session_state[nombre] = guardado
+    return guardado[1]
+
+def paginar(total, clave):
+    """Controles de tamaño y número de página; devuelve (inicio, fin) de las filas a mostrar"""
+    c_tam, c_pag, c_info = st.columns([1, 1, 2])
+    with c_tam:
+        opciones = sorted({25, 50, 100, 250, 500, TAMANO_PAGINA})
+        tamano = st.selectbox("Filas por página", opciones, index=opciones.index(TAMANO_PAGINA), key=f"{clave}_tamano")
+    paginas = max(1, -(-total // tamano))
+    # Si el filtro achicó el resultado, se vuelve a la primera página
+    if st.session_state.get(f"{clave}_pagina", 1) > paginas:
+        st.session_state[f"{clave}_pagina"] = 1
+    with c_pag:
+        pagina = st.number_input("Página", min_value=1, max_value=paginas, step=1, key=f"{clave}_pagina")
+    inicio = (pagina - 1) * tamano
+    fin = min(inicio + tamano, total)
+    with c_info:
+        st.caption(f"Mostrando {inicio + 1 if total else 0}-{fin} de {total} (página {pagina} de {paginas})")
+    return inicio, fin
+
+
 # --- LÓGICA DE CARGA ÚNICA ---
-if not st.session_state.data_loaded:
-    with st.spinner("Cargando base de datos desde la nube..."):
-        cargar_todo_desde_nube()
+if not almacen.cargado:
+    with almacen.lock:
+        # Otra sesión pudo haber cargado mientras esperábamos el lock
+        if not almacen.cargado:
+            # Al arrancar el proceso se usa la copia en disco y el backend se lee en segundo plano
+            if not obtener_reconciliador().arrancar_desde_disco():
+                with st.spinner("Cargando base de datos..."):
+                    cargar_todo()
+elif obtener_reconciliador().al_dia and almacen.puede_reintentar():
+    # Sin conexión los reintentos de guardado esperan a que el backend vuelva; si
+    # fallan, el próximo rerun (de cualquier sesión) espera cada vez más antes de reintentar
+    ok = None
+    if obtener_diario().pendientes():
+        ok = reintentar_diario()
+    elif obtener_repositorio().movimientos_pendientes():
+        ok = vaciar_movimientos()
+    if ok is not None:
+        almacen.anotar_reintento(ok)
+
+# Mientras la memoria no coincida con el backend no se registran entradas ni salidas
+solo_lectura = not obtener_reconciliador().al_dia
+if solo_lectura:
+    @st.fragment(run_every=5)
+    def aviso_solo_lectura():
+        reconciliador = obtener_reconciliador()
+        if reconciliador.al_dia:
+            st.rerun()
+        guardado = f" (copia del {reconciliador.sello['guardado'].replace('T', ' ')})" if reconciliador.sello else ""
+        if reconciliador.ultimo_error:
+            st.warning(f"📴 Sin conexión con el almacenamiento: se muestran los datos guardados en este equipo{guardado}. "
+                       f"Entradas y salidas quedan deshabilitadas hasta reconectar (intento {reconciliador.intentos}): "
+                       f"{reconciliador.ultimo_error}")
+        else:
+            st.info(f"🔄 Sincronizando con el almacenamiento; mientras tanto se muestran los datos guardados en este equipo{guardado}.")
+    aviso_solo_lectura()
+
+# Estado de la copia en segundo plano a la nube
+if obtener_espejo() is not None:
+    with st.sidebar:
+        pendientes = obtener_espejo().pendientes()
+        st.caption(f"☁️ {pendientes} cambios pendientes de sincronizar" if pendientes else "☁️ Sincronizado con la nube")
+        if obtener_espejo().ultimo_error:
+            st.caption(f"⚠️ Reintento {obtener_espejo().intentos}: {obtener_espejo().ultimo_error}")
+
+# Panel de rendimiento: tiempos por operación y uso de la API de Sheets en este proceso
+if st.session_state.rol == "administrador":
+    with st.sidebar.expander("⏱️ Rendimiento"):
+        st.caption(f"Sheets en el último minuto: {metricas.ultimo_minuto('sheets.lecturas')}/{CUPO_POR_MINUTO} lecturas, "
+                   f"{metricas.ultimo_minuto('sheets.escrituras')}/{CUPO_POR_MINUTO} escrituras")
+        contadores = metricas.contadores()
+        if contadores:
+            st.caption(f"Desde las {metricas.desde:%H:%M:%S}")
+            st.dataframe(pd.Series(contadores, name="total").sort_index(), use_container_width=True)
+        resumen = metricas.resumen()
+        if resumen:
+            st.dataframe(pd.DataFrame(resumen), hide_index=True, use_container_width=True)
+            metrica = st.selectbox("Histograma", [r["metrica"] for r in resumen], key="metrica_histograma")
+            conteos, bordes = np.histogram(metricas.valores(metrica), bins=20)
+            st.bar_chart(pd.Series(conteos, index=np.round(bordes[:-1], 2)))
+        st.download_button("⬇️ Exportar JSONL", data=metricas.exportar_jsonl, file_name="metricas.jsonl",
+                           mime="application/jsonl", on_click="ignore")
+        if st.button("Reiniciar métricas"):
+            metricas.reiniciar()
+            st.rerun()
 
 tab1, tab2, tab3, tab4, tab5, tab6 = None, None, None, None, None, None
 
 if st.session_state.rol == "administrador":
+    # Con on_change="rerun" cada pestaña sabe si está abierta (.open) y las
+    # pestañas de reportes solo se arman cuando se las mira
     tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
         "📥 Entrada", "📤 Salida", "📋 Inventario", 
         "📊 Historial", "📉 Stock Mínimo", "⏰ Vencimientos"
-    ])
+    ], key="pestana", on_change="rerun")
 else:
     tab1, tab2 = st.tabs(["📥 Entrada", "📤 Salida"])
 
-with tab1:
+with tab1, metricas.medir("pestaña.entrada"):
     st.subheader("📥 Registro de Entradas")
     
     if 'reset_counter' not in st.session_state:
@@ -328,28 +575,16 @@ with tab1:
     
     if entrada:
         if entrada.lower() == 'buscar':
-            productos_lista = []
-            for codigo, lotes in inventario.items():
-                if lotes:
-                    base = lotes[0]
-                    nombre = base.get('nombre') or 'N/A'
-                    marca = base.get('marca') or 'N/A'
-                    productos_lista.append((codigo, nombre, marca))
-                
-            productos_lista.sort(key=lambda x: x[1])
-
-            opciones = [f"{i+1}) {nombre} - {marca} (Código: {codigo})" 
-                                            for i, (codigo, nombre, marca) in enumerate(productos_lista)]
-            
-            opciones.insert(0, "Cancelar")
-            seleccion = st.selectbox("Seleccione un producto", opciones)
+            # Lista ya ordenada por el índice de búsqueda; la opción es el código mismo
+            codigos, etiquetas = almacen.selector_productos()
+            seleccion = st.selectbox("Seleccione un producto", ["Cancelar", *codigos],
+                                     format_func=lambda c: etiquetas.get(c, c))
 
             if seleccion == 'Cancelar':
                 codigo_seleccionado = None
             else:
-                idx = opciones.index(seleccion) - 1
-                codigo_seleccionado = productos_lista[idx][0]
-                st.success(f"✅ Seleccionado: {productos_lista[idx][1]}")
+                codigo_seleccionado = seleccion
+                st.success(f"✅ Seleccionado: {almacen.resumen.get(seleccion, {}).get('nombre') or 'N/A'}")
         else:
             codigo_seleccionado = entrada
 
@@ -394,49 +629,76 @@ with tab1:
                 fecha_vencimiento = st.date_input("Fecha Vencimiento", value = datetime.now().date())
 
             st.markdown("<br>", unsafe_allow_html=True)
-            submitted = st.form_submit_button("💾 Guardar Entrada", type="primary")
+            submitted = st.form_submit_button("💾 Guardar Entrada", type="primary", disabled=solo_lectura)
 
             if submitted:
-                fv = normalizar_fecha(fecha_vencimiento) if aplica_vencimiento else ""
-
-                if es_nuevo:
-                    lote = {
-                        'nombre': nombre, 'marca': marca, 'cantidad': cantidad,
-                        'fecha_vencimiento': fv, 'precio_costo': precio_costo, 'precio_venta': precio_venta
-                    }
-                    # Actualiza memoria local inmediatamente
-                    inventario[codigo_seleccionado] = [lote]
-                    stock_minimo[codigo_seleccionado] = cant_min
-                    mensaje = f'Producto {nombre} creado con éxito'
-                else:
-                    lotes = inventario[codigo_seleccionado]
-                    lote_existente = next((l for l in lotes if l.get("fecha_vencimiento", "") == fv), None)
+                with almacen.lock:
+                    fv = normalizar_fecha(fecha_vencimiento) if aplica_vencimiento else ""
 
-                    if lote_existente:
-                        lote_existente['cantidad'] += cantidad
-                        mensaje = f"Se agregaron {cantidad} unidades al lote existente ({fv})"
-                    else:
-                        lotes.append({
+                    if es_nuevo and codigo_seleccionado not in inventario: # Otra terminal pudo crearlo
+                        lote = {
                             'nombre': nombre, 'marca': marca, 'cantidad': cantidad,
                             'fecha_vencimiento': fv, 'precio_costo': precio_costo, 'precio_venta': precio_venta
-                        })
+                        }
+                        # Actualiza memoria local inmediatamente
+                        inventario.agregar_lote(codigo_seleccionado, lote)
                         stock_minimo[codigo_seleccionado] = cant_min
-                        mensaje = f"Se creó un nuevo lote con {cantidad} unidades ({fv})"
+                        mensaje = f'Producto {nombre} creado con éxito'
+                    else:
+                        # Se suma al lote con el mismo vencimiento o se inserta en su lugar FIFO
+                        if inventario.agregar_lote(codigo_seleccionado, {
+                            'nombre': nombre, 'marca': marca, 'cantidad': cantidad,
+                            'fecha_vencimiento': fv, 'precio_costo': precio_costo, 'precio_venta': precio_venta
+                        }):
+                            mensaje = f"Se agregaron {cantidad} unidades al lote existente ({fv})"
+                        else:
+                            stock_minimo[codigo_seleccionado] = cant_min
+                            mensaje = f"Se creó un nuevo lote con {cantidad} unidades ({fv})"
 
-                # Sincroniza con la nube (Escritura)
-                guardar_inventario()
-                guardar_stock_minimo()
-                registrar_movimiento("entrada", codigo_seleccionado, nombre, cantidad, fv, precio_costo, precio_venta)
+                    fila = registrar_movimiento("entrada", codigo_seleccionado, nombre, cantidad, fv, precio_costo, precio_venta)
+                    almacen.marcar_cambio([codigo_seleccionado])
+
+                    # Primero al diario local (con fsync); el backend se escribe fuera del lock
+                    seq = anotar_operacion("entrada", [codigo_seleccionado], [fila])
+                confirmar_operacion(seq, [codigo_seleccionado])
                 st.success(mensaje) 
                 st.session_state.reset_counter += 1
                 st.rerun()
 
-with tab2:
+    if st.session_state.rol == "administrador":
+        st.markdown("---")
+        with st.expander("📦 Importación masiva (CSV / XLSX)"):
+            st.caption("Columnas: codigo, nombre, marca, cantidad, fecha_vencimiento (AAAA-MM-DD), precio_costo, "
+                       "precio_venta y, opcional, stock_min. Los lotes con el mismo código y vencimiento se suman.")
+            archivo = st.file_uploader("Planilla del proveedor", type=["csv", "xlsx"], key="archivo_importacion")
+            if archivo is None:
+                st.session_state.pop("importacion", None)
+            elif st.button("🔎 Validar archivo"):
+                try:
+                    # Se lee por bloques: el archivo nunca se carga entero como filas de Python
+                    st.session_state.importacion = validar_archivo(archivo, archivo.name)
+                except Exception as e:
+                    st.error(f"No se pudo leer el archivo: {e}")
+
+            if archivo is not None and "importacion" in st.session_state:
+                lotes_validos, errores = st.session_state.importacion
+                st.write(f"✅ {len(lotes_validos)} lotes válidos | ❌ {len(errores)} errores")
+                if errores:
+                    st.dataframe(pd.DataFrame(errores[:500], columns=["Fila", "Motivo"]), hide_index=True)
+                if len(lotes_validos) and st.button(f"💾 Importar {len(lotes_validos)} lotes", type="primary", disabled=solo_lectura):
+                    importados = importar_lotes(lotes_validos)
+                    del st.session_state.importacion
+                    st.success(f"Se importaron {importados} lotes")
+
+with tab2, metricas.medir("pestaña.salida"):
     st.subheader("📤 Registro de Salidas")
     
     if "lista" not in st.session_state:
         st.session_state.lista = {}
     
+    if "versiones_lista" not in st.session_state:
+        st.session_state.versiones_lista = {}
+
     if "producto_pendiente_salida" not in st.session_state:
         st.session_state.producto_pendiente_salida = None
 
@@ -453,157 +715,215 @@ with tab2:
 
         st.session_state.producto_pendiente_salida = codigo
 
-    st.text_input("🔢 Escanee código para agregar a salida:", 
-                  key="input_salida_codigo", 
-                  on_change=procesar_codigo_escaneado)
+    def mostrar_carrito():
+        c_lista, c_resumen = st.columns([2, 1])
+    
+        with c_lista:
+            st.markdown("### 🛒 Carrito de Salida")
+            if not st.session_state.lista:
+                st.info("El carrito está vacío.")
+            else:
+                eliminar = []
+                for codigo, cant_lista in st.session_state.lista.items():
+                    if codigo in inventario:
+                        # Nombre y marca salen del resumen, sin armar los lotes
+                        nombre = almacen.resumen[codigo]['nombre']
+                        marca = almacen.resumen[codigo]['marca']
+                        col_det, col_btn = st.columns([0.8, 0.2])
+                        with col_det:
+                            st.markdown(f"**{nombre}** ({marca}): `{cant_lista}` un.")
+                        with col_btn:
+                            if st.button("🗑️", key=f"del_{codigo}", help="Eliminar del carro"):
+                                eliminar.append(codigo)
+            
+                if eliminar:
+                    for cod in eliminar:
+                        del st.session_state.lista[cod]
+                        st.session_state.versiones_lista.pop(cod, None)
+                    st.rerun()
+    
+        with c_resumen:
+            if st.session_state.lista:
+                total_items = sum(st.session_state.lista.values())
+                st.metric("Total Items", total_items)
+            
+                if st.button("🚀 Confirmar Salida", type="primary", disabled=solo_lectura):
+                    lista = st.session_state.lista
+                    versiones = st.session_state.versiones_lista
+                    faltantes = {}
+                    # Bloqueo breve: validar, aplicar en memoria y anotar en el diario (sin red)
+                    with almacen.lock:
+                        # Solo se releen los productos que otra terminal modificó desde que se agregaron
+                        for c in almacen.cambiados({c: versiones.get(c) for c in lista}):
+                            disponible = almacen.stock_total(c)
+                            if lista[c] > disponible:
+                                faltantes[c] = disponible
+
+                        if not faltantes:
+                            filas = []
+                            for codigo_prod, cantidad_sacar in lista.items():
+                                if codigo_prod not in inventario: continue
+
+                                nombre_prod = inventario[codigo_prod][0]['nombre']
+
+                                # Los lotes ya están en orden FIFO: se consumen desde el frente
+                                for l, toma in almacen.consumir_fifo(codigo_prod, cantidad_sacar):
+                                    filas.append(registrar_movimiento("salida", codigo_prod, nombre_prod, toma, l.get('fecha_vencimiento',''), l.get('precio_costo'), l.get('precio_venta')))
+                            codigos = list(lista)
+                            almacen.marcar_cambio(codigos)
+                            seq = anotar_operacion("salida", codigos, filas)
+
+                    if faltantes:
+                        # Conflicto: se ajusta el carrito al stock actual y el cajero vuelve a confirmar
+                        for c, disponible in faltantes.items():
+                            if disponible > 0:
+                                lista[c] = disponible
+                                versiones[c] = almacen.version_producto(c)
+                            else:
+                                del lista[c]
+                                versiones.pop(c, None)
+                            st.toast(f"⚠️ Otra terminal vendió stock de {c}: quedan {disponible}. Revise el carrito y confirme de nuevo.")
+                        st.rerun()
 
-    if st.session_state.producto_pendiente_salida:
-        cod_pend = st.session_state.producto_pendiente_salida
-        
-        if cod_pend in inventario:
-            lotes = inventario[cod_pend]
-            nombre_prod = lotes[0]['nombre']
-            marca_prod = lotes[0]['marca']
-            stock_disp_total = stock_total(cod_pend)
-            en_lista = st.session_state.lista.get(cod_pend, 0)
-            stock_real_disp = stock_disp_total - en_lista
-
-            st.info(f"🛒 Seleccionando cantidad para: **{nombre_prod}** ({marca_prod})")
-            st.write(f"Stock total: {stock_disp_total} | En carrito: {en_lista} | **Disponible: {stock_real_disp}**")
-
-            if stock_real_disp <= 0:
-                st.error("⚠️ Sin stock disponible para agregar más.")
-                if st.button("Cancelar selección"):
-                    st.session_state.producto_pendiente_salida = None
+                    # Al backend van todos los movimientos del carrito en una sola llamada, fuera del lock
+                    confirmar_operacion(seq, codigos)
+                    st.session_state.lista = {}
+                    st.session_state.versiones_lista = {}
+                    st.session_state.pop("ultimo_escaneo", None)
+                    st.success("Salidas registradas correctamente!")
                     st.rerun()
-            else:
-                with st.form("form_cantidad_salida"):
-                    col_cant, col_btn = st.columns([1,1])
-                    with col_cant:
-                        cantidad_selec = st.number_input("Cantidad:", min_value=1, max_value=int(stock_real_disp), value=1, step=1)
-                    with col_btn:
-                        st.markdown("<br>", unsafe_allow_html=True)
-                        b_agregar = st.form_submit_button("➕ Agregar al Carrito", type="primary")
-                        b_cancelar = st.form_submit_button("❌ Cancelar")
-
-                    if b_agregar:
-                        if cod_pend in st.session_state.lista:
-                            st.session_state.lista[cod_pend] += cantidad_selec
-                        else:
-                            st.session_state.lista[cod_pend] = cantidad_selec
-                        
-                        st.toast(f"✅ Agregado: {cantidad_selec} de {nombre_prod}")
+
+    def sumar_escaneo():
+        codigo = st.session_state.input_escaneo_rapido.strip()
+        st.session_state.input_escaneo_rapido = ""
+        if not codigo: return
+        lista = st.session_state.lista
+        # El resumen ya tiene el stock por producto: no se recorren lotes ni se toma el lock
+        item = almacen.resumen.get(codigo)
+        if item is None or codigo not in inventario:
+            st.session_state.ultimo_escaneo = ("error", f"❌ El código {codigo} no existe")
+        elif lista.get(codigo, 0) + 1 > item['total']:
+            st.session_state.ultimo_escaneo = ("error", f"⚠️ Sin stock de {item['nombre']}: hay {item['total']} y ya están en el carrito")
+        else:
+            # Lecturas repetidas del mismo código se suman en una sola línea del carrito
+            lista[codigo] = lista.get(codigo, 0) + 1
+            st.session_state.versiones_lista[codigo] = almacen.version_producto(codigo)
+            st.session_state.ultimo_escaneo = ("ok", f"✅ {item['nombre']} ({item['marca']}) × {lista[codigo]}")
+
+    @st.fragment
+    def escaneo_rapido():
+        # Dentro del fragmento cada lectura vuelve a ejecutar solo esta parte, no el resto de la app
+        st.text_input("⚡ Escanee productos (cada lectura suma 1 unidad):",
+                      key="input_escaneo_rapido",
+                      on_change=sumar_escaneo)
+        if "ultimo_escaneo" in st.session_state:
+            tipo, mensaje = st.session_state.ultimo_escaneo
+            (st.success if tipo == "ok" else st.error)(mensaje)
+        st.divider()
+        mostrar_carrito()
+
+    if st.toggle("⚡ Escaneo rápido", key="modo_rapido",
+                 help="Cada lectura agrega una unidad al carrito sin pedir cantidad"):
+        escaneo_rapido()
+    else:
+        st.text_input("🔢 Escanee código para agregar a salida:", 
+                      key="input_salida_codigo", 
+                      on_change=procesar_codigo_escaneado)
+
+        if st.session_state.producto_pendiente_salida:
+            cod_pend = st.session_state.producto_pendiente_salida
+        
+            if cod_pend in inventario:
+                lotes = inventario[cod_pend]
+                nombre_prod = lotes[0]['nombre']
+                marca_prod = lotes[0]['marca']
+                stock_disp_total = stock_total(cod_pend)
+                en_lista = st.session_state.lista.get(cod_pend, 0)
+                stock_real_disp = stock_disp_total - en_lista
+
+                st.info(f"🛒 Seleccionando cantidad para: **{nombre_prod}** ({marca_prod})")
+                st.write(f"Stock total: {stock_disp_total} | En carrito: {en_lista} | **Disponible: {stock_real_disp}**")
+
+                if stock_real_disp <= 0:
+                    st.error("⚠️ Sin stock disponible para agregar más.")
+                    if st.button("Cancelar selección"):
                         st.session_state.producto_pendiente_salida = None
                         st.rerun()
+                else:
+                    with st.form("form_cantidad_salida"):
+                        col_cant, col_btn = st.columns([1,1])
+                        with col_cant:
+                            cantidad_selec = st.number_input("Cantidad:", min_value=1, max_value=int(stock_real_disp), value=1, step=1)
+                        with col_btn:
+                            st.markdown("<br>", unsafe_allow_html=True)
+                            b_agregar = st.form_submit_button("➕ Agregar al Carrito", type="primary")
+                            b_cancelar = st.form_submit_button("❌ Cancelar")
+
+                        if b_agregar:
+                            if cod_pend in st.session_state.lista:
+                                st.session_state.lista[cod_pend] += cantidad_selec
+                            else:
+                                st.session_state.lista[cod_pend] = cantidad_selec
+                            # Versión del producto con la que se controló el stock
+                            st.session_state.versiones_lista[cod_pend] = almacen.version_producto(cod_pend)
+                        
+                            st.toast(f"✅ Agregado: {cantidad_selec} de {nombre_prod}")
+                            st.session_state.producto_pendiente_salida = None
+                            st.rerun()
                     
-                    if b_cancelar:
-                        st.session_state.producto_pendiente_salida = None
-                        st.rerun()
-        else:
-             st.error("El producto ya no existe en el inventario.")
-             st.session_state.producto_pendiente_salida = None
+                        if b_cancelar:
+                            st.session_state.producto_pendiente_salida = None
+                            st.rerun()
+            else:
+                 st.error("El producto ya no existe en el inventario.")
+                 st.session_state.producto_pendiente_salida = None
 
-    st.divider()
-    
-    c_lista, c_resumen = st.columns([2, 1])
-    
-    with c_lista:
-        st.markdown("### 🛒 Carrito de Salida")
-        if not st.session_state.lista:
-            st.info("El carrito está vacío.")
-        else:
-            eliminar = []
-            for codigo, cant_lista in st.session_state.lista.items():
-                if codigo in inventario:
-                    nombre = inventario[codigo][0]['nombre']
-                    marca = inventario[codigo][0]['marca']
-                    col_det, col_btn = st.columns([0.8, 0.2])
-                    with col_det:
-                        st.markdown(f"**{nombre}** ({marca}): `{cant_lista}` un.")
-                    with col_btn:
-                        if st.button("🗑️", key=f"del_{codigo}", help="Eliminar del carro"):
-                            eliminar.append(codigo)
-            
-            if eliminar:
-                for cod in eliminar:
-                    del st.session_state.lista[cod]
-                st.rerun()
-    
-    with c_resumen:
-        if st.session_state.lista:
-            total_items = sum(st.session_state.lista.values())
-            st.metric("Total Items", total_items)
-            
-            if st.button("🚀 Confirmar Salida", type="primary"):
-                for codigo_prod, cantidad_sacar in st.session_state.lista.items():
-                    if codigo_prod not in inventario: continue
-
-                    lotes_a_modificar = ordenar_lotes_fifo(inventario[codigo_prod])
-                    restante = cantidad_sacar
-                    nombre_prod = lotes_a_modificar[0]['nombre']
-
-                    lotes_finales = []
-                    for l in lotes_a_modificar:
-                        if restante > 0:
-                            toma = min(l['cantidad'], restante)
-                            l['cantidad'] -= toma
-                            restante -= toma
-                            registrar_movimiento("salida", codigo_prod, nombre_prod, toma, l.get('fecha_vencimiento',''), l.get('precio_costo'), l.get('precio_venta'))
-                        if l['cantidad'] > 0:
-                            lotes_finales.append(l)
-                    
-                    # Actualización en memoria local
-                    if not lotes_finales:
-                        if codigo_prod in inventario: del inventario[codigo_prod]
-                    else:
-                        inventario[codigo_prod] = lotes_finales
-                
-                # Sincronización con la nube (Solo escritura)
-                guardar_inventario()
-                st.session_state.lista = {}
-                st.success("Salidas registradas correctamente!")
-                st.rerun() 
-
-if tab3:
-    with tab3:
+        st.divider()
+        mostrar_carrito()
+
+if tab3 and tab3.open:
+    with tab3, metricas.medir("pestaña.inventario"):
         st.subheader("📋 Inventario Completo")
         
-        # Generar DataFrame desde memoria local (Sin API)
-        filas_data = []
-        for cod, lotes in inventario.items():
-            for l in lotes:
-                filas_data.append([
-                    cod, l['nombre'], l['marca'], l['cantidad'], 
-                    l['fecha_vencimiento'], l['precio_costo'], l['precio_venta']
-                ])
-        
-        if filas_data:
-            df_inv = pd.DataFrame(filas_data, columns=inventario_headers)
-        else:
+        if not inventario:
             st.warning("Inventario vacío.")
-            df_inv = pd.DataFrame(columns=inventario_headers)
 
         c_search, c_metric1, c_metric2 = st.columns([2, 1, 1])
         with c_search:
             busqueda = st.text_input("🔍 Buscar en inventario:", key="search_inv", placeholder="Nombre, Marca o Código...")
-        
-        if busqueda:
-            busqueda_lower = busqueda.lower()
-            filtro = (df_inv['codigo'].astype(str).str.contains(busqueda_lower, case=False, na=False)) | \
-                    (df_inv['nombre'].astype(str).str.contains(busqueda_lower, case=False, na=False)) | \
-                    (df_inv['marca'].astype(str).str.contains(busqueda_lower, case=False, na=False))
-            df_filtrado = df_inv[filtro]
-        else:
-            df_filtrado = df_inv
 
-        with c_metric1:
-            st.metric("Total Productos", len(df_filtrado))
-        with c_metric2:
-            total_stock_view = df_filtrado['cantidad'].sum() if not df_filtrado.empty else 0
-            st.metric("Stock Total Unidades", total_stock_view)
-        
+        columnas_orden = {'nombre': "Nombre", 'codigo': "Código", 'marca': "Marca", 'cantidad': "Stock",
+                          'fecha_vencimiento': "Vencimiento", 'precio_costo': "Costo", 'precio_venta': "Venta"}
+        c_orden, c_desc = st.columns([1, 1])
+        with c_orden:
+            orden = st.selectbox("Ordenar por", list(columnas_orden), format_func=columnas_orden.get, key="orden_inv")
+        with c_desc:
+            descendente = st.checkbox("Descendente", key="orden_inv_desc")
+
+        def filtrar():
+            if busqueda:
+                filas = inventario.filas(almacen.busqueda.buscar(busqueda))
+            else:
+                filas = np.arange(inventario.n)
+            return inventario.ordenar(filas, orden, descendente), inventario.unidades(filas)
+
+        # Filtro, totales y orden se calculan sobre los arreglos (y se repiten solo si
+        # cambió algo); solo la página visible se arma como DataFrame
+        with almacen.lock:
+            filas, unidades = memo_sesion("filas_inventario", (busqueda, orden, descendente), filtrar)
+
+            with c_metric1:
+                st.metric("Total Productos", len(filas))
+            with c_metric2:
+                st.metric("Stock Total Unidades", unidades)
+
+            inicio, fin = paginar(len(filas), "pagina_inv")
+            df_pagina = inventario.dataframe(filas[inicio:fin])
+
+        botones_exportar("inventario", bloques_inventario)
+
         st.dataframe(
-            df_filtrado, 
+            df_pagina, 
             use_container_width=True,
             height=500,
             hide_index=True,
@@ -611,39 +931,30 @@ if tab3:
                 'codigo': st.column_config.TextColumn("Código"),
                 'nombre': st.column_config.TextColumn("Nombre"),
                 'marca': st.column_config.TextColumn("Marca"),
-                "fecha_vencimiento": st.column_config.TextColumn("Vencimiento", width="medium"),
+                "fecha_vencimiento": st.column_config.DateColumn("Vencimiento", width="medium", format="YYYY-MM-DD"),
                 "cantidad": st.column_config.NumberColumn("Stock", format="%d"),
                 "precio_costo": st.column_config.NumberColumn("Costo", format="$%d"),
                 "precio_venta": st.column_config.NumberColumn("Venta", format="$%d"),
             }
         )
 
-    with tab4:
+if tab4 and tab4.open:
+    with tab4, metricas.medir("pestaña.historial"):
         st.subheader("📊 Historial de Movimientos")
+        botones_exportar("movimientos", bloques_movimientos)
         
         with st.expander("🛠️ Filtros de Búsqueda", expanded=True):
             col_izq, col_der = st.columns(2)
 
             with col_izq:
                 # Construir lista desde memoria
-                productos_lista = []
-                for codigo, lotes in inventario.items():
-                    if lotes:
-                        base = lotes[0]
-                        nombre = base.get('nombre') or 'N/A'
-                        marca = base.get('marca') or 'N/A'
-                        productos_lista.append((codigo, nombre, marca))
-                productos_lista.sort(key=lambda x: x[1])
-
-                opciones = [f"{i+1}) {nombre} - {marca} (Código: {codigo})" for i, (codigo, nombre, marca) in enumerate(productos_lista)]
-                opciones.insert(0, "Cancelar")
-                opciones.insert(1, 'Todos los productos')
-                seleccion = st.selectbox("Producto:", opciones, key="mov_prod_sel")
+                codigos, etiquetas = almacen.selector_productos()
+                seleccion = st.selectbox("Producto:", ["Cancelar", 'Todos los productos', *codigos],
+                                         format_func=lambda c: etiquetas.get(c, c), key="mov_prod_sel")
 
                 codigo_seleccionado = None
                 if seleccion != 'Cancelar' and seleccion != 'Todos los productos':
-                    idx = opciones.index(seleccion) - 2
-                    codigo_seleccionado = productos_lista[idx][0]
+                    codigo_seleccionado = seleccion
                 
                 tipo_movimiento = st.selectbox("Tipo:", ["Todos", "entrada", "salida"], key="tipo_movimiento")
 
@@ -655,96 +966,91 @@ if tab3:
                 st.markdown("<br>", unsafe_allow_html=True)
                 btn_filtrar = st.button("🔎 Buscar Movimientos", type="primary")
 
+        # El filtro aplicado queda en la sesión para poder cambiar de página sin volver a buscar
         if btn_filtrar:
-            if not movimientos:
+            st.session_state.filtro_movimientos = (fecha_inicio, fecha_fin, codigo_seleccionado, tipo_movimiento)
+
+        if "filtro_movimientos" in st.session_state:
+            if not len(movimientos):
                 st.info("No hay movimientos registrados.")
             else:
                 try:
-                    df = pd.DataFrame(movimientos, columns=movimientos_headers)
-                    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-                    
+                    fecha_inicio, fecha_fin, codigo_filtro, tipo_filtro = st.session_state.filtro_movimientos
                     fecha_inicio = pd.to_datetime(fecha_inicio)
                     fecha_fin = pd.to_datetime(fecha_fin) + pd.Timedelta(days=1)
                     
-                    df_filtrado = df.loc[(df["timestamp"] >= fecha_inicio) & (df["timestamp"] < fecha_fin)].copy()
-                    df_filtrado['cantidad'] = df_filtrado['cantidad'].apply(_convertir_a_numero)
-
-                    if tipo_movimiento != "Todos":
-                        df_filtrado = df_filtrado[df_filtrado['tipo'] == tipo_movimiento]
-
-                    if codigo_seleccionado is not None:
-                        df_filtrado = df_filtrado[df_filtrado['codigo'] == codigo_seleccionado]
+                    # Solo se leen los meses del rango; timestamp y cantidad ya vienen tipados
+                    df_filtrado = memo_sesion("movimientos_filtrados", st.session_state.filtro_movimientos,
+                        lambda: movimientos.consultar(
+                            desde=fecha_inicio, hasta=fecha_fin, codigo=codigo_filtro,
+                            tipo=None if tipo_filtro == "Todos" else tipo_filtro
+                        ))
+                    invalidos = movimientos.invalidos()
+                    if invalidos:
+                        st.caption("⚠️ Valores inválidos en el historial (se muestran sin fecha o en 0): "
+                                   + ", ".join(f"{c}: {n}" for c, n in invalidos.items()))
 
                     c_graf, c_tabla = st.columns([1, 1])
                     
                     with c_graf:
-                        if tipo_movimiento == "Todos" or tipo_movimiento == "entrada":
-                            df_e = df_filtrado[df_filtrado['tipo'] == 'entrada']
-                            if not df_e.empty:
-                                fig, ax = plt.subplots(figsize=(6, 4))
-                                ax.scatter(df_e["timestamp"], df_e["cantidad"], alpha=0.7, color='green')
-                                ax.set_title("Entradas")
-                                ax.tick_params(axis='x', rotation=45)
-                                st.pyplot(fig)
-                        
-                        if tipo_movimiento == "Todos" or tipo_movimiento == "salida":
-                            df_s = df_filtrado[df_filtrado['tipo'] == 'salida']
-                            if not df_s.empty:
-                                fig2, ax2 = plt.subplots(figsize=(6, 4))
-                                ax2.scatter(df_s["timestamp"], df_s["cantidad"], alpha=0.7, color='red')
-                                ax2.set_title("Salidas")
-                                ax2.tick_params(axis='x', rotation=45)
-                                st.pyplot(fig2)
+                        frecuencia = st.selectbox("Agrupar por", list(FRECUENCIAS), format_func=FRECUENCIAS.get, key="mov_frecuencia")
+                        # Los gráficos usan totales por período (guardados por filtro), no un punto por movimiento
+                        serie = movimientos.serie(
+                            desde=fecha_inicio, hasta=fecha_fin, codigo=codigo_filtro,
+                            tipo=None if tipo_filtro == "Todos" else tipo_filtro, frecuencia=frecuencia
+                        )
+                        ancho = {"D": 0.8, "W": 5, "M": 20}[frecuencia]
+
+                        for tipo, color, titulo in (("entrada", 'green', "Entradas"), ("salida", 'red', "Salidas")):
+                            if tipo not in serie or not serie[tipo].any():
+                                continue
+                            fig, ax = plt.subplots(figsize=(6, 4))
+                            ax.bar(serie.index, serie[tipo], width=ancho, alpha=0.7, color=color)
+                            ax.set_title(f"{titulo} por {FRECUENCIAS[frecuencia].lower()}")
+                            ax.tick_params(axis='x', rotation=45)
+                            st.pyplot(fig)
+                            plt.close(fig) # Libera la figura; si no, matplotlib la guarda para siempre
 
                     with c_tabla:
-                        df_filtrado['fecha'] = df_filtrado['timestamp'].dt.date
-                        df_filtrado['hora'] = df_filtrado['timestamp'].dt.time
+                        columnas_orden = {'timestamp': "Fecha", 'tipo': "Tipo", 'nombre': "Nombre", 'cantidad': "Cantidad"}
+                        c_orden, c_desc = st.columns([1, 1])
+                        with c_orden:
+                            orden = st.selectbox("Ordenar por", list(columnas_orden), format_func=columnas_orden.get, key="orden_mov")
+                        with c_desc:
+                            descendente = st.checkbox("Descendente", key="orden_mov_desc")
+
+                        # Se ordenan solo las posiciones y se arma la página visible
+                        posiciones = memo_sesion("orden_movimientos", (st.session_state.filtro_movimientos, orden),
+                                                 lambda: np.argsort(df_filtrado[orden].to_numpy(), kind='stable'))
+                        if descendente:
+                            posiciones = posiciones[::-1]
+                        inicio, fin = paginar(len(posiciones), "pagina_mov")
+                        df_pagina = df_filtrado.iloc[posiciones[inicio:fin]].copy()
+                        df_pagina['fecha'] = df_pagina['timestamp'].dt.date
+                        df_pagina['hora'] = df_pagina['timestamp'].dt.time
                         
                         st.dataframe(
-                            df_filtrado[["fecha", "hora", "tipo", "nombre", "cantidad"]],
+                            df_pagina[["fecha", "hora", "tipo", "nombre", "cantidad"]],
                             hide_index=True,
                             use_container_width=True
                         )
                 except Exception as e:
                     st.error(f"Error procesando datos: {e}")
 
-    with tab5:
+if tab5 and tab5.open:
+    with tab5, metricas.medir("pestaña.stock_minimo"):
         st.subheader("📉 Niveles de Stock")
 
-        data_rows = []
-        for c, lotes in inventario.items():
-            if lotes:
-                base = lotes[0]
-                data_rows.append({
-                    'codigo': c, 'nombre': base.get('nombre'), 'stock_total_calc': stock_total(c)
-                })
-        df_inv_sin_lotes = pd.DataFrame(data_rows)
-        
-        df_stock_min = pd.DataFrame(list(stock_minimo.items()), columns=['codigo', 'stock_min'])
-        df_stock_min['stock_min'] = df_stock_min['stock_min'].apply(_convertir_a_numero)
+        # El reporte sale del resumen por producto y se rearma solo si cambió el inventario
+        df_reporte = almacen.reporte_stock()
         
-        if not df_inv_sin_lotes.empty:
-            df_reporte = pd.merge(df_stock_min, df_inv_sin_lotes, on='codigo', how='outer')
-            df_reporte['stock_total_calc'] = df_reporte['stock_total_calc'].fillna(0).astype(int)
-            df_reporte['stock_min'] = df_reporte['stock_min'].fillna(0).astype(int)
-            df_reporte['nombre'] = df_reporte['nombre'].fillna('Sin nombre')
-            df_reporte = df_reporte.dropna(subset=['codigo'])
-            df_reporte = df_reporte.drop_duplicates(subset=['codigo'])
-
-            def semaforo(fila):
-                total = fila['stock_total_calc']
-                minimo = fila['stock_min']
-                if total <= minimo: return "🔴 Crítico"
-                elif total <= 1.5*minimo: return "🟡 Advertencia"
-                else: return "🟢 Óptimo"
-
-            df_reporte['Estado'] = df_reporte.apply(semaforo, axis = 1)
-            df_reporte = df_reporte.sort_values(by=['Estado', 'stock_total_calc'])
+        if inventario and not df_reporte.empty:
+            conteo_estados = df_reporte['Estado'].value_counts()
 
             c_crit, c_warn, c_ok = st.columns(3)
-            with c_crit: st.metric("🔴 Estado Crítico", len(df_reporte[df_reporte['Estado'] == "🔴 Crítico"]))
-            with c_warn: st.metric("🟡 Advertencia", len(df_reporte[df_reporte['Estado'] == "🟡 Advertencia"]))
-            with c_ok: st.metric("🟢 Óptimo", len(df_reporte[df_reporte['Estado'] == "🟢 Óptimo"]))
+            with c_crit: st.metric("🔴 Estado Crítico", int(conteo_estados.get("🔴 Crítico", 0)))
+            with c_warn: st.metric("🟡 Advertencia", int(conteo_estados.get("🟡 Advertencia", 0)))
+            with c_ok: st.metric("🟢 Óptimo", int(conteo_estados.get("🟢 Óptimo", 0)))
 
             busqueda = st.text_input("🔍 Buscar código en reporte:", key="search_stock_min")
             if busqueda:
@@ -762,7 +1068,8 @@ if tab3:
         else:
             st.warning("Sin datos de inventario.")
             
-    with tab6:
+if tab6 and tab6.open:
+    with tab6, metricas.medir("pestaña.vencimientos"):
         st.subheader("⏰ Alertas de Vencimiento")
         
         with st.expander("⚙️ Configuración de Alertas", expanded=True):
@@ -772,31 +1079,38 @@ if tab3:
             alerta_preventiva = col_v3.slider("Días Preventivos (🟠)", 0, 120, 12)
 
         hoy = datetime.now().date()
-        alertas = []
 
-        for codigo, lotes in inventario.items():
-            for lote in lotes:
-                fv = lote.get("fecha_vencimiento")
+        def armar_alertas():
+            alertas = []
+
+            # El índice ya está ordenado por fecha: solo se recorren los lotes dentro del umbral mayor
+            limite = hoy + timedelta(days=max(alerta_critica, alerta_adv, alerta_preventiva))
+            for dia, codigo, fv in almacen.vencimientos.hasta(limite):
+                dias_restantes = dia - hoy.toordinal()
                 estado = None
-                if fv:
-                    try:
-                        fv_date = datetime.strptime(fv, "%Y-%m-%d").date()
-                        dias_restantes = (fv_date - hoy).days
 
-                        if dias_restantes < 0: estado = 'Vencido ❌'
-                        elif dias_restantes <= alerta_critica: estado = 'Alerta Crítica 🔴'
-                        elif  dias_restantes <= alerta_adv: estado = 'Alerta Advertencia 🟡'
-                        elif dias_restantes <= alerta_preventiva: estado = 'Alerta Preventiva 🟠'
+                if dias_restantes < 0: estado = 'Vencido ❌'
+                elif dias_restantes <= alerta_critica: estado = 'Alerta Crítica 🔴'
+                elif  dias_restantes <= alerta_adv: estado = 'Alerta Advertencia 🟡'
+                elif dias_restantes <= alerta_preventiva: estado = 'Alerta Preventiva 🟠'
 
-                        if estado:
+                if estado:
+                    for lote in inventario.get(codigo, []):
+                        if lote.get("fecha_vencimiento") == fv:
                             alertas.append({
                                 'Estado': estado, 'Fecha': fv, 'Días': dias_restantes,
                                 'Nombre': lote['nombre'], 'Cantidad': lote['cantidad'], 'Código': codigo
                             })
-                    except: pass
+            return alertas
+
+        # Las alertas se rearman solo si cambió el inventario, el día o los umbrales
+        alertas = memo_sesion("alertas_vencimiento", (hoy, alerta_critica, alerta_adv, alerta_preventiva), armar_alertas)
+
+        if almacen.vencimientos.invalidas:
+            st.caption(f"⚠️ {sum(len(v) for v in almacen.vencimientos.invalidas.values())} lotes tienen una fecha de vencimiento que no se pudo interpretar.")
 
         if alertas:
-            df_alertas = pd.DataFrame(alertas).sort_values(by='Días')
+            df_alertas = pd.DataFrame(alertas) # Ya viene ordenado por días
             st.dataframe(
                 df_alertas, 
                 use_container_width=True, 
@@ -808,3 +1122,5 @@ if tab3:
             )
         else:
             st.success("✅ No hay productos próximos a vencer según los rangos seleccionados.")
+
+metricas.registrar("ejecución completa (ms)", (time.perf_counter() - inicio_ejecucion) * 1000)
@@ -0,0 +1,418 @@
+"""Benchmarks de las operaciones principales sobre un catálogo sintético.
+
+Uso:
+    python benchmark.py                        # mide y compara contra benchmark_base.json
+    python benchmark.py --tamanos 1000 1000000 --latencia 0.05
+    python benchmark.py --guardar-base         # registra los resultados como nueva base
+
+La planilla de Google Sheets se reemplaza por `PlanillaFalsa`, que guarda
+las pestañas en memoria, cuenta las llamadas a la API y simula la latencia
+de red, así se puede medir sin credenciales ni cuota. Los tiempos de la base
+dependen de la máquina: conviene regenerarla donde se vaya a comparar. Las
+llamadas a la API no dependen de la máquina y se comparan exactas.
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import gspread
+import numpy as np
+
+from almacen import AlmacenInventario
+from cliente_sheets import ClienteSheets
+from repositorio import (INVENTARIO_WS, MOVIMIENTOS_WS, STOCK_MINIMO_WS, RepositorioSQLite, RepositorioSheets,
+                         filas_inventario, inventario_headers, movimientos_headers, stock_minimo_headers)
+
+RUTA_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_base.json")
+
+
+# --- Catálogo sintético ---
+
+def generar_catalogo(n_lotes, lotes_por_producto=3, movimientos_por_lote=2, semilla=0):
+    """(inventario, stock_minimo, movimientos) con la forma que devuelve Repositorio.cargar.
+
+    Los vencimientos se reparten como en un almacén real: algunos ya
+    vencidos, una parte en el próximo mes, la mayoría hasta dos años
+    adelante y algunos lotes sin fecha o con una fecha mal escrita.
+    """
+    rnd = random.Random(semilla)
+    hoy = date.today()
+    marcas = [f"Marca {i}" for i in range(max(1, n_lotes // 200))]
+    inventario, stock_minimo = {}, {}
+    n_productos = max(1, n_lotes // lotes_por_producto)
+    for p in range(n_productos):
+        codigo = f"{7790000000000 + p}"
+        nombre = f"Producto {p} {rnd.choice(['Leche', 'Arroz', 'Fideos', 'Yerba', 'Azúcar', 'Galletitas'])}"
+        marca = rnd.choice(marcas)
+        costo = rnd.randint(50, 5000)
+        inventario[codigo] = []
+        stock_minimo[codigo] = rnd.randint(0, 20)
+        for _ in range(lotes_por_producto):
+            azar = rnd.random()
+            if azar < 0.05:
+                fv = (hoy - timedelta(days=rnd.randint(1, 60))).isoformat()
+            elif azar < 0.20:
+                fv = (hoy + timedelta(days=rnd.randint(0, 30))).isoformat()
+            elif azar < 0.90:
+                fv = (hoy + timedelta(days=rnd.randint(31, 730))).isoformat()
+            elif azar < 0.99:
+                fv = ""
+            else:
+                fv = "sin fecha"
+            inventario[codigo].append({
+                'nombre': nombre, 'marca': marca, 'cantidad': rnd.randint(1, 200), 'fecha_vencimiento': fv,
+                'precio_costo': costo, 'precio_venta': int(costo * 1.4),
+            })
+
+    codigos = list(inventario)
+    inicio = datetime.now() - timedelta(days=365)
+    segundos = sorted(rnd.randrange(365 * 24 * 3600) for _ in range(n_lotes * movimientos_por_lote))
+    movimientos = []
+    for s in segundos:
+        codigo = rnd.choice(codigos)
+        lote = rnd.choice(inventario[codigo])
+        movimientos.append([
+            (inicio + timedelta(seconds=s)).isoformat(timespec="seconds"),
+            "entrada" if rnd.random() < 0.4 else "salida", codigo, lote['nombre'], rnd.randint(1, 10),
+            lote['fecha_vencimiento'], lote['precio_costo'], lote['precio_venta'],
+        ])
+    return inventario, stock_minimo, movimientos
+
+
+# --- Planilla falsa (misma interfaz que usa la app de gspread) ---
+
+def _texto(fila):
+    return ["" if v is None else str(v) for v in fila]
+
+
+def _valor_celda(celda):
+    valor = celda["userEnteredValue"]
+    return str(valor.get("numberValue", valor.get("stringValue", "")))
+
+
+class _RespuestaFalsa:
+    """Lo mínimo de requests.Response que usa gspread.exceptions.APIError"""
+
+    def __init__(self, codigo, mensaje):
+        self.status_code = codigo
+        self.text = mensaje
+        self._error = {"error": {"code": codigo, "message": mensaje, "status": ""}}
+
+    def json(self):
+        return self._error
+
+
+class HojaFalsa:
+    """Pestaña en memoria; las celdas se guardan como texto, igual que las devuelve Sheets"""
+
+    def __init__(self, planilla, id, title):
+        self.planilla = planilla
+        self.id = id
+        self.title = title
+        self.filas = []
+
+    def _llamada(self, metodo, filas=0):
+        self.planilla._llamada(f"{self.title}.{metodo}", filas)
+
+    def get_all_values(self):
+        self._llamada("get_all_values", len(self.filas))
+        return [list(f) for f in self.filas]
+
+    def get(self, rango=None, **kwargs):
+        inicio = int(re.match(r"[A-Z]+(\d+)", rango or "A1").group(1)) - 1
+        self._llamada("get", len(self.filas) - inicio)
+        return [list(f) for f in self.filas[inicio:]]
+
+    def clear(self):
+        self._llamada("clear")
+        self.filas = []
+
+    def append_row(self, fila, **kwargs):
+        self._llamada("append_row", 1)
+        self.filas.append(_texto(fila))
+
+    def append_rows(self, filas, **kwargs):
+        self._llamada("append_rows", len(filas))
+        self.filas.extend(_texto(f) for f in filas)
+
+
+class PlanillaFalsa:
+    """Reemplazo de gspread.Spreadsheet que cuenta llamadas y simula la red.
+
+    Cada llamada espera `latencia` segundos más `latencia_fila` por fila
+    leída o escrita. `llamadas` cuenta por método (por ejemplo
+    "inventario.get_all_values") y `total_llamadas()` las suma.
+    """
+
+    def __init__(self, latencia=0.0, latencia_fila=0.0):
+        self.latencia = latencia
+        self.latencia_fila = latencia_fila
+        self.llamadas = Counter()
+        self._hojas = {}
+
+    def _llamada(self, nombre, filas=0):
+        self.llamadas[nombre] += 1
+        espera = self.latencia + self.latencia_fila * filas
+        if espera:
+            time.sleep(espera)
+
+    def total_llamadas(self):
+        return sum(self.llamadas.values())
+
+    def cargar(self, inventario, stock_minimo, movimientos):
+        """Llena las pestañas sin contar llamadas, como una planilla ya existente"""
+        for titulo, headers, filas in (
+            (INVENTARIO_WS, inventario_headers, filas_inventario(inventario)),
+            (STOCK_MINIMO_WS, stock_minimo_headers, list(stock_minimo.items())),
+            (MOVIMIENTOS_WS, movimientos_headers, movimientos),
+        ):
+            hoja = self._hojas.get(titulo) or self._nueva_hoja(titulo)
+            hoja.filas = [list(headers)] + [_texto(f) for f in filas]
+
+    def _nueva_hoja(self, titulo):
+        hoja = HojaFalsa(self, len(self._hojas) + 1, titulo)
+        self._hojas[titulo] = hoja
+        return hoja
+
+    def worksheets(self):
+        self._llamada("worksheets")
+        return list(self._hojas.values())
+
+    def worksheet(self, titulo):
+        self._llamada("worksheet")
+        if titulo not in self._hojas:
+            raise gspread.exceptions.WorksheetNotFound(titulo)
+        return self._hojas[titulo]
+
+    def add_worksheet(self, title, rows=100, cols=10, **kwargs):
+        self._llamada("add_worksheet")
+        return self._nueva_hoja(title)
+
+    def _rango(self, rango):
+        titulo, _, celdas = rango.partition("!")
+        hoja = self._hojas.get(titulo.strip("'"))
+        if hoja is None:
+            raise gspread.exceptions.APIError(_RespuestaFalsa(400, f"Unable to parse range: {rango}"))
+        inicio = re.match(r"[A-Z]+(\d+)", celdas)
+        return hoja.filas[int(inicio.group(1)) - 1 if inicio else 0:]
+
+    def values_batch_get(self, ranges, params=None):
+        filas = [self._rango(r) for r in ranges]
+        self._llamada("values_batch_get", sum(len(f) for f in filas))
+        return {"valueRanges": [{"range": r, "values": [list(x) for x in f]} for r, f in zip(ranges, filas)]}
+
+    def batch_update(self, body):
+        pedidos = body["requests"]
+        self._llamada("batch_update", len(pedidos))
+        por_id = {h.id: h for h in self._hojas.values()}
+        for pedido in pedidos:
+            if "updateCells" in pedido:
+                rango = pedido["updateCells"]["range"]
+                fila = por_id[rango["sheetId"]].filas[rango["startRowIndex"]]
+                fila.extend([""] * (rango["endColumnIndex"] - len(fila)))
+                for j, celda in enumerate(pedido["updateCells"]["rows"][0]["values"]):
+                    fila[rango["startColumnIndex"] + j] = _valor_celda(celda)
+            elif "deleteDimension" in pedido:
+                rango = pedido["deleteDimension"]["range"]
+                del por_id[rango["sheetId"]].filas[rango["startIndex"]:rango["endIndex"]]
+            elif "appendCells" in pedido:
+                hoja = por_id[pedido["appendCells"]["sheetId"]]
+                hoja.filas.extend([_valor_celda(c) for c in f["values"]] for f in pedido["appendCells"]["rows"])
+        return {}
+
+
+# --- Medición ---
+
+def medir(funcion, repeticiones, planilla=None):
+    """Corre `funcion` y devuelve p50/p99 en ms, operaciones por segundo,
+    llamadas a la API por operación (la mayor entre las repeticiones) y
+    memoria pico en MB"""
+    # Una corrida previa sin medir: lo que se hace una sola vez (los metadatos de
+    # las pestañas, tipar el mes en historial_mes) no se reparte entre las repeticiones
+    funcion()
+    tiempos, llamadas = [], []
+    for _ in range(repeticiones):
+        # La basura de la corrida anterior no se cobra en esta
+        gc.collect()
+        antes = planilla.total_llamadas() if planilla is not None else 0
+        t0 = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - t0)
+        if planilla is not None:
+            llamadas.append(planilla.total_llamadas() - antes)
+
+    # La memoria se mide en una corrida aparte: tracemalloc hace más lento todo lo demás
+    tracemalloc.start()
+    try:
+        funcion()
+        pico = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    tiempos = np.asarray(tiempos) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(tiempos, 50)), 3),
+        "p99_ms": round(float(np.percentile(tiempos, 99)), 3),
+        "ops_s": round(repeticiones / (tiempos.sum() / 1000), 1) if tiempos.sum() else None,
+        "llamadas": max(llamadas, default=0),
+        "memoria_mb": round(pico / 2**20, 2),
+    }
+
+
+def operaciones(n_lotes, latencia, directorio, semilla=0):
+    """(nombre, función, planilla o None, repeticiones relativas) para un catálogo de `n_lotes`"""
+    inventario, stock_minimo, movimientos = generar_catalogo(n_lotes, semilla=semilla)
+    planilla = PlanillaFalsa(latencia)
+    planilla.cargar(inventario, stock_minimo, movimientos)
+    rnd = random.Random(semilla)
+    codigos = list(inventario)
+
+    almacen = AlmacenInventario()
+    almacen.reemplazar(inventario, stock_minimo, movimientos)
+
+    # Sin límite de cupo: se mide el trabajo, no las esperas del balde de fichas
+    cliente = ClienteSheets(planilla, cupo_por_minuto=10**9)
+    repo_sheets = RepositorioSheets(lambda: cliente)
+    repo_sheets.leer_disposicion()
+    repo_sqlite = RepositorioSQLite(os.path.join(directorio, f"bench_{n_lotes}.db"))
+    repo_sqlite.importar(inventario, stock_minimo, movimientos)
+
+    def cargar_sheets():
+        # Carga en frío como cargar_todo con INVENTARIO_BACKEND=sheets
+        nuevo = ClienteSheets(planilla, cupo_por_minuto=10**9)
+        AlmacenInventario().reemplazar(*RepositorioSheets(lambda: nuevo).cargar())
+
+    def cargar_sqlite():
+        AlmacenInventario().reemplazar(*repo_sqlite.cargar())
+
+    def entrada():
+        codigo = rnd.choice(codigos)
+        with almacen.lock:
+            almacen.inventario.agregar_lote(codigo, {
+                'nombre': "x", 'marca': "x", 'cantidad': 5,
+                'fecha_vencimiento': (date.today() + timedelta(days=rnd.randint(0, 700))).isoformat(),
+                'precio_costo': 10, 'precio_venta': 14,
+            })
+            almacen.marcar_cambio([codigo])
+
+    def salida_fifo():
+        codigo = rnd.choice(codigos)
+        with almacen.lock:
+            if codigo in almacen.inventario:
+                almacen.consumir_fifo(codigo, 3)
+                almacen.marcar_cambio([codigo])
+
+    def guardar_sheets():
+        # Un lote cambiado: la planilla se compara completa y se envían solo las diferencias
+        salida_fifo()
+        repo_sheets.guardar_inventario(almacen.instantanea())
+
+    def guardar_sqlite():
+        codigo = rnd.choice(codigos)
+        repo_sqlite.guardar_inventario(almacen.instantanea([codigo]), [codigo])
+
+    def reporte_stock():
+        almacen.version += 1 # Fuerza a rearmar el reporte en vez de leerlo del memo
+        almacen.reporte_stock()
+
+    def vencimientos():
+        almacen.vencimientos.hasta(date.today() + timedelta(days=12))
+
+    def busqueda():
+        almacen.busqueda.buscar(rnd.choice(["leche", "arroz", "marca 1", "77900000001"]))
+
+    def historial_mes():
+        movimientos_almacen = almacen.movimientos
+        hasta = datetime.now()
+        movimientos_almacen.consultar(desde=hasta - timedelta(days=30), hasta=hasta)
+
+    return [
+        ("cargar_sheets", cargar_sheets, planilla, 0.2),
+        ("cargar_sqlite", cargar_sqlite, None, 0.2),
+        ("guardar_inventario_sheets", guardar_sheets, planilla, 0.5),
+        ("guardar_inventario_sqlite", guardar_sqlite, None, 1),
+        ("entrada_fifo", entrada, None, 1),
+        ("salida_fifo", salida_fifo, None, 1),
+        ("reporte_stock", reporte_stock, None, 0.5),
+        ("vencimientos", vencimientos, None, 1),
+        ("busqueda", busqueda, None, 1),
+        ("historial_mes", historial_mes, None, 0.5),
+    ]
+
+
+def correr(tamanos, repeticiones, latencia, seleccion=None):
+    resultados = {}
+    with tempfile.TemporaryDirectory() as directorio:
+        for n in tamanos:
+            t0 = time.perf_counter()
+            lista = operaciones(n, latencia, directorio)
+            print(f"\n== {n} lotes (catálogo armado en {time.perf_counter() - t0:.1f}s)")
+            for nombre, funcion, planilla, factor in lista:
+                if seleccion and nombre not in seleccion:
+                    continue
+                r = medir(funcion, max(1, int(repeticiones * factor)), planilla)
+                resultados[f"{nombre}@{n}"] = r
+                print(f"{nombre:<28} p50 {r['p50_ms']:>10.3f} ms  p99 {r['p99_ms']:>10.3f} ms  "
+                      f"{r['ops_s'] or 0:>10.1f} op/s  {r['llamadas']:>5g} llamadas  {r['memoria_mb']:>8.2f} MB")
+    return resultados
+
+
+def comparar(resultados, base, tolerancia):
+    """Lista de regresiones contra la base: más llamadas a la API o p50 más lento que la tolerancia"""
+    regresiones = []
+    for clave, r in resultados.items():
+        b = base.get(clave)
+        if b is None:
+            continue
+        # Son enteros exactos: cualquier llamada de más es una regresión
+        if r["llamadas"] > b["llamadas"]:
+            regresiones.append(f"{clave}: {r['llamadas']:g} llamadas (base {b['llamadas']:g})")
+        # Menos de 1 ms de diferencia es ruido, no regresión
+        if r["p50_ms"] > b["p50_ms"] * (1 + tolerancia) and r["p50_ms"] - b["p50_ms"] > 1:
+            regresiones.append(f"{clave}: p50 {r['p50_ms']:.3f} ms (base {b['p50_ms']:.3f} ms)")
+    return regresiones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[1000, 10000], help="Lotes por catálogo")
+    parser.add_argument("--repeticiones", type=int, default=50)
+    parser.add_argument("--latencia", type=float, default=0.0, help="Segundos por llamada a la planilla falsa")
+    parser.add_argument("--operaciones", nargs="+", help="Medir solo estas operaciones")
+    parser.add_argument("--base", default=RUTA_BASE)
+    parser.add_argument("--guardar-base", action="store_true", help="Guarda los resultados como nueva base")
+    parser.add_argument("--tolerancia", type=float, default=1.0, help="Aumento de p50 permitido (1.0 = el doble)")
+    args = parser.parse_args(argv)
+
+    resultados = correr(args.tamanos, args.repeticiones, args.latencia, args.operaciones)
+
+    base = {}
+    if os.path.exists(args.base):
+        with open(args.base, encoding="utf-8") as f:
+            base = json.load(f)
+    if args.guardar_base:
+        base.update(resultados)
+        with open(args.base, "w", encoding="utf-8") as f:
+            json.dump(base, f, indent=2, sort_keys=True)
+        print(f"\nBase guardada en {args.base}")
+        return 0
+
+    regresiones = comparar(resultados, base, args.tolerancia)
+    for r in regresiones:
+        print(f"REGRESIÓN {r}")
+    if not base:
+        print("\nSin base para comparar (use --guardar-base)")
+    return 1 if regresiones else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""Índice de búsqueda de productos por código, nombre y marca."""
+import unicodedata
+from bisect import bisect_left, insort
+
+
+def plegar(texto):
+    """Minúsculas y sin tildes, para comparar 'Azúcar' con 'azucar'"""
+    texto = unicodedata.normalize("NFKD", str(texto or "").casefold())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+def _trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceBusqueda:
+    """Trigramas sobre codigo, nombre y marca ya plegados.
+
+    Una búsqueda de 3 o más letras intersecta los trigramas del texto y
+    confirma la subcadena solo en los candidatos. Con 1 o 2 letras no hay
+    trigrama que usar y se recorren los textos buscando la subcadena, igual
+    que el filtro original ("56" encuentra "456"). `ordenados()` mantiene la
+    lista de productos ordenada por nombre para los selectores. Los trigramas
+    se arman recién en la primera búsqueda que los usa, así cargar el
+    inventario no paga por ellos.
+    """
+
+    def __init__(self):
+        self._textos = {}
+        self._trigramas = None
+        self._por_nombre = []
+        self._entradas = {}
+
+    def __len__(self):
+        return len(self._textos)
+
+    def __contains__(self, codigo):
+        return codigo in self._textos
+
+    def quitar(self, codigo):
+        texto = self._textos.pop(codigo, None)
+        if texto is None:
+            return
+        if self._trigramas is not None:
+            for campo in texto.split("\x00"):
+                for tri in _trigramas(campo):
+                    codigos = self._trigramas.get(tri)
+                    if codigos is not None:
+                        codigos.discard(codigo)
+                        if not codigos:
+                            del self._trigramas[tri]
+        clave = self._entradas.pop(codigo)
+        del self._por_nombre[bisect_left(self._por_nombre, clave)]
+
+    def _texto(self, codigo, nombre, marca):
+        # Los campos van separados para que un texto no coincida entre dos de ellos
+        return "\x00".join(plegar(campo) for campo in (codigo, nombre, marca))
+
+    def _indexar_trigramas(self, codigo, texto):
+        for campo in texto.split("\x00"):
+            for tri in _trigramas(campo):
+                self._trigramas.setdefault(tri, set()).add(codigo)
+
+    def agregar(self, codigo, nombre, marca):
+        """Indexa un producto (o lo reindexa si cambió nombre o marca)"""
+        texto = self._texto(codigo, nombre, marca)
+        if self._textos.get(codigo) == texto:
+            return
+        self.quitar(codigo)
+        self._textos[codigo] = texto
+        if self._trigramas is not None:
+            self._indexar_trigramas(codigo, texto)
+        clave = (nombre or "N/A", codigo, marca or "N/A")
+        self._entradas[codigo] = clave
+        insort(self._por_nombre, clave)
+
+    def reconstruir(self, productos):
+        """Indexa de cero una lista de (codigo, nombre, marca)"""
+        self.__init__()
+        for codigo, nombre, marca in productos:
+            self._textos[codigo] = self._texto(codigo, nombre, marca)
+            self._entradas[codigo] = (nombre or "N/A", codigo, marca or "N/A")
+        self._por_nombre = sorted(self._entradas.values())
+
+    def buscar(self, consulta):
+        """Códigos cuyo codigo, nombre o marca contienen la consulta"""
+        consulta = plegar(consulta).strip()
+        if not consulta:
+            return set(self._textos)
+        if len(consulta) < 3:
+            return {c for c, texto in self._textos.items() if consulta in texto}
+        if self._trigramas is None:
+            self._trigramas = {}
+            for codigo, texto in self._textos.items():
+                self._indexar_trigramas(codigo, texto)
+        listas = [self._trigramas.get(tri) for tri in _trigramas(consulta)]
+        if not all(listas):
+            return set()
+        listas.sort(key=len)
+        candidatos = listas[0].intersection(*listas[1:])
+        return {c for c in candidatos if consulta in self._textos[c]}
+
+    def ordenados(self):
+        """(codigo, nombre, marca) de todos los productos, ordenados por nombre"""
+        return [(codigo, nombre, marca) for nombre, codigo, marca in self._por_nombre]
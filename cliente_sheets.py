@@ -0,0 +1,267 @@
+"""Cliente de Google Sheets que respeta el cupo de la API."""
+import copy
+import random
+import threading
+import time
+
+from gspread.exceptions import APIError, WorksheetNotFound
+
+from metricas import metricas
+
+# Cupo de lectura y de escritura de la API de Sheets por usuario y por minuto
+CUPO_POR_MINUTO = 60
+# Errores que se reintentan: cupo agotado y fallas transitorias del servidor
+_REINTENTABLES = {429, 500, 502, 503, 504}
+# Una escritura que respondió 5xx pudo haberse aplicado igual (append, borrado de
+# filas, clear): repetirla duplicaría o correría datos. El 429 se rechaza sin aplicar.
+_REINTENTABLES_ESCRITURA = {429}
+
+
+class BaldeFichas:
+    """Token bucket: hasta `capacidad` pedidos de golpe y luego `por_segundo`.
+
+    Con capacidad C y tasa r nunca pasan más de C + 60·r pedidos en un
+    minuto, así que se reparte el cupo entre la ráfaga y la tasa.
+    """
+
+    def __init__(self, cupo_por_minuto=CUPO_POR_MINUTO, capacidad=10):
+        self.capacidad = capacidad
+        self.por_segundo = (cupo_por_minuto - capacidad) / 60
+        self._fichas = float(capacidad)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def tomar(self):
+        """Espera hasta que haya una ficha y la consume; devuelve los segundos esperados"""
+        esperado = 0.0
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._fichas = min(self.capacidad, self._fichas + (ahora - self._ultimo) * self.por_segundo)
+                self._ultimo = ahora
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return esperado
+                espera = (1 - self._fichas) / self.por_segundo
+            time.sleep(espera)
+            esperado += espera
+
+
+def _codigo(error):
+    codigo = getattr(error, "code", None)
+    if codigo in (None, -1):
+        codigo = getattr(getattr(error, "response", None), "status_code", None)
+    return codigo
+
+
+def _copia(resultado):
+    # Cada llamador recibe su copia: los lectores modifican las filas que reciben
+    if isinstance(resultado, list):
+        return [list(f) if isinstance(f, list) else f for f in resultado]
+    return copy.deepcopy(resultado)
+
+
+def _filas_pedidas(metodo, args, resultado):
+    """(filas leídas, filas escritas) de una llamada a gspread"""
+    if metodo in ("get_all_values", "get") and isinstance(resultado, list):
+        return len(resultado), 0
+    if metodo == "values_batch_get" and isinstance(resultado, dict):
+        return sum(len(r.get("values", [])) for r in resultado.get("valueRanges", [])), 0
+    if metodo == "append_rows" and args:
+        return 0, len(args[0])
+    if metodo == "append_row":
+        return 0, 1
+    if metodo == "batch_update" and args:
+        pedidos = args[0].get("requests", [])
+        return 0, sum(len(p["updateCells"]["rows"]) if "updateCells" in p else
+                      len(p["appendCells"]["rows"]) if "appendCells" in p else 0 for p in pedidos)
+    return 0, 0
+
+
+class _Vuelo:
+    """Una lectura en curso que otros hilos esperan en vez de repetirla"""
+
+    def __init__(self):
+        self.listo = threading.Event()
+        self.resultado = None
+        self.error = None
+        self.esperando = 0
+
+
+class ClienteSheets:
+    """Envuelve un gspread.Spreadsheet con la misma interfaz que usa la app.
+
+    - Las pestañas se piden una sola vez (una llamada de metadatos) y se
+      recuerdan; `worksheet()` ya no va a la red.
+    - Lecturas idénticas simultáneas (por ejemplo varias terminales
+      cargando a la vez) comparten un solo pedido. Una lectura que empieza
+      después de una escritura nunca se junta con una anterior a ella.
+    - Lecturas y escrituras pasan por un balde de fichas cada una, con el
+      tamaño del cupo por minuto: en hora pico se espera en vez de fallar.
+    - Las lecturas que responden 429 o 5xx se reintentan con espera
+      exponencial con azar; las escrituras solo ante 429.
+    - Si `interactivo()` es verdadero (la llamada viene del hilo que dibuja
+      la página) los reintentos no esperan más de `espera_interactiva`
+      segundos en total: el error sube y el reintento largo queda para los
+      hilos de fondo.
+
+    Cada llamada real a la API se cuenta y se mide en `metricas`.
+    """
+
+    def __init__(self, sh, cupo_por_minuto=CUPO_POR_MINUTO, reintentos=5, espera_inicial=1, espera_maxima=64,
+                 interactivo=None, espera_interactiva=4):
+        self._sh = sh
+        self.reintentos = reintentos
+        self.espera_inicial = espera_inicial
+        self.espera_maxima = espera_maxima
+        self.interactivo = interactivo or (lambda: False)
+        self.espera_interactiva = espera_interactiva
+        self.lecturas = BaldeFichas(cupo_por_minuto)
+        self.escrituras = BaldeFichas(cupo_por_minuto)
+        self._hojas = None
+        self._lock = threading.Lock()
+        self._vuelos = {}
+        self._generacion = 0
+
+    @property
+    def id(self):
+        return self._sh.id
+
+    # --- Llamadas a la API ---
+
+    def _llamar(self, nombre, funcion, args=(), kwargs=None, escritura=False):
+        kwargs = kwargs or {}
+        balde = self.escrituras if escritura else self.lecturas
+        reintentables = _REINTENTABLES_ESCRITURA if escritura else _REINTENTABLES
+        presupuesto = self.espera_interactiva if self.interactivo() else None
+        for intento in range(self.reintentos + 1):
+            esperado = balde.tomar()
+            if esperado:
+                metricas.registrar("sheets.espera por cupo (ms)", esperado * 1000)
+            metricas.contar("sheets.llamadas")
+            metricas.contar("sheets.escrituras" if escritura else "sheets.lecturas")
+            try:
+                with metricas.medir(f"sheets.{nombre}"):
+                    resultado = funcion(*args, **kwargs)
+                break
+            except APIError as e:
+                codigo = _codigo(e)
+                espera = min(self.espera_maxima, self.espera_inicial * 2 ** intento) * random.uniform(0.5, 1)
+                agotado = intento == self.reintentos or (presupuesto is not None and espera > presupuesto)
+                if codigo not in reintentables or agotado:
+                    if codigo not in _REINTENTABLES:
+                        # Puede ser una pestaña borrada o renombrada: se vuelven a pedir
+                        self.olvidar_hojas()
+                    raise
+                metricas.contar(f"sheets.error_{codigo}")
+                time.sleep(espera)
+                if presupuesto is not None:
+                    presupuesto -= espera
+        leidas, escritas = _filas_pedidas(nombre, args, resultado)
+        if leidas:
+            metricas.contar("sheets.filas_leidas", leidas)
+        if escritas:
+            metricas.contar("sheets.filas_escritas", escritas)
+        return resultado
+
+    def _leer(self, clave, nombre, funcion, args=(), kwargs=None):
+        """Lectura compartida con los hilos que piden lo mismo al mismo tiempo"""
+        with self._lock:
+            clave = (self._generacion, clave)
+            vuelo = self._vuelos.get(clave)
+            propio = vuelo is None
+            if propio:
+                vuelo = self._vuelos[clave] = _Vuelo()
+            else:
+                vuelo.esperando += 1
+        if propio:
+            try:
+                vuelo.resultado = self._llamar(nombre, funcion, args, kwargs)
+            except Exception as e:
+                vuelo.error = e
+            finally:
+                with self._lock:
+                    del self._vuelos[clave]
+                    compartido = vuelo.esperando > 0
+                vuelo.listo.set()
+            if vuelo.error is not None:
+                raise vuelo.error
+            # Sin nadie esperando el resultado es solo de este hilo y no hace falta copiarlo
+            return _copia(vuelo.resultado) if compartido else vuelo.resultado
+        metricas.contar("sheets.lecturas_compartidas")
+        vuelo.listo.wait()
+        if vuelo.error is not None:
+            raise vuelo.error
+        return _copia(vuelo.resultado)
+
+    def _escribir(self, nombre, funcion, args=(), kwargs=None):
+        with self._lock:
+            self._generacion += 1
+        return self._llamar(nombre, funcion, args, kwargs, escritura=True)
+
+    # --- Interfaz de gspread.Spreadsheet ---
+
+    def olvidar_hojas(self):
+        with self._lock:
+            self._hojas = None
+
+    def _cargar_hojas(self):
+        if self._hojas is None:
+            hojas = self._leer("worksheets", "worksheets", self._sh.worksheets)
+            with self._lock:
+                self._hojas = {ws.title: _Hoja(self, ws) for ws in hojas}
+        return self._hojas
+
+    def worksheets(self):
+        return list(self._cargar_hojas().values())
+
+    def worksheet(self, titulo):
+        hoja = self._cargar_hojas().get(titulo)
+        if hoja is None:
+            # Puede haberse creado desde otro lado: se confirma una vez con la planilla
+            self.olvidar_hojas()
+            hoja = self._cargar_hojas().get(titulo)
+            if hoja is None:
+                raise WorksheetNotFound(titulo)
+        return hoja
+
+    def add_worksheet(self, title, rows=100, cols=10, **kwargs):
+        ws = self._escribir("add_worksheet", self._sh.add_worksheet, (), dict(title=title, rows=rows, cols=cols, **kwargs))
+        hoja = _Hoja(self, ws)
+        with self._lock:
+            if self._hojas is not None:
+                self._hojas[title] = hoja
+        return hoja
+
+    def values_batch_get(self, ranges, params=None):
+        clave = ("values_batch_get", tuple(ranges), tuple(sorted((params or {}).items())))
+        return self._leer(clave, "values_batch_get", self._sh.values_batch_get, (ranges,), {"params": params})
+
+    def batch_update(self, body):
+        return self._escribir("batch_update", self._sh.batch_update, (body,))
+
+
+class _Hoja:
+    """Pestaña con las llamadas de gspread.Worksheet que usa la app, vía ClienteSheets"""
+
+    def __init__(self, cliente, ws):
+        self._cliente = cliente
+        self._ws = ws
+        self.id = ws.id
+        self.title = ws.title
+
+    def get_all_values(self):
+        return self._cliente._leer((self.id, "get_all_values"), "get_all_values", self._ws.get_all_values)
+
+    def get(self, rango=None, **kwargs):
+        clave = (self.id, "get", rango, tuple(sorted(kwargs.items())))
+        return self._cliente._leer(clave, "get", self._ws.get, (rango,), kwargs)
+
+    def clear(self):
+        return self._cliente._escribir("clear", self._ws.clear)
+
+    def append_row(self, fila, **kwargs):
+        return self._cliente._escribir("append_row", self._ws.append_row, (fila,), kwargs)
+
+    def append_rows(self, filas, **kwargs):
+        return self._cliente._escribir("append_rows", self._ws.append_rows, (filas,), kwargs)
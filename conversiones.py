@@ -0,0 +1,78 @@
+"""Conversión de los valores leídos de las hojas a tipos de Python."""
+import numpy as np
+import pandas as pd
+
+
+def normalizar_fecha(fecha_obj) -> str:
+    if not fecha_obj: return ""
+    try:
+        if isinstance(fecha_obj, str):
+            fecha_obj = fecha_obj.strip()
+            if ' ' in fecha_obj: fecha_obj = fecha_obj.split(' ')[0]
+            if 'T' in fecha_obj: fecha_obj = fecha_obj.split('T')[0]
+            return fecha_obj
+        if hasattr(fecha_obj, 'strftime'):
+            return fecha_obj.strftime("%Y-%m-%d")
+        return str(fecha_obj).split(' ')[0]
+    except: return ""
+
+def _convertir_a_numero(valor, por_defecto=0):
+    if valor is None or valor == '': return por_defecto
+    try: return int(valor)
+    except (ValueError, TypeError):
+        try: return float(valor)
+        except (ValueError, TypeError): return por_defecto
+
+
+def _distintos(valores):
+    """(posición de cada valor en los distintos, distintos como texto sin espacios)"""
+    posiciones, distintos = pd.factorize(np.asarray(valores, dtype=object), use_na_sentinel=False)
+    texto = pd.Series(distintos, dtype="string").fillna("").str.strip()
+    return posiciones, texto
+
+
+def parsear_numeros(valores, por_defecto=0):
+    """Columna a float64 con to_numeric; devuelve (números, posiciones inválidas).
+
+    Las columnas repiten mucho, así que se convierte cada valor distinto una
+    sola vez. Vacío vale `por_defecto` sin ser error; lo que no es número
+    también, pero su posición se informa.
+    """
+    posiciones, texto = _distintos(valores)
+    numeros = pd.to_numeric(texto, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+    vacio = (texto == "").to_numpy()
+    invalido = np.isnan(numeros) & ~vacio
+    numeros[vacio | invalido] = por_defecto
+    return numeros[posiciones], np.flatnonzero(invalido[posiciones])
+
+
+def parsear_fechas(valores):
+    """Columna de fechas a texto AAAA-MM-DD (sin la hora); devuelve (fechas, posiciones inválidas).
+
+    Se valida con formato fijo; las válidas se devuelven con ceros ("2025-6-1"
+    queda "2025-06-01"), que es lo que entienden la tabla y el índice de
+    vencimientos. Lo que no es fecha queda como venía (igual que
+    normalizar_fecha) pero su posición se informa.
+    """
+    posiciones, texto = _distintos(valores)
+    texto = texto.str.split(" ", n=1).str[0].str.split("T", n=1).str[0]
+    fechas = pd.to_datetime(texto, format="%Y-%m-%d", errors="coerce")
+    invalido = (fechas.isna() & (texto != "")).to_numpy()
+    texto = fechas.dt.strftime("%Y-%m-%d").fillna(texto)
+    return texto.to_numpy(dtype=object)[posiciones], np.flatnonzero(invalido[posiciones])
+
+
+def como_python(numeros):
+    """Números de un arreglo como int si no tienen decimales, como _convertir_a_numero"""
+    enteros = np.isfinite(numeros) & (numeros == np.trunc(numeros))
+    return [int(x) if e else x for x, e in zip(numeros.tolist(), enteros.tolist())]
+
+
+def describir_errores(errores, ejemplos=3):
+    """Texto para el usuario a partir de columna -> [(fila, valor), ...]; vacío si no hay errores"""
+    partes = []
+    for columna, malos in errores.items():
+        if malos:
+            muestra = ", ".join(f"fila {fila}: {valor!r}" for fila, valor in malos[:ejemplos])
+            partes.append(f"{columna} ({len(malos)}): {muestra}{', ...' if len(malos) > ejemplos else ''}")
+    return "; ".join(partes)
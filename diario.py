@@ -0,0 +1,116 @@
+"""Diario local de operaciones (write-ahead) en formato JSON-lines."""
+import json
+import os
+import threading
+
+
+class Diario:
+    """Archivo de solo agregado con las operaciones de inventario.
+
+    Cada operación se escribe con número de secuencia y fsync antes de tocar
+    el backend, y se marca como confirmada cuando el backend la guardó. Al
+    arrancar, `pendientes()` devuelve lo que quedó sin confirmar para volver a
+    aplicarlo. Cada `compactar_cada` líneas el archivo se reescribe dejando
+    solo las operaciones pendientes.
+
+    Cada operación guarda el estado final de sus productos (`lotes` y
+    `stock_minimo`, de código a valor). Confirmar una operación guarda también
+    esos productos para las pendientes anteriores: se les quitan y, si no les
+    queda ninguno, se dan por confirmadas. Así reaplicar lo pendiente nunca
+    vuelve un producto a un estado más viejo que uno ya guardado.
+    """
+
+    def __init__(self, ruta, compactar_cada=1000):
+        self.ruta = ruta
+        self.compactar_cada = compactar_cada
+        self._lock = threading.Lock()
+        self._pendientes = {}
+        self._ultimo = 0
+        self._lineas = 0
+        self._leer()
+        self._archivo = open(ruta, "a", encoding="utf-8")
+        if self._corte:
+            # La última línea quedó cortada por una caída: que lo nuevo empiece en otra
+            self._archivo.write("\n")
+            self._archivo.flush()
+
+    def _leer(self):
+        self._corte = False
+        if not os.path.exists(self.ruta):
+            return
+        with open(self.ruta, encoding="utf-8") as f:
+            for linea in f:
+                self._corte = not linea.endswith("\n")
+                try:
+                    registro = json.loads(linea)
+                except ValueError:
+                    continue
+                self._lineas += 1
+                if "confirmado" in registro:
+                    self._quitar(registro["confirmado"])
+                elif "seq" in registro:
+                    self._pendientes[registro["seq"]] = registro
+                self._ultimo = max(self._ultimo, registro.get("seq", 0), registro.get("confirmado", 0))
+
+    def _escribir(self, registro, sincronizar):
+        self._archivo.write(json.dumps(registro, ensure_ascii=False, default=str) + "\n")
+        self._archivo.flush()
+        if sincronizar:
+            os.fsync(self._archivo.fileno())
+        self._lineas += 1
+
+    def registrar(self, **datos):
+        """Agrega una operación y espera a que llegue al disco; devuelve su número de secuencia"""
+        with self._lock:
+            self._ultimo += 1
+            registro = {"seq": self._ultimo, **datos}
+            self._escribir(registro, sincronizar=True)
+            self._pendientes[self._ultimo] = registro
+            return self._ultimo
+
+    def _quitar(self, seq):
+        """Saca seq de pendientes y sus productos de las pendientes anteriores; False si no estaba"""
+        registro = self._pendientes.pop(seq, None)
+        if registro is None:
+            return False
+        guardados = set(registro.get("lotes", {})) | set(registro.get("stock_minimo", {}))
+        for anterior in [s for s in self._pendientes if s < seq]:
+            previo = self._pendientes[anterior]
+            lotes = {c: v for c, v in previo.get("lotes", {}).items() if c not in guardados}
+            minimos = {c: v for c, v in previo.get("stock_minimo", {}).items() if c not in guardados}
+            if lotes or minimos:
+                # Copia: quien recibió el registro en pendientes() no lo ve cambiar
+                self._pendientes[anterior] = {**previo, "lotes": lotes, "stock_minimo": minimos}
+            else:
+                # Sus movimientos ya se enviaron: el guardado de seq vació la cola entera
+                del self._pendientes[anterior]
+        return True
+
+    def confirmar(self, seq):
+        # Sin fsync: si se pierde, la operación se vuelve a aplicar y da el mismo resultado
+        with self._lock:
+            if not self._quitar(seq):
+                return
+            self._escribir({"confirmado": seq}, sincronizar=False)
+            if self._lineas >= self.compactar_cada:
+                self._compactar()
+
+    def pendientes(self):
+        with self._lock:
+            return [self._pendientes[s] for s in sorted(self._pendientes)]
+
+    def _compactar(self):
+        temporal = self.ruta + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            for seq in sorted(self._pendientes):
+                f.write(json.dumps(self._pendientes[seq], ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._archivo.close()
+        os.replace(temporal, self.ruta)
+        self._archivo = open(self.ruta, "a", encoding="utf-8")
+        self._lineas = len(self._pendientes)
+
+    def compactar(self):
+        with self._lock:
+            self._compactar()
@@ -0,0 +1,262 @@
+"""Historial de movimientos en columnas tipadas, particionado por mes."""
+import re
+import threading
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from conversiones import como_python, parsear_numeros
+from repositorio import movimientos_headers
+
+_MES = re.compile(r"^\d{4}-\d{2}")
+_NUMERICAS = ["cantidad", "precio_costo", "precio_venta"]
+# Períodos de agrupación para los gráficos: día, semana (desde el lunes) y mes
+FRECUENCIAS = {"D": "Día", "W": "Semana", "M": "Mes"}
+_MAX_SERIES = 32
+
+
+def _tipar(filas):
+    """Convierte filas crudas en un DataFrame con timestamp y números ya parseados.
+
+    Devuelve (df, invalidos, malas): invalidos cuenta por columna los valores
+    que no eran fecha o número (quedan NaT o 0) y malas marca las filas que
+    tienen alguno.
+    """
+    ancho = len(movimientos_headers)
+    # Las filas cortas se completan con None y las largas pierden lo que sobra
+    df = pd.DataFrame(filas).reindex(columns=range(ancho))
+    df.columns = movimientos_headers
+    texto = df["timestamp"].astype("string").fillna("").str.strip()
+    df["timestamp"] = pd.to_datetime(texto, format="ISO8601", errors="coerce")
+    malas = (df["timestamp"].isna() & (texto != "")).to_numpy()
+    invalidos = {"timestamp": int(malas.sum())}
+    for col in _NUMERICAS:
+        numeros, malos = parsear_numeros(df[col].to_numpy())
+        # Enteros si ninguno tiene decimales, como los dejaba to_numeric
+        df[col] = numeros.astype(np.int64) if np.all(numeros % 1 == 0) else numeros
+        invalidos[col] = len(malos)
+        malas[malos] = True
+    for col in ("tipo", "codigo", "nombre", "fecha_vencimiento"):
+        df[col] = df[col].fillna("").astype(str)
+    return df, invalidos, malas
+
+
+def _celda(valor):
+    return "" if valor is None else str(valor)
+
+
+def _clave_mes(fila):
+    ts = str(fila[0]) if fila else ""
+    return ts[:7] if _MES.match(ts) else ""
+
+
+def _agrupar_por_mes(filas):
+    """Filas por clave de mes (como _clave_mes), calculando los meses de una vez y sin copiarlas"""
+    filas = filas if isinstance(filas, list) else list(filas)
+    if not filas:
+        return {}
+    ts = pd.Series([f[0] if f else "" for f in filas], dtype=object).astype("string")
+    meses = ts.str[:7].where(ts.str.match(_MES.pattern), "").fillna("")
+    codigos, claves = pd.factorize(meses)
+    orden = np.argsort(codigos, kind="stable")
+    grupos = np.split(orden, np.flatnonzero(np.diff(codigos[orden])) + 1)
+    return {claves[codigos[g[0]]]: [filas[i] for i in g] for g in grupos}
+
+
+class _Particion:
+    """Un mes de movimientos: las filas nuevas se tipan e indexan recién al consultar.
+
+    De las filas con algún valor inválido se guarda además la fila original
+    (en `crudas`, alineada con `df`), así `texto()` puede devolverla tal cual.
+    """
+
+    def __init__(self):
+        self.df = None
+        self.crudas = None
+        self.nuevas = []
+        self.por_codigo = None
+        self.por_tipo = None
+        self.invalidos = Counter()
+
+    def tabla(self):
+        if self.nuevas:
+            nuevo, invalidos, malas = _tipar(self.nuevas)
+            self.invalidos.update(invalidos)
+            crudas = np.full(len(nuevo), None, dtype=object)
+            for i in np.flatnonzero(malas):
+                crudas[i] = self.nuevas[i]
+            self.nuevas = []
+            if self.df is None:
+                self.df, self.crudas = nuevo, crudas
+            else:
+                self.df = pd.concat([self.df, nuevo], ignore_index=True)
+                self.crudas = np.concatenate([self.crudas, crudas])
+            if not self.df["timestamp"].is_monotonic_increasing:
+                # NaT al final, como sort_values
+                orden = np.argsort(self.df["timestamp"].to_numpy(), kind="stable")
+                self.df = self.df.iloc[orden].reset_index(drop=True)
+                self.crudas = self.crudas[orden]
+            self.por_codigo = self.por_tipo = None
+        return self.df
+
+    def texto(self):
+        """Columnas de texto (en el orden de movimientos_headers) que al tiparse dan esta partición"""
+        df = self.tabla()
+        # datetime_as_string es mucho más rápido que dt.strftime y da el mismo formato
+        ts = np.datetime_as_string(df["timestamp"].to_numpy().astype("datetime64[s]"))
+        columnas = [np.where(ts == "NaT", "", ts).tolist()]
+        for col in movimientos_headers[1:]:
+            if col in _NUMERICAS:
+                columnas.append([str(x) for x in como_python(df[col].to_numpy(dtype=float))])
+            else:
+                columnas.append(df[col].tolist())
+        # Las filas con valores inválidos van como llegaron: al volver a tiparlas se cuentan igual
+        for i in np.flatnonzero(np.not_equal(self.crudas, None)):
+            fila = self.crudas[i]
+            for j, columna in enumerate(columnas):
+                columna[i] = _celda(fila[j]) if j < len(fila) else ""
+        return columnas
+
+    def indices(self):
+        df = self.tabla()
+        if self.por_codigo is None:
+            self.por_codigo = df.groupby("codigo", sort=False).indices
+            self.por_tipo = df.groupby("tipo", sort=False).indices
+        return self.por_codigo, self.por_tipo
+
+
+def resumir(df, frecuencia="D"):
+    """Cantidad sumada por período (filas) y tipo (columnas), sin recorrer fila por fila"""
+    periodo = df["timestamp"].dt.to_period(frecuencia).dt.start_time.rename("periodo")
+    return df.groupby([periodo, df["tipo"]])["cantidad"].sum().unstack("tipo", fill_value=0)
+
+
+def _mes_en_rango(clave, desde, hasta):
+    if not clave:
+        # Movimientos sin fecha válida: solo aparecen en consultas sin rango
+        return desde is None and hasta is None
+    inicio = pd.Timestamp(clave + "-01")
+    fin = inicio + pd.offsets.MonthBegin(1)
+    return (hasta is None or inicio < hasta) and (desde is None or fin > desde)
+
+
+class HistorialMovimientos:
+    """Almacén de solo agregado con índices por timestamp, codigo y tipo.
+
+    Cada mes se guarda ordenado por timestamp, así un rango de fechas es una
+    búsqueda binaria y solo se leen las particiones que lo tocan. Los meses ya
+    cerrados se tipan e indexan una sola vez. Los resúmenes por período de
+    `serie()` se guardan por filtro hasta que llega un movimiento nuevo.
+    """
+
+    def __init__(self, filas=()):
+        self._particiones = {}
+        self._n = 0
+        self._version = 0
+        self._series = {}
+        self._lock = threading.Lock()
+        self.extend(filas)
+
+    def __len__(self):
+        return self._n
+
+    def append(self, fila):
+        with self._lock:
+            self._particiones.setdefault(_clave_mes(fila), _Particion()).nuevas.append(list(fila))
+            self._n += 1
+            self._version += 1
+
+    def extend(self, filas):
+        """Agrega muchas filas; no se copian, así que no deben modificarse después"""
+        grupos = _agrupar_por_mes(filas)
+        with self._lock:
+            for clave, grupo in grupos.items():
+                self._particiones.setdefault(clave, _Particion()).nuevas.extend(grupo)
+                self._n += len(grupo)
+            self._version += 1
+
+    def reemplazar(self, filas):
+        nuevo = HistorialMovimientos(filas)
+        with self._lock:
+            self._particiones, self._n = nuevo._particiones, nuevo._n
+            self._version += 1
+
+    def invalidos(self):
+        """Valores que no eran fecha o número (quedaron NaT o 0) por columna, en los meses ya tipados.
+
+        Las filas sin fecha válida (partición "") se tipan acá: las consultas
+        con rango de fechas nunca las tocan y sus errores no se contarían.
+        """
+        total = Counter()
+        with self._lock:
+            if "" in self._particiones:
+                self._particiones[""].tabla()
+            for particion in self._particiones.values():
+                total.update(particion.invalidos)
+        return {c: n for c, n in total.items() if n}
+
+    def por_mes(self):
+        """DataFrame tipado de cada mes, en orden, para recorrer todo sin juntarlo en memoria"""
+        with self._lock:
+            claves = sorted(self._particiones)
+        for clave in claves:
+            with self._lock:
+                particion = self._particiones.get(clave)
+                df = particion.tabla() if particion is not None else None
+            if df is not None and len(df):
+                yield df
+
+    def texto_por_mes(self):
+        """_Particion.texto() de cada mes, en orden: el historial como texto, sin juntarlo en memoria"""
+        with self._lock:
+            claves = sorted(self._particiones)
+        for clave in claves:
+            with self._lock:
+                particion = self._particiones.get(clave)
+                columnas = particion.texto() if particion is not None else None
+            if columnas and columnas[0]:
+                yield columnas
+
+    def consultar(self, desde=None, hasta=None, codigo=None, tipo=None):
+        """Movimientos con desde <= timestamp < hasta, filtrados por codigo y tipo"""
+        partes = []
+        with self._lock:
+            for clave in sorted(self._particiones):
+                if not _mes_en_rango(clave, desde, hasta):
+                    continue
+                particion = self._particiones[clave]
+                df = particion.tabla()
+                ts = df["timestamp"].to_numpy()
+                i0 = 0 if desde is None else ts.searchsorted(np.datetime64(desde), "left")
+                i1 = len(df) if hasta is None else ts.searchsorted(np.datetime64(hasta), "left")
+                if i0 >= i1:
+                    continue
+                pos = np.arange(i0, i1)
+                if codigo is not None or tipo is not None:
+                    por_codigo, por_tipo = particion.indices()
+                    for indice, valor in ((por_codigo, codigo), (por_tipo, tipo)):
+                        if valor is None:
+                            continue
+                        sel = indice.get(valor, np.empty(0, dtype=np.intp))
+                        pos = np.intersect1d(pos, sel, assume_unique=True)
+                if len(pos):
+                    partes.append(df.iloc[pos])
+        if not partes:
+            return _tipar([])[0]
+        return pd.concat(partes, ignore_index=True)
+
+    def serie(self, desde=None, hasta=None, codigo=None, tipo=None, frecuencia="D"):
+        """resumir() de una consulta, guardado por filtro mientras no cambie el historial"""
+        clave = (desde, hasta, codigo, tipo, frecuencia)
+        with self._lock:
+            version, resultado = self._series.get(clave, (None, None))
+            if version == self._version:
+                return resultado
+            version = self._version
+        resultado = resumir(self.consultar(desde, hasta, codigo, tipo), frecuencia)
+        with self._lock:
+            if len(self._series) >= _MAX_SERIES:
+                self._series.pop(next(iter(self._series)))
+            self._series[clave] = (version, resultado)
+        return resultado
@@ -0,0 +1,279 @@
+"""Sincronización incremental entre la memoria de la app y Google Sheets."""
+import csv
+import os
+import threading
+import time
+from collections import Counter
+
+
+def _fila_canonica(fila, n_columnas):
+    """Ajusta la fila al ancho de la pestaña y reemplaza None por vacío"""
+    fila = list(fila) + ["" for _ in range(n_columnas - len(fila))]
+    return ["" if celda is None else celda for celda in fila[:n_columnas]]
+
+
+def _a_celda(valor):
+    """Convierte un valor de Python en un CellData de la API de Sheets"""
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return {"userEnteredValue": {"numberValue": valor}}
+    return {"userEnteredValue": {"stringValue": str(valor)}}
+
+
+def _agrupar_consecutivos(indices):
+    """Agrupa índices ordenados en rangos [inicio, fin) contiguos"""
+    rangos = []
+    for i in indices:
+        if rangos and rangos[-1][1] == i:
+            rangos[-1][1] = i + 1
+        else:
+            rangos.append([i, i + 1])
+    return rangos
+
+
+class SincronizadorHoja:
+    """Recuerda en qué fila vive cada registro de una pestaña y envía solo los cambios.
+
+    `clave` recibe una fila y devuelve lo que la identifica (por ejemplo
+    codigo + fecha de vencimiento para un lote). Las filas repetidas se
+    distinguen por su número de aparición.
+    """
+
+    def __init__(self, ws_name, headers, clave):
+        self.ws_name = ws_name
+        self.headers = headers
+        self.clave = clave
+        # Lista de (clave, fila) en el mismo orden que la hoja (sin el header).
+        # None significa que no sabemos qué hay escrito y hay que reescribir todo.
+        self.filas = None
+
+    def conoce_hoja(self):
+        return self.filas is not None
+
+    def olvidar(self):
+        self.filas = None
+
+    def _con_claves(self, filas):
+        vistos = Counter()
+        resultado = []
+        for fila in filas:
+            fila = _fila_canonica(fila, len(self.headers))
+            base = self.clave(fila)
+            resultado.append(((base, vistos[base]), fila))
+            vistos[base] += 1
+        return resultado
+
+    def registrar(self, filas):
+        """Registra el contenido actual de la pestaña, en el orden de la hoja"""
+        self.filas = self._con_claves(filas)
+
+    def calcular_cambios(self, filas_nuevas):
+        """Compara lo escrito con lo nuevo.
+
+        Devuelve (actualizaciones, borrados, altas, resultado): actualizaciones es
+        una lista de (indice, columnas_cambiadas, fila), borrados los índices a
+        eliminar, altas las filas a agregar al final y resultado el estado que
+        quedará en la hoja.
+        """
+        nuevas = self._con_claves(filas_nuevas)
+        posicion = {clave: i for i, (clave, _) in enumerate(self.filas)}
+        claves_nuevas = set()
+
+        actualizaciones, altas = [], []
+        actual = list(self.filas)
+        for clave, fila in nuevas:
+            claves_nuevas.add(clave)
+            i = posicion.get(clave)
+            if i is None:
+                altas.append((clave, fila))
+                continue
+            anterior = actual[i][1]
+            cambiadas = [j for j, (a, b) in enumerate(zip(anterior, fila)) if a != b]
+            if cambiadas:
+                actualizaciones.append((i, cambiadas, fila))
+                actual[i] = (clave, fila)
+
+        borrados = [i for i, (clave, _) in enumerate(self.filas) if clave not in claves_nuevas]
+        borrados_set = set(borrados)
+        resultado = [par for i, par in enumerate(actual) if i not in borrados_set] + altas
+        return actualizaciones, borrados, [fila for _, fila in altas], resultado
+
+    def sincronizar(self, sh, filas_nuevas):
+        """Envía las diferencias en un único batch_update. Devuelve la cantidad de pedidos enviados."""
+        actualizaciones, borrados, altas, resultado = self.calcular_cambios(filas_nuevas)
+        if not (actualizaciones or borrados or altas):
+            self.filas = resultado
+            return 0
+        ws = sh.worksheet(self.ws_name)
+        hoja_id = ws.id
+        pedidos = []
+
+        # 1) Celdas modificadas, con los índices previos a los borrados (fila 0 = header)
+        for i, cambiadas, fila in actualizaciones:
+            ini, fin = min(cambiadas), max(cambiadas) + 1
+            pedidos.append({"updateCells": {
+                "range": {"sheetId": hoja_id, "startRowIndex": i + 1, "endRowIndex": i + 2,
+                          "startColumnIndex": ini, "endColumnIndex": fin},
+                "rows": [{"values": [_a_celda(v) for v in fila[ini:fin]]}],
+                "fields": "userEnteredValue",
+            }})
+
+        # 2) Borrados de abajo hacia arriba para no desplazar los índices pendientes
+        for ini, fin in reversed(_agrupar_consecutivos(borrados)):
+            pedidos.append({"deleteDimension": {"range": {
+                "sheetId": hoja_id, "dimension": "ROWS", "startIndex": ini + 1, "endIndex": fin + 1,
+            }}})
+
+        # 3) Filas nuevas al final
+        if altas:
+            pedidos.append({"appendCells": {
+                "sheetId": hoja_id,
+                "rows": [{"values": [_a_celda(v) for v in fila]} for fila in altas],
+                "fields": "userEnteredValue",
+            }})
+
+        try:
+            sh.batch_update({"requests": pedidos})
+        except Exception:
+            # No sabemos cuánto se aplicó: la próxima escritura será completa
+            self.olvidar()
+            raise
+        self.filas = resultado
+        return len(pedidos)
+
+
+class BufferMovimientos:
+    """Acumula filas de movimientos y las escribe juntas con un solo append_rows.
+
+    Se vacía cuando se pide explícitamente (por ejemplo al confirmar una salida)
+    o cuando se supera `max_filas` o `max_segundos` desde la fila más antigua.
+    `agregar` nunca escribe: quien use el buffer consulta `debe_vaciar` y
+    `espera` desde su propio hilo (ver RepositorioSheets). Si la escritura
+    falla las filas vuelven a la cola, en el mismo orden.
+    """
+
+    def __init__(self, ws_name, max_filas=200, max_segundos=30):
+        self.ws_name = ws_name
+        self.max_filas = max_filas
+        self.max_segundos = max_segundos
+        self._pendientes = []
+        self._desde = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pendientes)
+
+    def pendientes(self):
+        with self._lock:
+            return list(self._pendientes)
+
+    def agregar(self, fila):
+        with self._lock:
+            if not self._pendientes:
+                self._desde = time.monotonic()
+            self._pendientes.append([str(x) for x in fila])
+
+    def debe_vaciar(self):
+        with self._lock:
+            if not self._pendientes:
+                return False
+            return (len(self._pendientes) >= self.max_filas
+                    or time.monotonic() - self._desde >= self.max_segundos)
+
+    def espera(self):
+        """Segundos hasta que toque vaciar por tiempo; None si no hay nada pendiente"""
+        with self._lock:
+            if not self._pendientes:
+                return None
+            if len(self._pendientes) >= self.max_filas:
+                return 0
+            return max(0, self._desde + self.max_segundos - time.monotonic())
+
+    def vaciar(self, sh):
+        """Escribe todo lo pendiente. Devuelve la cantidad de filas escritas."""
+        with self._lock:
+            filas, self._pendientes = self._pendientes, []
+            desde, self._desde = self._desde, None
+        if not filas:
+            return 0
+        try:
+            sh.worksheet(self.ws_name).append_rows(filas)
+        except Exception:
+            with self._lock:
+                # Lo que llegó mientras tanto queda detrás de lo que falló
+                self._pendientes = filas + self._pendientes
+                self._desde = desde
+            raise
+        return len(filas)
+
+
+class CopiaLocalHoja:
+    """Copia en disco (CSV) de las filas ya descargadas de una pestaña de solo agregado.
+
+    Permite pedir a Sheets únicamente las filas que se agregaron desde la
+    última lectura. Las filas se guardan como texto, igual que las devuelve
+    get_all_values.
+    """
+
+    def __init__(self, ruta, n_columnas):
+        self.ruta = ruta
+        self.n_columnas = n_columnas
+        self._filas = None
+
+    def _normalizar(self, fila):
+        fila = [str(x) for x in fila[:self.n_columnas]]
+        return fila + [""] * (self.n_columnas - len(fila))
+
+    def filas(self):
+        if self._filas is None:
+            self._filas = []
+            if os.path.exists(self.ruta):
+                with open(self.ruta, newline="", encoding="utf-8") as f:
+                    self._filas = [self._normalizar(fila) for fila in csv.reader(f)]
+        return self._filas
+
+    def agregar(self, filas):
+        filas = [self._normalizar(f) for f in filas]
+        with open(self.ruta, "a", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(filas)
+        self.filas().extend(filas)
+
+    def reemplazar(self, filas):
+        filas = [self._normalizar(f) for f in filas]
+        temporal = self.ruta + ".tmp"
+        with open(temporal, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(filas)
+        os.replace(temporal, self.ruta)
+        self._filas = filas
+
+    def rango(self):
+        """Rango A1 con las filas a pedir (desde la última conocida), o None si hay que traer todo"""
+        n = len(self.filas())
+        # Fila 1 = header, la última conocida es la n + 1
+        return f"A{n + 1}:{_letra_columna(self.n_columnas)}" if n else None
+
+    def aplicar(self, recientes):
+        """Agrega lo leído desde `rango()`; False si la pestaña cambió y hay que leerla completa.
+
+        Se vuelve a pedir la última fila conocida para detectar si la pestaña se
+        reescribió o se borraron filas.
+        """
+        if recientes and self._normalizar(recientes[0]) == self.filas()[-1]:
+            if len(recientes) > 1:
+                self.agregar(recientes[1:])
+            return True
+        return False
+
+    def actualizar(self, ws):
+        """Trae de la pestaña solo las filas nuevas y devuelve todas las filas de datos"""
+        rango = self.rango()
+        if rango is None or not self.aplicar(ws.get(rango)):
+            self.reemplazar(ws.get_all_values()[1:])
+        return self._filas
+
+
+def _letra_columna(n):
+    letras = ""
+    while n:
+        n, resto = divmod(n - 1, 26)
+        letras = chr(65 + resto) + letras
+    return letras
@@ -0,0 +1,174 @@
+"""Importación masiva de lotes desde CSV/XLSX y exportación por bloques."""
+import csv
+import io
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from repositorio import inventario_headers
+
+TAMANO_BLOQUE = 5000
+# stock_min es opcional: si viene, actualiza el stock mínimo del producto
+COLUMNAS_IMPORTACION = inventario_headers + ["stock_min"]
+_OBLIGATORIAS = ["codigo", "cantidad"]
+
+
+def _bloques_csv(archivo, tamano):
+    yield from pd.read_csv(archivo, dtype=str, keep_default_na=False, chunksize=tamano)
+
+
+def _celda(valor):
+    """Texto de una celda de openpyxl igual que en un CSV: los números enteros sin '.0'"""
+    if valor is None:
+        return ""
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+
+def _bloques_xlsx(archivo, tamano):
+    # read_only no carga la planilla entera: las filas se leen a medida que se piden
+    libro = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        filas = libro.active.iter_rows(values_only=True)
+        encabezado = [_celda(c) for c in next(filas, ())]
+        ancho = len(encabezado)
+        bloque = []
+        for fila in filas:
+            # Todo como texto, como el CSV con dtype=str: una celda vacía no vuelve float a la columna
+            fila = [_celda(c) for c in fila[:ancho]]
+            bloque.append(fila + [""] * (ancho - len(fila)))
+            if len(bloque) >= tamano:
+                yield pd.DataFrame(bloque, columns=encabezado)
+                bloque = []
+        if bloque:
+            yield pd.DataFrame(bloque, columns=encabezado)
+    finally:
+        libro.close()
+
+
+def leer_bloques(archivo, nombre, tamano=TAMANO_BLOQUE):
+    """DataFrames de a `tamano` filas, según la extensión del archivo"""
+    if nombre.lower().endswith((".xlsx", ".xlsm")):
+        return _bloques_xlsx(archivo, tamano)
+    return _bloques_csv(archivo, tamano)
+
+
+def _texto(serie):
+    return serie.astype("string").fillna("").str.strip()
+
+
+def _numero(serie):
+    # float64 común: lo que no es número queda NaN (no pd.NA) y las comparaciones dan False
+    return pd.to_numeric(_texto(serie), errors="coerce").astype("float64")
+
+
+def validar_bloque(df, inicio=0):
+    """Normaliza y valida un bloque de una vez por columna.
+
+    Devuelve (lotes válidos, errores) donde errores es una lista de
+    (fila del archivo, motivo); `inicio` es cuántas filas de datos hubo antes.
+    """
+    df = df.rename(columns=lambda c: str(c).strip().lower())
+    faltan = [c for c in _OBLIGATORIAS if c not in df.columns]
+    if faltan:
+        raise ValueError(f"Faltan columnas: {', '.join(faltan)}")
+    n = len(df)
+    fila = pd.Series(np.arange(inicio, inicio + n) + 2, index=df.index) # +2: encabezado y base 1
+    vacio = pd.Series("", index=df.index, dtype="string")
+    # Las filas sin ningún dato (por ejemplo al final de la planilla) se saltean sin error
+    vacia = pd.concat([_texto(df[c]) == "" for c in df.columns], axis=1).all(axis=1).to_numpy()
+
+    codigo = _texto(df["codigo"])
+    nombre = _texto(df["nombre"]) if "nombre" in df else vacio
+    marca = _texto(df["marca"]) if "marca" in df else vacio
+    cantidad = _numero(df["cantidad"])
+    # Mismo criterio que normalizar_fecha: se descarta la hora
+    fv = _texto(df["fecha_vencimiento"]) if "fecha_vencimiento" in df else vacio
+    fv = fv.str.split(" ").str[0].str.split("T").str[0]
+    fecha = pd.to_datetime(fv, format="%Y-%m-%d", errors="coerce")
+    precios = {c: _numero(df[c]) if c in df else pd.Series(0.0, index=df.index)
+               for c in ("precio_costo", "precio_venta")}
+    stock_min = _numero(df["stock_min"]) if "stock_min" in df else pd.Series(np.nan, index=df.index)
+
+    motivos = [
+        (codigo == "", "código vacío"),
+        (cantidad.isna() | (cantidad <= 0) | (cantidad % 1 != 0), "cantidad inválida"),
+        ((fv != "") & fecha.isna(), "fecha inválida (use AAAA-MM-DD)"),
+    ] + [((precios[c].isna() & (_texto(df[c]) != "")) | (precios[c] < 0), f"{c} inválido")
+         for c in precios if c in df]
+
+    malo = pd.Series(False, index=df.index)
+    errores = []
+    for mascara, motivo in motivos:
+        mascara = mascara.to_numpy(dtype=bool) & ~vacia
+        errores.extend((int(f), motivo) for f in fila[mascara])
+        malo |= mascara
+
+    ok = ~(malo | vacia)
+    lotes = pd.DataFrame({
+        "codigo": codigo[ok].astype(str),
+        "nombre": nombre[ok].astype(str),
+        "marca": marca[ok].astype(str),
+        "cantidad": cantidad[ok].astype("int64"),
+        # Normalizada (to_datetime acepta "2025-6-1"): igual que la escriben el formulario y la tabla
+        "fecha_vencimiento": fecha[ok].dt.strftime("%Y-%m-%d").fillna("").astype(str),
+        "precio_costo": precios["precio_costo"][ok].fillna(0),
+        "precio_venta": precios["precio_venta"][ok].fillna(0),
+        "stock_min": stock_min[ok],
+    })
+    return lotes, sorted(errores)
+
+
+def consolidar(lotes):
+    """Suma en un solo lote las filas con el mismo código y vencimiento (regla del formulario)"""
+    if lotes.empty:
+        return lotes
+    return lotes.groupby(["codigo", "fecha_vencimiento"], sort=False, as_index=False).agg(
+        nombre=("nombre", "first"), marca=("marca", "first"), cantidad=("cantidad", "sum"),
+        precio_costo=("precio_costo", "first"), precio_venta=("precio_venta", "first"),
+        stock_min=("stock_min", "last"),
+    )[COLUMNAS_IMPORTACION]
+
+
+def validar_archivo(archivo, nombre, tamano=TAMANO_BLOQUE):
+    """Lee el archivo por bloques; devuelve (lotes consolidados, errores)"""
+    partes, errores, leidas = [], [], 0
+    for bloque in leer_bloques(archivo, nombre, tamano):
+        lotes, errores_bloque = validar_bloque(bloque, leidas)
+        leidas += len(bloque)
+        partes.append(consolidar(lotes))
+        errores.extend(errores_bloque)
+    if not partes:
+        return pd.DataFrame(columns=COLUMNAS_IMPORTACION), errores
+    return consolidar(pd.concat(partes, ignore_index=True)), errores
+
+
+def exportar(bloques, formato="csv", hoja="datos"):
+    """Escribe DataFrames de a uno como CSV o XLSX y devuelve el archivo en bytes.
+
+    Los bloques se recorren una sola vez; st.download_button necesita el
+    contenido entero (bytes), así que no se devuelve un archivo abierto.
+    """
+    salida = io.BytesIO()
+    if formato == "xlsx":
+        libro = openpyxl.Workbook(write_only=True)
+        ws = libro.create_sheet(hoja)
+        encabezado = True
+        for df in bloques:
+            if encabezado:
+                ws.append(list(df.columns))
+                encabezado = False
+            for fila in df.itertuples(index=False):
+                ws.append(["" if pd.isna(v) else v for v in fila])
+        libro.save(salida)
+    else:
+        texto = io.TextIOWrapper(salida, encoding="utf-8-sig", newline="")
+        encabezado = True
+        for df in bloques:
+            df.to_csv(texto, header=encabezado, index=False, quoting=csv.QUOTE_MINIMAL)
+            encabezado = False
+        texto.flush()
+        texto.detach()
+    return salida.getvalue()
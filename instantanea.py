@@ -0,0 +1,242 @@
+"""Copia en disco del estado cargado, para arrancar sin esperar a la red."""
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from metricas import metricas
+from repositorio import filas_inventario, inventario_headers, movimientos_headers
+
+FORMATO = 2
+_SEPARADOR = "\x00"
+
+
+def _flotante(valor):
+    try:
+        return float(valor)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def _numero(valor):
+    """int cuando no tiene decimales, como lo deja la carga desde el backend"""
+    return int(valor) if valor.is_integer() else valor
+
+
+def _empaquetar(valores):
+    """Una columna de texto como un solo arreglo de bytes UTF-8, los valores separados por NUL.
+
+    Un arreglo de texto de NumPy reserva para cada celda el ancho de la más
+    larga; así cada valor ocupa lo que mide y leerlo es un decode y un split.
+    """
+    valores = [str(v) for v in valores]
+    texto = _SEPARADOR.join(valores)
+    if texto.count(_SEPARADOR) != max(len(valores) - 1, 0):
+        # Una celda con NUL partiría la columna: se le quita
+        texto = _SEPARADOR.join(v.replace(_SEPARADOR, "") for v in valores)
+    return np.frombuffer(texto.encode("utf-8"), dtype=np.uint8)
+
+
+def _desempaquetar(arreglo, n):
+    if n == 0:
+        return []
+    valores = arreglo.tobytes().decode("utf-8").split(_SEPARADOR)
+    if len(valores) != n:
+        raise ValueError(f"columna con {len(valores)} valores, se esperaban {n}")
+    return valores
+
+
+class InstantaneaDisco:
+    """Inventario, stock mínimo y movimientos en un .npz comprimido, con un sello de versión.
+
+    Cada columna es un arreglo NumPy (sin pickle): los números de lotes y
+    stock mínimo en float64 y cada columna de texto en bytes UTF-8 (ver
+    `_empaquetar`). Los movimientos se guardan como texto, tal como los
+    devuelve `HistorialMovimientos.texto_por_mes()`: al cargarlos se vuelven
+    a tipar y los valores inválidos se siguen contando. El sello dice de qué backend salió
+    (`origen`), qué versión del almacén tenía y cuándo se escribió; una copia
+    de otro origen o de otro formato no se usa. La escritura va a un archivo
+    temporal y se reemplaza de una vez: nunca queda una copia a medias.
+    """
+
+    def __init__(self, ruta, origen):
+        self.ruta = ruta
+        self.origen = origen
+
+    def existe(self):
+        return os.path.exists(self.ruta)
+
+    def guardar(self, inventario, stock_minimo, movimientos, version):
+        """`inventario` es codigo -> lotes y `movimientos` un HistorialMovimientos"""
+        lotes = filas_inventario(inventario)
+        texto_mov = [[] for _ in movimientos_headers]
+        for columnas in movimientos.texto_por_mes():
+            for todas, parte in zip(texto_mov, columnas):
+                todas.extend(parte)
+        n_mov = len(texto_mov[0])
+        sello = {
+            "formato": FORMATO, "origen": self.origen, "version": version,
+            "guardado": datetime.now().isoformat(timespec="seconds"),
+            "lotes": len(lotes), "movimientos": n_mov,
+        }
+        arreglos = {
+            "sello": np.asarray(json.dumps(sello, ensure_ascii=False)),
+            "lotes_numeros": np.asarray([[_flotante(f[i]) for i in (3, 5, 6)] for f in lotes], dtype=float).reshape(-1, 3),
+            "minimo_codigos": _empaquetar(stock_minimo),
+            "minimo_valores": np.asarray([_flotante(v) for v in stock_minimo.values()], dtype=float),
+        }
+        for i in (0, 1, 2, 4):
+            arreglos[f"lotes_{inventario_headers[i]}"] = _empaquetar(f[i] for f in lotes)
+        for col, valores in zip(movimientos_headers, texto_mov):
+            arreglos[f"mov_{col}"] = _empaquetar(valores)
+        temporal = self.ruta + ".tmp"
+        with open(temporal, "wb") as f:
+            np.savez_compressed(f, **arreglos)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self.ruta)
+        return sello
+
+    def cargar(self):
+        """Devuelve (inventario, stock_minimo, movimientos, sello) como los devuelve un backend.
+
+        Lanza ValueError si la copia es de otro formato u otro origen.
+        """
+        with np.load(self.ruta, allow_pickle=False) as datos:
+            sello = json.loads(str(datos["sello"]))
+            if sello.get("formato") != FORMATO or sello.get("origen") != self.origen:
+                raise ValueError(f"instantánea de otro origen o formato: {sello.get('origen')}")
+            n_lotes, n_mov = sello["lotes"], sello["movimientos"]
+            lotes_texto = [_desempaquetar(datos[f"lotes_{inventario_headers[i]}"], n_lotes) for i in (0, 1, 2, 4)]
+            lotes_numeros = datos["lotes_numeros"].tolist()
+            minimo_valores = datos["minimo_valores"].tolist()
+            minimo_codigos = _desempaquetar(datos["minimo_codigos"], len(minimo_valores))
+            texto_mov = [_desempaquetar(datos[f"mov_{col}"], n_mov) for col in movimientos_headers]
+
+        inventario = {}
+        for codigo, nombre, marca, fv, (cant, pc, pv) in zip(*lotes_texto, lotes_numeros):
+            inventario.setdefault(codigo, []).append({
+                'nombre': nombre, 'marca': marca, 'cantidad': _numero(cant),
+                'fecha_vencimiento': fv, 'precio_costo': _numero(pc), 'precio_venta': _numero(pv),
+            })
+        stock_minimo = {c: _numero(v) for c, v in zip(minimo_codigos, minimo_valores)}
+        # Filas de texto como las de la planilla, en el orden de movimientos_headers
+        movimientos = list(map(list, zip(*texto_mov)))
+        return inventario, stock_minimo, movimientos, sello
+
+
+class Reconciliador:
+    """Mantiene el almacén al día con el backend cuando se arrancó desde la instantánea.
+
+    Después de `arrancar_desde_disco()` (o de una carga fallida, con
+    `sin_conexion()`) el hilo lee el backend con `leer()` fuera de cualquier
+    lock y, si nadie cambió el almacén mientras tanto, lo aplica con
+    `aplicar(datos)` dentro de `almacen.lock`. Mientras `al_dia` sea False la
+    app no debe escribir. Si la lectura falla reintenta con espera
+    exponencial, igual que EspejoSheets. Ya al día, cada `intervalo`
+    segundos vuelve a escribir la instantánea si el almacén cambió.
+    """
+
+    def __init__(self, almacen, instantanea, leer, aplicar, intervalo=60, espera_inicial=2, espera_maxima=300):
+        self.almacen = almacen
+        self.instantanea = instantanea
+        self.leer = leer
+        self.aplicar = aplicar
+        self.intervalo = intervalo
+        self.espera_inicial = espera_inicial
+        self.espera_maxima = espera_maxima
+        self.al_dia = False
+        self.sello = None
+        self.ultimo_error = None
+        self.error_disco = None
+        self.intentos = 0
+        self._usada = False
+        self._guardada = None
+        self._evento = threading.Event()
+        self._hilo = threading.Thread(target=self._bucle, name="reconciliador", daemon=True)
+        self._hilo.start()
+
+    def arrancar_desde_disco(self):
+        """Carga la instantánea en el almacén (solo la primera vez); False si no hay una usable"""
+        if self._usada or not self.instantanea.existe():
+            return False
+        try:
+            with metricas.medir("instantanea.cargar"):
+                inventario, stock_minimo, movimientos, sello = self.instantanea.cargar()
+                with self.almacen.lock:
+                    self.almacen.reemplazar(inventario, stock_minimo, movimientos)
+                    self._guardada = self.almacen.version
+        except Exception as e:
+            self.error_disco = str(e)
+            return False
+        self._usada = True
+        self.sello = sello
+        self.al_dia = False
+        self._evento.set()
+        return True
+
+    def cargado(self):
+        """El almacén se acaba de cargar desde el backend: queda al día y se guarda la copia"""
+        self._usada = True
+        self.al_dia = True
+        self.ultimo_error = None
+        self.intentos = 0
+        self._evento.set()
+
+    def sin_conexion(self, error):
+        """Falló la carga desde el backend: se sigue con lo que hay en memoria y se reintenta"""
+        self.al_dia = False
+        self.ultimo_error = str(error)
+        self.almacen.cargado = True
+        self._evento.set()
+
+    def _reconciliar(self):
+        version = self.almacen.version
+        datos = self.leer()
+        with self.almacen.lock:
+            if self.almacen.version != version:
+                # Otra carga cambió el almacén mientras leíamos: se vuelve a leer
+                self._evento.set()
+                return
+            self.aplicar(datos)
+            self.al_dia = True
+
+    def _guardar(self):
+        with self.almacen.lock:
+            version = self.almacen.version
+            lotes = self.almacen.instantanea()
+            stock_minimo = dict(self.almacen.stock_minimo)
+        self.sello = self.instantanea.guardar(lotes, stock_minimo, self.almacen.movimientos, version)
+        self._guardada = version
+
+    def _bucle(self):
+        while True:
+            if self.intentos:
+                espera = min(self.espera_maxima, self.espera_inicial * 2 ** (self.intentos - 1))
+                time.sleep(espera * random.uniform(0.5, 1))
+            else:
+                self._evento.wait(self.intervalo)
+            self._evento.clear()
+            if not self.almacen.cargado:
+                continue
+            if not self.al_dia:
+                try:
+                    with metricas.medir("instantanea.reconciliar"):
+                        self._reconciliar()
+                    self.ultimo_error = None
+                    self.intentos = 0
+                except Exception as e:
+                    self.ultimo_error = str(e)
+                    self.intentos += 1
+                    continue
+            if self.al_dia and self.almacen.version != self._guardada:
+                try:
+                    with metricas.medir("instantanea.guardar"):
+                        self._guardar()
+                    self.error_disco = None
+                except Exception as e:
+                    self.error_disco = str(e)
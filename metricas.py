@@ -0,0 +1,99 @@
+"""Tiempos y contadores de las operaciones de la app, para el panel de rendimiento."""
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+
+class Metricas:
+    """Muestras (tiempos en ms u otros valores) y contadores del proceso.
+
+    De cada métrica se guardan las últimas `max_muestras` con su hora, para
+    calcular percentiles y exportarlas. Los contadores guardan el total y los
+    incrementos del último minuto, para comparar contra el cupo de la API.
+    """
+
+    def __init__(self, max_muestras=2000):
+        self.max_muestras = max_muestras
+        self._lock = threading.Lock()
+        self._muestras = defaultdict(lambda: deque(maxlen=self.max_muestras))
+        self._totales = defaultdict(int)
+        self._recientes = defaultdict(deque)
+        self.desde = datetime.now()
+
+    def registrar(self, nombre, valor):
+        with self._lock:
+            self._muestras[nombre].append((time.time(), valor))
+
+    @contextmanager
+    def medir(self, nombre):
+        """Registra en `nombre (ms)` cuánto tarda el bloque, aunque termine con una excepción"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registrar(f"{nombre} (ms)", (time.perf_counter() - inicio) * 1000)
+
+    def contar(self, nombre, n=1):
+        ahora = time.monotonic()
+        with self._lock:
+            self._totales[nombre] += n
+            recientes = self._recientes[nombre]
+            recientes.append((ahora, n))
+            while recientes and recientes[0][0] < ahora - 60:
+                recientes.popleft()
+
+    def total(self, nombre):
+        with self._lock:
+            return self._totales.get(nombre, 0)
+
+    def ultimo_minuto(self, nombre):
+        limite = time.monotonic() - 60
+        with self._lock:
+            return sum(n for t, n in self._recientes.get(nombre, ()) if t >= limite)
+
+    def contadores(self):
+        with self._lock:
+            return dict(self._totales)
+
+    def valores(self, nombre):
+        with self._lock:
+            return np.array([v for _, v in self._muestras.get(nombre, ())], dtype=float)
+
+    def resumen(self):
+        """Filas (métrica, n, p50, p95, máximo) ordenadas por nombre"""
+        with self._lock:
+            muestras = {n: np.array([v for _, v in m], dtype=float) for n, m in self._muestras.items() if m}
+        return [
+            {"metrica": n, "n": len(v), "p50": round(float(np.percentile(v, 50)), 3),
+             "p95": round(float(np.percentile(v, 95)), 3), "max": round(float(v.max()), 3)}
+            for n, v in sorted(muestras.items())
+        ]
+
+    def exportar_jsonl(self):
+        """Una línea JSON por muestra y una por contador"""
+        with self._lock:
+            muestras = [(t, n, v) for n, m in self._muestras.items() for t, v in m]
+            totales = dict(self._totales)
+        ahora = datetime.now().isoformat(timespec="seconds")
+        lineas = [json.dumps({"t": datetime.fromtimestamp(t).isoformat(timespec="milliseconds"),
+                              "metrica": n, "valor": v}, ensure_ascii=False)
+                  for t, n, v in sorted(muestras)]
+        lineas += [json.dumps({"t": ahora, "contador": n, "total": v}, ensure_ascii=False)
+                   for n, v in sorted(totales.items())]
+        return "\n".join(lineas) + "\n"
+
+    def reiniciar(self):
+        with self._lock:
+            self._muestras.clear()
+            self._totales.clear()
+            self._recientes.clear()
+            self.desde = datetime.now()
+
+
+# Un registro por proceso, compartido por todas las sesiones y los hilos de fondo
+metricas = Metricas()
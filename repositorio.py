@@ -0,0 +1,578 @@
+"""Backends de almacenamiento del inventario.
+
+`RepositorioSQLite` es el almacenamiento principal: cada entrada o salida se
+confirma en una base local en milisegundos. `RepositorioSheets` lee y escribe
+directamente en Google Sheets, y `EspejoSheets` copia en segundo plano lo que
+hay en SQLite a la planilla.
+"""
+import random
+import sqlite3
+import threading
+import time
+
+from conversiones import como_python, describir_errores, parsear_fechas, parsear_numeros
+from hojas import SincronizadorHoja, BufferMovimientos, CopiaLocalHoja
+from metricas import metricas
+
+INVENTARIO_WS = 'inventario'
+STOCK_MINIMO_WS = 'stock_minimo'
+MOVIMIENTOS_WS = 'movimientos'
+
+inventario_headers = ["codigo", "nombre", "marca", "cantidad", "fecha_vencimiento", "precio_costo", "precio_venta"]
+stock_minimo_headers = ['codigo', 'stock_min']
+movimientos_headers = ["timestamp", "tipo", "codigo", "nombre", "cantidad", "fecha_vencimiento", "precio_costo", "precio_venta"]
+
+
+def fila_lote(codigo, lote):
+    """Fila de la pestaña inventario para un lote, en el orden de inventario_headers"""
+    return [
+        codigo, lote.get('nombre', ""), lote.get('marca', ""), lote.get('cantidad', 0),
+        lote.get('fecha_vencimiento', ""), lote.get('precio_costo', 0), lote.get('precio_venta', 0)
+    ]
+
+
+def filas_inventario(inventario):
+    return [fila_lote(codigo, lote) for codigo, lotes in inventario.items() for lote in lotes]
+
+
+def _columnas(filas, n):
+    """Las filas como n columnas de texto (las cortas se completan con vacío)"""
+    return [[fila[i] if i < len(fila) else "" for fila in filas] for i in range(n)]
+
+
+def _invalidos(codigos, originales, posiciones):
+    """(fila de la hoja, valor) de las celdas que no se pudieron convertir, en filas con código"""
+    # +2: el header y la numeración desde 1
+    return [(int(i) + 2, originales[i]) for i in posiciones if codigos[i]]
+
+
+def parsear_inventario(filas):
+    """Lotes de la pestaña inventario (sin el header) convertidos por columna.
+
+    Devuelve (inventario, filas_hoja, errores): filas_hoja es el contenido tal
+    como lo escribiría guardar_inventario, para SincronizadorHoja, y errores
+    va de columna a las (fila, valor) que no eran número o fecha y se
+    cargaron como 0 o tal cual.
+    """
+    codigos, nombres, marcas, cantidades, fechas, costos, ventas = _columnas(filas, len(inventario_headers))
+    errores = {}
+    columnas = {}
+    for nombre, valores in (("cantidad", cantidades), ("precio_costo", costos), ("precio_venta", ventas)):
+        numeros, invalidos = parsear_numeros(valores)
+        columnas[nombre] = como_python(numeros)
+        errores[nombre] = _invalidos(codigos, valores, invalidos)
+    columnas["fecha_vencimiento"], invalidos = parsear_fechas(fechas)
+    errores["fecha_vencimiento"] = _invalidos(codigos, fechas, invalidos)
+    cantidades, fechas = columnas["cantidad"], columnas["fecha_vencimiento"]
+    costos, ventas = columnas["precio_costo"], columnas["precio_venta"]
+
+    inventario, filas_hoja = {}, []
+    for i, codigo in enumerate(codigos):
+        if not codigo:
+            # SincronizadorHoja la ajusta al ancho de la pestaña
+            filas_hoja.append(filas[i])
+            continue
+        lote = {
+            'nombre': nombres[i], 'marca': marcas[i], 'cantidad': cantidades[i],
+            'fecha_vencimiento': fechas[i], 'precio_costo': costos[i], 'precio_venta': ventas[i],
+        }
+        inventario.setdefault(codigo, []).append(lote)
+        filas_hoja.append(fila_lote(codigo, lote))
+    return inventario, filas_hoja, errores
+
+
+def parsear_stock_minimo(filas):
+    """Stock mínimo de la pestaña (sin el header); devuelve (stock_minimo, filas_hoja, errores)"""
+    codigos, minimos = _columnas(filas, len(stock_minimo_headers))
+    numeros, invalidos = parsear_numeros(minimos)
+    errores = {"stock_min": _invalidos(codigos, minimos, invalidos)}
+    minimos = como_python(numeros)
+    stock_minimo, filas_hoja = {}, []
+    for i, codigo in enumerate(codigos):
+        if codigo:
+            stock_minimo[codigo] = minimos[i]
+            filas_hoja.append([codigo, minimos[i]])
+        else:
+            filas_hoja.append(filas[i])
+    return stock_minimo, filas_hoja, errores
+
+
+class Repositorio:
+    """Interfaz común de los backends.
+
+    `cargar` devuelve (inventario, stock_minimo, movimientos) con la misma forma
+    que usa la app. Los guardados reciben opcionalmente los códigos que
+    cambiaron, para los backends que pueden escribir solo esos productos; los
+    que tienen `guarda_completo` necesitan igual el inventario entero.
+    """
+
+    guarda_completo = False
+
+    def cargar(self):
+        raise NotImplementedError
+
+    def guardar_inventario(self, inventario, codigos=None):
+        raise NotImplementedError
+
+    def guardar_stock_minimo(self, stock_minimo, codigos=None):
+        raise NotImplementedError
+
+    def agregar_movimiento(self, fila):
+        """Encola un movimiento; se persiste en `vaciar_movimientos`"""
+        raise NotImplementedError
+
+    def vaciar_movimientos(self):
+        raise NotImplementedError
+
+    def movimientos_pendientes(self):
+        """Movimientos encolados que todavía no se pudieron persistir"""
+        return []
+
+
+class RepositorioSheets(Repositorio):
+    """Lee y escribe directamente las pestañas de Google Sheets.
+
+    `conectar` es una función que devuelve el gspread.Spreadsheet y `avisar`
+    recibe los avisos que no interrumpen la carga (valores inválidos, pestañas
+    que no se pudieron crear); un error al leer una pestaña sí la interrumpe. Con
+    `ruta_copia_movimientos` el historial ya descargado se guarda en disco y
+    cada carga solo pide las filas nuevas. Los movimientos encolados los
+    escribe un hilo propio cuando el buffer lo pide (por cantidad o por
+    tiempo), así `agregar_movimiento` no llama a la red aunque se use dentro
+    de `almacen.lock`.
+    """
+
+    def __init__(self, conectar, avisar=None, ruta_copia_movimientos=None):
+        self.conectar = conectar
+        self.avisar = avisar or (lambda mensaje: None)
+        self.copia_movimientos = None
+        if ruta_copia_movimientos:
+            self.copia_movimientos = CopiaLocalHoja(ruta_copia_movimientos, len(movimientos_headers))
+        self.sync_inventario = SincronizadorHoja(INVENTARIO_WS, inventario_headers, clave=lambda f: (f[0], f[4]))
+        self.sync_stock_minimo = SincronizadorHoja(STOCK_MINIMO_WS, stock_minimo_headers, clave=lambda f: f[0])
+        self.buffer = BufferMovimientos(MOVIMIENTOS_WS)
+        self.error_vaciado = None
+        self._lock_vaciado = threading.Lock()
+        self._evento_vaciado = threading.Event()
+        self._hilo_vaciado = None
+
+    # La planilla se compara completa contra lo que hay en memoria
+    guarda_completo = True
+
+    def check_worksheets(self, sh):
+        """Asegura que las pestañas existan y tengan headers"""
+        try:
+            titulos_actuales = [ws.title for ws in sh.worksheets()]
+            if INVENTARIO_WS not in titulos_actuales:
+                ws = sh.add_worksheet(title=INVENTARIO_WS, rows=100, cols=10)
+                ws.append_row(inventario_headers)
+            if STOCK_MINIMO_WS not in titulos_actuales:
+                ws = sh.add_worksheet(title=STOCK_MINIMO_WS, rows=100, cols=5)
+                ws.append_row(stock_minimo_headers)
+            if MOVIMIENTOS_WS not in titulos_actuales:
+                ws = sh.add_worksheet(title=MOVIMIENTOS_WS, rows=100, cols=10)
+                ws.append_row(movimientos_headers)
+        except Exception as e:
+            self.avisar(f"Error verificando pestañas: {e}")
+
+    def _leer_pestanas(self, sh, movimientos=True):
+        """Valores de inventario, stock mínimo y (opcional) movimientos en un solo values_batch_get.
+
+        Con copia local de movimientos solo se piden las filas nuevas; devuelve
+        (valores por pestaña, rango pedido de movimientos).
+        """
+        rangos = [f"'{INVENTARIO_WS}'", f"'{STOCK_MINIMO_WS}'"]
+        rango_mov = None
+        if movimientos:
+            rango_mov = self.copia_movimientos.rango() if self.copia_movimientos is not None else None
+            rangos.append(f"'{MOVIMIENTOS_WS}'" + (f"!{rango_mov}" if rango_mov else ""))
+        respuesta = sh.values_batch_get(rangos)
+        return [r.get("values", []) for r in respuesta.get("valueRanges", [])], rango_mov
+
+    def _avisar_invalidos(self, ws_name, errores):
+        """Informa las celdas que no eran número o fecha, por columna"""
+        metricas.contar("carga.valores_invalidos", sum(len(e) for e in errores.values()))
+        texto = describir_errores(errores)
+        if texto:
+            self.avisar(f"Valores inválidos en {ws_name} (se cargaron como 0 o tal cual): {texto}")
+
+    def _leer_inventario(self, sh, valores=None):
+        try:
+            if valores is None:
+                valores = sh.worksheet(INVENTARIO_WS).get_all_values()
+            # filas_hoja: contenido de la hoja tal como lo escribiría guardar_inventario
+            inventario, filas_hoja, errores = parsear_inventario(valores[1:]) # Saltar header
+        except Exception:
+            self.sync_inventario.olvidar()
+            raise
+        self.sync_inventario.registrar(filas_hoja)
+        self._avisar_invalidos(INVENTARIO_WS, errores)
+        return inventario
+
+    def _leer_stock_minimo(self, sh, valores=None):
+        try:
+            if valores is None:
+                valores = sh.worksheet(STOCK_MINIMO_WS).get_all_values()
+            stock_minimo, filas_hoja, errores = parsear_stock_minimo(valores[1:])
+        except Exception:
+            self.sync_stock_minimo.olvidar()
+            raise
+        self.sync_stock_minimo.registrar(filas_hoja)
+        self._avisar_invalidos(STOCK_MINIMO_WS, errores)
+        return stock_minimo
+
+    def _leer_movimientos(self, sh, valores=None, rango=None):
+        if self.copia_movimientos is not None:
+            copia = self.copia_movimientos
+            if valores is not None and rango is None:
+                copia.reemplazar(valores[1:])
+            elif valores is None or not copia.aplicar(valores):
+                # Sin lectura previa, o la pestaña cambió desde la última vez: se pide de nuevo
+                copia.actualizar(sh.worksheet(MOVIMIENTOS_WS))
+            return list(copia.filas())
+        if valores is None:
+            valores = sh.worksheet(MOVIMIENTOS_WS).get_all_values()
+        return [fila[:len(movimientos_headers)] for fila in valores[1:]]
+
+    def cargar(self):
+        """Lee las tres pestañas; si alguna lectura falla lanza la excepción.
+
+        Nunca devuelve un inventario vacío por un error de red: quien llama
+        decide seguir con lo que tiene (por ejemplo la instantánea en disco).
+        """
+        sh = self.conectar()
+        try:
+            self.vaciar_movimientos() # Lo que siga pendiente se agrega a mano al final
+        except Exception:
+            pass
+        try:
+            # Un solo pedido para las tres pestañas; si alguna falta, falla y recién ahí se crean
+            valores, rango_mov = self._leer_pestanas(sh)
+        except Exception:
+            self.check_worksheets(sh)
+            valores, rango_mov = [None, None, None], None
+        inventario = self._leer_inventario(sh, valores[0])
+        stock_minimo = self._leer_stock_minimo(sh, valores[1])
+        movimientos = self._leer_movimientos(sh, valores[2], rango_mov)
+        movimientos.extend(self.buffer.pendientes())
+        return inventario, stock_minimo, movimientos
+
+    def leer_disposicion(self):
+        """Lee inventario y stock mínimo solo para saber en qué fila está cada registro"""
+        sh = self.conectar()
+        try:
+            valores, _ = self._leer_pestanas(sh, movimientos=False)
+        except Exception:
+            valores = [None, None]
+        self._leer_inventario(sh, valores[0])
+        self._leer_stock_minimo(sh, valores[1])
+
+    def _escribir_sheet(self, ws_name, headers, datos):
+        """Sobreescribe una pestaña completa con nuevos datos"""
+        ws = self.conectar().worksheet(ws_name)
+        ws.clear()
+        ws.append_row(headers)
+        if datos:
+            datos_limpios = []
+            for fila in datos:
+                fila_expandida = list(fila) + ["" for _ in range(len(headers) - len(fila))]
+                fila_str = [str(celda) if celda is not None else "" for celda in fila_expandida[:len(headers)]]
+                datos_limpios.append(fila_str)
+            ws.append_rows(datos_limpios, value_input_option='USER_ENTERED')
+
+    def _sincronizar_sheet(self, sincronizador, datos):
+        """Envía a la pestaña solo las celdas, altas y bajas que cambiaron"""
+        if sincronizador.conoce_hoja():
+            try:
+                sincronizador.sincronizar(self.conectar(), datos)
+                return
+            except Exception:
+                pass # La hoja no coincide con lo recordado: se reescribe completa
+        self._escribir_sheet(sincronizador.ws_name, sincronizador.headers, datos)
+        sincronizador.registrar(datos)
+
+    def guardar_inventario(self, inventario, codigos=None):
+        self._sincronizar_sheet(self.sync_inventario, filas_inventario(inventario))
+
+    def guardar_stock_minimo(self, stock_minimo, codigos=None):
+        self._sincronizar_sheet(self.sync_stock_minimo, [[k, v] for k, v in stock_minimo.items()])
+
+    def agregar_movimiento(self, fila):
+        self.buffer.agregar(fila)
+        if self._hilo_vaciado is None:
+            self._hilo_vaciado = threading.Thread(target=self._bucle_vaciado, name="vaciar-movimientos", daemon=True)
+            self._hilo_vaciado.start()
+        self._evento_vaciado.set()
+
+    def vaciar_movimientos(self):
+        # Un vaciado a la vez, para que las filas lleguen a la hoja en orden
+        with self._lock_vaciado:
+            if len(self.buffer):
+                self.buffer.vaciar(self.conectar())
+
+    def _bucle_vaciado(self):
+        while True:
+            self._evento_vaciado.clear()
+            self._evento_vaciado.wait(self.buffer.espera())
+            if not self.buffer.debe_vaciar():
+                continue
+            try:
+                with metricas.medir("vaciar_movimientos.fondo"):
+                    self.vaciar_movimientos()
+                self.error_vaciado = None
+            except Exception as e:
+                # Las filas siguen en el buffer: se reintenta pasado el plazo
+                self.error_vaciado = str(e)
+                time.sleep(self.buffer.max_segundos)
+
+    def escribir_movimientos(self, filas):
+        """Agrega filas a la pestaña de movimientos en una sola llamada, sin pasar por el buffer"""
+        if filas:
+            self.conectar().worksheet(MOVIMIENTOS_WS).append_rows([["" if x is None else str(x) for x in fila] for fila in filas])
+
+    def movimientos_pendientes(self):
+        return self.buffer.pendientes()
+
+
+ESQUEMA_SQLITE = """
+CREATE TABLE IF NOT EXISTS lotes (
+    id INTEGER PRIMARY KEY,
+    codigo TEXT NOT NULL,
+    nombre TEXT,
+    marca TEXT,
+    cantidad NUMERIC,
+    fecha_vencimiento TEXT,
+    precio_costo NUMERIC,
+    precio_venta NUMERIC
+);
+CREATE INDEX IF NOT EXISTS idx_lotes_codigo ON lotes(codigo);
+CREATE INDEX IF NOT EXISTS idx_lotes_vencimiento ON lotes(fecha_vencimiento);
+
+CREATE TABLE IF NOT EXISTS stock_minimo (
+    codigo TEXT PRIMARY KEY,
+    stock_min NUMERIC
+);
+
+CREATE TABLE IF NOT EXISTS movimientos (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT,
+    tipo TEXT,
+    codigo TEXT,
+    nombre TEXT,
+    cantidad NUMERIC,
+    fecha_vencimiento TEXT,
+    precio_costo NUMERIC,
+    precio_venta NUMERIC,
+    exportado INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_mov_timestamp ON movimientos(timestamp);
+CREATE INDEX IF NOT EXISTS idx_mov_codigo ON movimientos(codigo, timestamp);
+CREATE INDEX IF NOT EXISTS idx_mov_tipo ON movimientos(tipo, timestamp);
+CREATE INDEX IF NOT EXISTS idx_mov_sin_exportar ON movimientos(id) WHERE exportado = 0;
+
+-- Productos modificados que el espejo todavía no copió a Sheets
+CREATE TABLE IF NOT EXISTS cambios_sin_exportar (
+    codigo TEXT PRIMARY KEY
+);
+"""
+
+_COLUMNAS_LOTE = "codigo, nombre, marca, cantidad, fecha_vencimiento, precio_costo, precio_venta"
+_COLUMNAS_MOV = ", ".join(movimientos_headers)
+
+
+class RepositorioSQLite(Repositorio):
+    """Base SQLite local con tablas indexadas de lotes, stock mínimo y movimientos"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        # Una conexión compartida por los hilos de Streamlit y el espejo, protegida por lock
+        self.conn = sqlite3.connect(ruta, check_same_thread=False)
+        self.lock = threading.RLock()
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(ESQUEMA_SQLITE)
+        self._pendientes = []
+
+    def esta_vacio(self):
+        with self.lock:
+            for tabla in ("lotes", "stock_minimo", "movimientos"):
+                if self.conn.execute(f"SELECT 1 FROM {tabla} LIMIT 1").fetchone():
+                    return False
+        return True
+
+    def leer_inventario(self):
+        inventario = {}
+        with self.lock:
+            filas = self.conn.execute(f"SELECT {_COLUMNAS_LOTE} FROM lotes ORDER BY id").fetchall()
+        for codigo, nombre, marca, cant, fv, pc, pv in filas:
+            inventario.setdefault(codigo, []).append({
+                'nombre': nombre or "", 'marca': marca or "", 'cantidad': cant or 0,
+                'fecha_vencimiento': fv or "", 'precio_costo': pc or 0, 'precio_venta': pv or 0
+            })
+        return inventario
+
+    def leer_stock_minimo(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT codigo, stock_min FROM stock_minimo"))
+
+    def cargar(self):
+        self.vaciar_movimientos()
+        with self.lock:
+            movimientos = [list(f) for f in self.conn.execute(f"SELECT {_COLUMNAS_MOV} FROM movimientos ORDER BY id")]
+        return self.leer_inventario(), self.leer_stock_minimo(), movimientos
+
+    def importar(self, inventario, stock_minimo, movimientos, exportados=True):
+        """Reemplaza todo el contenido, por ejemplo con lo descargado de Sheets"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM lotes")
+            self.conn.execute("DELETE FROM stock_minimo")
+            self.conn.execute("DELETE FROM movimientos")
+            self.conn.execute("DELETE FROM cambios_sin_exportar")
+            if not exportados:
+                self._marcar_cambios(set(inventario) | set(stock_minimo))
+            self.conn.executemany(f"INSERT INTO lotes ({_COLUMNAS_LOTE}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  filas_inventario(inventario))
+            self.conn.executemany("INSERT INTO stock_minimo (codigo, stock_min) VALUES (?, ?)", stock_minimo.items())
+            self.conn.executemany(
+                f"INSERT INTO movimientos ({_COLUMNAS_MOV}, exportado) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [list(f) + [""] * (len(movimientos_headers) - len(f)) + [int(exportados)] for f in movimientos])
+
+    def _marcar_cambios(self, codigos):
+        # REPLACE le da un rowid nuevo, así un cambio durante una exportación no se pierde al limpiar
+        self.conn.executemany("INSERT OR REPLACE INTO cambios_sin_exportar (codigo) VALUES (?)", [(c,) for c in codigos])
+
+    def guardar_inventario(self, inventario, codigos=None):
+        with self.lock, self.conn:
+            if codigos is None:
+                self.conn.execute("DELETE FROM lotes")
+                codigos = list(inventario)
+            else:
+                self.conn.executemany("DELETE FROM lotes WHERE codigo = ?", [(c,) for c in codigos])
+            filas = [fila_lote(c, lote) for c in codigos for lote in inventario.get(c, [])]
+            self.conn.executemany(f"INSERT INTO lotes ({_COLUMNAS_LOTE}) VALUES (?, ?, ?, ?, ?, ?, ?)", filas)
+            self._marcar_cambios(codigos)
+
+    def guardar_stock_minimo(self, stock_minimo, codigos=None):
+        with self.lock, self.conn:
+            if codigos is None:
+                self.conn.execute("DELETE FROM stock_minimo")
+                codigos = list(stock_minimo)
+            self.conn.executemany("DELETE FROM stock_minimo WHERE codigo = ?",
+                                  [(c,) for c in codigos if c not in stock_minimo])
+            self.conn.executemany("INSERT OR REPLACE INTO stock_minimo (codigo, stock_min) VALUES (?, ?)",
+                                  [(c, stock_minimo[c]) for c in codigos if c in stock_minimo])
+            self._marcar_cambios(codigos)
+
+    def agregar_movimiento(self, fila):
+        with self.lock:
+            self._pendientes.append(list(fila))
+
+    def vaciar_movimientos(self):
+        with self.lock:
+            filas, self._pendientes = self._pendientes, []
+            try:
+                with self.conn:
+                    self.conn.executemany(f"INSERT INTO movimientos ({_COLUMNAS_MOV}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", filas)
+            except Exception:
+                # Como BufferMovimientos: lo que falló vuelve a la cola para el próximo intento
+                self._pendientes = filas + self._pendientes
+                raise
+
+    def movimientos_pendientes(self):
+        with self.lock:
+            return list(self._pendientes)
+
+    def movimientos_sin_exportar(self, limite=1000):
+        """Devuelve (ids, filas) de los movimientos que el espejo todavía no copió"""
+        with self.lock:
+            filas = self.conn.execute(
+                f"SELECT id, {_COLUMNAS_MOV} FROM movimientos WHERE exportado = 0 ORDER BY id LIMIT ?",
+                (limite,)).fetchall()
+        return [f[0] for f in filas], [list(f[1:]) for f in filas]
+
+    def marcar_exportados(self, ids):
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE movimientos SET exportado = 1 WHERE id = ?", [(i,) for i in ids])
+
+    def ultimo_cambio(self):
+        """Marca hasta la que llega una exportación que empieza ahora"""
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM cambios_sin_exportar").fetchone()[0]
+
+    def limpiar_cambios(self, hasta):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM cambios_sin_exportar WHERE rowid <= ?", (hasta,))
+
+    def sin_exportar(self):
+        """Productos modificados más movimientos que todavía no llegaron a Sheets"""
+        with self.lock:
+            cambios = self.conn.execute("SELECT COUNT(*) FROM cambios_sin_exportar").fetchone()[0]
+            movs = self.conn.execute("SELECT COUNT(*) FROM movimientos WHERE exportado = 0").fetchone()[0]
+        return cambios + movs + len(self._pendientes)
+
+
+class EspejoSheets:
+    """Copia en segundo plano el contenido de SQLite a Google Sheets.
+
+    Las escrituras quedan confirmadas en SQLite (que hace de diario local) y
+    el formulario sigue sin esperar a la red. `notificar()` despierta al hilo
+    después de cada escritura, y al arrancar exporta lo que quedó pendiente de
+    la ejecución anterior. Si una exportación falla, reintenta con espera
+    exponencial (con algo de azar) hasta `espera_maxima` segundos. Nunca
+    exporta una base local vacía sobre una planilla con datos.
+    """
+
+    def __init__(self, local, remoto, intervalo=60, espera_inicial=2, espera_maxima=300):
+        self.local = local
+        self.remoto = remoto
+        self.intervalo = intervalo
+        self.espera_inicial = espera_inicial
+        self.espera_maxima = espera_maxima
+        self.ultimo_error = None
+        self.intentos = 0
+        self._evento = threading.Event()
+        self._evento.set()
+        self._hilo = threading.Thread(target=self._bucle, name="espejo-sheets", daemon=True)
+        self._hilo.start()
+
+    def notificar(self):
+        self._evento.set()
+
+    def pendientes(self):
+        return self.local.sin_exportar()
+
+    def _bucle(self):
+        while True:
+            if self.intentos:
+                # Durante los reintentos las notificaciones no adelantan la espera
+                espera = min(self.espera_maxima, self.espera_inicial * 2 ** (self.intentos - 1))
+                time.sleep(espera * random.uniform(0.5, 1))
+            else:
+                self._evento.wait(self.intervalo)
+            self._evento.clear()
+            try:
+                with metricas.medir("espejo.exportar"):
+                    self.exportar()
+                self.ultimo_error = None
+                self.intentos = 0
+            except Exception as e:
+                self.ultimo_error = str(e)
+                self.intentos += 1
+
+    def exportar(self):
+        hasta = self.local.ultimo_cambio()
+        if not (self.remoto.sync_inventario.conoce_hoja() and self.remoto.sync_stock_minimo.conoce_hoja()):
+            self.remoto.leer_disposicion()
+        if self.local.esta_vacio() and (self.remoto.sync_inventario.filas or self.remoto.sync_stock_minimo.filas):
+            # Una base recién creada (o borrada) no pisa una planilla con datos: primero se importa
+            raise RuntimeError("La base local está vacía y la planilla tiene datos: no se exporta")
+        self.remoto.guardar_inventario(self.local.leer_inventario())
+        self.remoto.guardar_stock_minimo(self.local.leer_stock_minimo())
+        self.local.limpiar_cambios(hasta)
+        while True:
+            ids, filas = self.local.movimientos_sin_exportar()
+            if not ids:
+                break
+            self.remoto.escribir_movimientos(filas)
+            self.local.marcar_exportados(ids)
@@ -0,0 +1,290 @@
+"""Inventario en columnas: productos una vez por código y lotes en arreglos NumPy."""
+from bisect import insort
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+SIN_FECHA = 0         # Los ordinales de fecha empiezan en 1
+FECHA_INVALIDA = -1   # El texto original queda en _fv_invalidas
+_FIN_FIFO = 1 << 30   # Los lotes sin fecha válida se consumen al final
+_EPOCA = date(1970, 1, 1).toordinal()
+
+
+def _dia(fecha_vencimiento):
+    """Ordinal del vencimiento, SIN_FECHA o FECHA_INVALIDA"""
+    if not fecha_vencimiento:
+        return SIN_FECHA
+    try:
+        return date.fromisoformat(fecha_vencimiento).toordinal()
+    except (ValueError, TypeError):
+        return FECHA_INVALIDA
+
+
+def _numero(valor):
+    """Devuelve int cuando el valor no tiene decimales, como _convertir_a_numero"""
+    valor = float(valor)
+    return int(valor) if valor.is_integer() else valor
+
+
+class TablaInventario:
+    """Inventario compacto.
+
+    Nombre y marca se guardan una vez por código. Cada lote es una fila en
+    arreglos NumPy (producto, cantidad, vencimiento como ordinal y precios) y
+    los lotes vivos ocupan siempre las primeras `n` filas, así `dataframe()`
+    usa las columnas numéricas sin copiarlas. Cada producto guarda sus filas
+    en orden FIFO.
+
+    Para lectura se comporta como el dict codigo -> lista de lotes de antes:
+    `get`, `items` y `[]` devuelven los lotes como diccionarios.
+    """
+
+    def __init__(self, capacidad=1024):
+        self._indice = {}
+        self.codigos = []
+        self.nombres = []
+        self.marcas = []
+        self._fifo = []
+        self._con_lotes = 0
+
+        self.n = 0
+        self.producto = np.zeros(capacidad, dtype=np.int32)
+        self.cantidad = np.zeros(capacidad, dtype=np.int64)
+        self.vence = np.zeros(capacidad, dtype=np.int32)
+        self.precio_costo = np.zeros(capacidad, dtype=np.float64)
+        self.precio_venta = np.zeros(capacidad, dtype=np.float64)
+        self._fv_invalidas = {}
+
+    # --- Lectura (compatible con el dict de listas) ---
+
+    def __contains__(self, codigo):
+        pid = self._indice.get(codigo)
+        return pid is not None and bool(self._fifo[pid])
+
+    def __len__(self):
+        return self._con_lotes
+
+    def __iter__(self):
+        for pid, filas in enumerate(self._fifo):
+            if filas:
+                yield self.codigos[pid]
+
+    def __getitem__(self, codigo):
+        if codigo not in self:
+            raise KeyError(codigo)
+        return self.lotes(codigo)
+
+    def get(self, codigo, por_defecto=None):
+        return self.lotes(codigo) if codigo in self else por_defecto
+
+    def items(self):
+        for codigo in list(self):
+            yield codigo, self.lotes(codigo)
+
+    def _fecha_texto(self, fila):
+        dia = int(self.vence[fila])
+        if dia > 0:
+            return date.fromordinal(dia).isoformat()
+        if dia == FECHA_INVALIDA:
+            return self._fv_invalidas.get(fila, "")
+        return ""
+
+    def _lote(self, fila):
+        pid = int(self.producto[fila])
+        dia = int(self.vence[fila])
+        return {
+            'nombre': self.nombres[pid], 'marca': self.marcas[pid],
+            'cantidad': int(self.cantidad[fila]), 'fecha_vencimiento': self._fecha_texto(fila),
+            'precio_costo': _numero(self.precio_costo[fila]), 'precio_venta': _numero(self.precio_venta[fila]),
+            'vence': date.fromordinal(dia) if dia > 0 else None,
+        }
+
+    def lotes(self, codigo):
+        """Lotes del producto en orden FIFO, como diccionarios"""
+        pid = self._indice.get(codigo)
+        if pid is None:
+            return []
+        return [self._lote(fila) for fila in self._fifo[pid]]
+
+    def productos(self):
+        """(codigo, nombre, marca) de los productos con stock"""
+        return [(self.codigos[pid], self.nombres[pid], self.marcas[pid])
+                for pid, filas in enumerate(self._fifo) if filas]
+
+    def filas(self, codigos):
+        """Filas de los lotes de esos productos, en orden de fila"""
+        filas = [f for c in codigos if (pid := self._indice.get(c)) is not None for f in self._fifo[pid]]
+        return np.sort(np.asarray(filas, dtype=np.intp))
+
+    def unidades(self, filas=None):
+        """Suma de cantidades de las filas (o de todo el inventario)"""
+        return int(self.cantidad[:self.n].sum() if filas is None else self.cantidad[filas].sum())
+
+    def ordenar(self, filas, columna, descendente=False):
+        """Ordena las filas por una columna de inventario_headers, sin armar el DataFrame"""
+        if columna in ('codigo', 'nombre', 'marca'):
+            textos = {'codigo': self.codigos, 'nombre': self.nombres, 'marca': self.marcas}[columna]
+            rango = np.empty(len(textos), dtype=np.intp)
+            rango[np.argsort(np.asarray([str(t).casefold() for t in textos], dtype=object), kind='stable')] = np.arange(len(textos))
+            clave = rango[self.producto[filas]]
+        elif columna == 'fecha_vencimiento':
+            clave = self.vence[filas]
+            clave = np.where(clave > 0, clave, _FIN_FIFO)
+        else:
+            clave = getattr(self, columna)[filas]
+        orden = np.argsort(clave, kind='stable')
+        return filas[orden[::-1] if descendente else orden]
+
+    def dataframe(self, filas=None):
+        """Lotes con las columnas de inventario_headers (todos, o solo `filas`).
+
+        Sin `filas`, cantidad y precios son vistas de los arreglos (sin copia);
+        el código es categórico sobre la tabla de productos.
+        """
+        sel = slice(0, self.n) if filas is None else filas
+        producto = self.producto[sel]
+        dias = self.vence[sel]
+        fechas = np.where(dias > 0, dias.astype(np.int64) - _EPOCA, np.iinfo(np.int64).min)
+        return pd.DataFrame({
+            'codigo': pd.Categorical.from_codes(producto, categories=self.codigos),
+            'nombre': np.asarray(self.nombres, dtype=object)[producto],
+            'marca': np.asarray(self.marcas, dtype=object)[producto],
+            'cantidad': self.cantidad[sel],
+            'fecha_vencimiento': fechas.view('datetime64[D]'),
+            'precio_costo': self.precio_costo[sel],
+            'precio_venta': self.precio_venta[sel],
+        }, copy=False)
+
+    # --- Escritura (se llama dentro de almacen.lock) ---
+
+    def _clave_fifo(self, fila):
+        dia = int(self.vence[fila])
+        return dia if dia > 0 else _FIN_FIFO
+
+    def _producto(self, codigo, nombre, marca):
+        pid = self._indice.get(codigo)
+        if pid is None:
+            pid = len(self.codigos)
+            self._indice[codigo] = pid
+            self.codigos.append(codigo)
+            self.nombres.append(nombre)
+            self.marcas.append(marca)
+            self._fifo.append([])
+        elif not self._fifo[pid]:
+            # Un producto que se había quedado sin lotes se registra de nuevo
+            self.nombres[pid] = nombre
+            self.marcas[pid] = marca
+        return pid
+
+    def _asegurar_capacidad(self, n):
+        capacidad = len(self.producto)
+        if n <= capacidad:
+            return
+        capacidad = max(n, capacidad * 2)
+        for nombre in ("producto", "cantidad", "vence", "precio_costo", "precio_venta"):
+            arreglo = getattr(self, nombre)
+            nuevo = np.zeros(capacidad, dtype=arreglo.dtype)
+            nuevo[:self.n] = arreglo[:self.n]
+            setattr(self, nombre, nuevo)
+
+    def _nueva_fila(self, pid, lote):
+        self._asegurar_capacidad(self.n + 1)
+        fila = self.n
+        self.n += 1
+        fv = lote.get('fecha_vencimiento') or ""
+        self.producto[fila] = pid
+        self.cantidad[fila] = int(lote.get('cantidad') or 0)
+        self.vence[fila] = _dia(fv)
+        self.precio_costo[fila] = lote.get('precio_costo') or 0
+        self.precio_venta[fila] = lote.get('precio_venta') or 0
+        if self.vence[fila] == FECHA_INVALIDA:
+            self._fv_invalidas[fila] = fv
+        return fila
+
+    def _quitar_fila(self, fila):
+        """Borra una fila moviendo la última a su lugar, para que los lotes sigan contiguos"""
+        ultima = self.n - 1
+        self._fv_invalidas.pop(fila, None)
+        if fila != ultima:
+            for arreglo in (self.producto, self.cantidad, self.vence, self.precio_costo, self.precio_venta):
+                arreglo[fila] = arreglo[ultima]
+            filas = self._fifo[int(self.producto[fila])]
+            filas[filas.index(ultima)] = fila
+            if ultima in self._fv_invalidas:
+                self._fv_invalidas[fila] = self._fv_invalidas.pop(ultima)
+        self.n = ultima
+
+    def agregar_lote(self, codigo, lote):
+        """Suma el lote al de igual vencimiento o lo inserta en su lugar FIFO.
+
+        Devuelve True si se sumó a un lote existente.
+        """
+        pid = self._producto(codigo, lote.get('nombre', ""), lote.get('marca', ""))
+        filas = self._fifo[pid]
+        fv = lote.get('fecha_vencimiento') or ""
+        for fila in filas:
+            if self._fecha_texto(fila) == fv:
+                self.cantidad[fila] += int(lote.get('cantidad') or 0)
+                return True
+        if not filas:
+            self._con_lotes += 1
+        insort(filas, self._nueva_fila(pid, lote), key=self._clave_fifo)
+        return False
+
+    def consumir_fifo(self, codigo, cantidad):
+        """Descuenta `cantidad` desde el frente de la lista FIFO.
+
+        Los lotes que quedan en cero se borran en el lugar. Devuelve los
+        (lote, cantidad_tomada) consumidos.
+        """
+        pid = self._indice.get(codigo)
+        if pid is None:
+            return []
+        filas = self._fifo[pid]
+        consumidos, agotadas = [], 0
+        restante = cantidad
+        while agotadas < len(filas) and restante > 0:
+            fila = filas[agotadas]
+            toma = min(int(self.cantidad[fila]), restante)
+            self.cantidad[fila] -= toma
+            restante -= toma
+            if toma > 0:
+                consumidos.append((self._lote(fila), toma))
+            if self.cantidad[fila] > 0:
+                break
+            agotadas += 1
+        borrar = filas[:agotadas]
+        del filas[:agotadas]
+        # De mayor a menor, así la última fila nunca es una que falta borrar
+        for fila in sorted(borrar, reverse=True):
+            self._quitar_fila(fila)
+        if borrar and not filas:
+            self._con_lotes -= 1
+        return consumidos
+
+    def _cargar_producto(self, codigo, lotes):
+        pid = self._producto(codigo, lotes[0].get('nombre', ""), lotes[0].get('marca', ""))
+        filas = self._fifo[pid]
+        if not filas:
+            self._con_lotes += 1
+        filas.extend(self._nueva_fila(pid, lote) for lote in lotes)
+        filas.sort(key=self._clave_fifo)
+
+    def fijar_lotes(self, codigo, lotes):
+        """Reemplaza todos los lotes de un producto (por ejemplo al reaplicar el diario)"""
+        pid = self._indice.get(codigo)
+        if pid is not None and self._fifo[pid]:
+            for fila in sorted(self._fifo[pid], reverse=True):
+                self._quitar_fila(fila)
+            self._fifo[pid].clear()
+            self._con_lotes -= 1
+        if lotes:
+            self._cargar_producto(codigo, lotes)
+
+    def reemplazar(self, inventario):
+        """Carga un dict codigo -> lista de lotes, reemplazando todo"""
+        self.__init__(capacidad=max(1024, sum(len(l) for l in inventario.values())))
+        for codigo, lotes in inventario.items():
+            if lotes:
+                self._cargar_producto(codigo, lotes)
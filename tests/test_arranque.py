@@ -0,0 +1,60 @@
+import os
+import time
+
+import gspread
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+from benchmark import PlanillaFalsa, generar_catalogo
+from metricas import metricas
+from repositorio import INVENTARIO_WS, RepositorioSQLite, parsear_inventario
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+class _Cuenta:
+    def __init__(self, planilla):
+        self.planilla = planilla
+
+    def open_by_key(self, clave):
+        return self.planilla
+
+
+@pytest.fixture
+def entorno(tmp_path, monkeypatch):
+    for variable, archivo in (("INVENTARIO_DB", "inventario.db"), ("INVENTARIO_DIARIO", "diario.jsonl"),
+                              ("INVENTARIO_INSTANTANEA", "instantanea.npz"),
+                              ("INVENTARIO_COPIA_MOVIMIENTOS", "movimientos.csv")):
+        monkeypatch.setenv(variable, str(tmp_path / archivo))
+    monkeypatch.delenv("INVENTARIO_BACKEND", raising=False)
+    st.cache_resource.clear()
+    yield tmp_path
+    st.cache_resource.clear()
+
+
+def test_primer_arranque_importa_la_planilla_sin_borrarla(entorno, monkeypatch):
+    inventario, stock_minimo, movimientos = generar_catalogo(300)
+    planilla = PlanillaFalsa()
+    planilla.cargar(inventario, stock_minimo, movimientos)
+    monkeypatch.setattr(gspread, "service_account_from_dict", lambda credenciales: _Cuenta(planilla))
+    exportaciones = len(metricas.valores("espejo.exportar (ms)"))
+
+    at = AppTest.from_file(APP, default_timeout=60)
+    at.secrets["gcp_service_account"] = {"type": "service_account"}
+    at.run()
+    # La carga empieza después del login
+    at.text_input[0].input("admin")
+    at.text_input[1].input("admin123")
+    at.button[0].click()
+    at.run()
+    assert not at.exception
+
+    # El espejo arranca después de importar y su primera exportación no cambia nada
+    limite = time.monotonic() + 10
+    while len(metricas.valores("espejo.exportar (ms)")) == exportaciones and time.monotonic() < limite:
+        time.sleep(0.05)
+    assert len(metricas.valores("espejo.exportar (ms)")) > exportaciones
+    assert len(planilla._hojas[INVENTARIO_WS].filas) == 1 + sum(len(l) for l in inventario.values())
+    filas = planilla._hojas[INVENTARIO_WS].filas[1:]
+    assert RepositorioSQLite(str(entorno / "inventario.db")).leer_inventario() == parsear_inventario(filas)[0]
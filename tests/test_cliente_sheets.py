@@ -0,0 +1,164 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from gspread.exceptions import APIError
+
+import cliente_sheets
+from benchmark import _RespuestaFalsa
+from cliente_sheets import BaldeFichas, ClienteSheets
+
+
+class RelojFalso:
+    """monotonic/sleep que no esperan: dormir solo adelanta el reloj y se anota"""
+
+    def __init__(self):
+        self.ahora = 1000.0
+        self.dormidas = []
+
+    def monotonic(self):
+        return self.ahora
+
+    def sleep(self, segundos):
+        self.dormidas.append(segundos)
+        self.ahora += segundos
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = RelojFalso()
+    monkeypatch.setattr(cliente_sheets, "time", SimpleNamespace(monotonic=reloj.monotonic, sleep=reloj.sleep))
+    # Sin azar: cada reintento espera el máximo de su tramo
+    monkeypatch.setattr(cliente_sheets, "random", SimpleNamespace(uniform=lambda a, b: b))
+    return reloj
+
+
+class HojaFalsa:
+    """Pestaña que cuenta las llamadas y puede fallar o quedarse esperando"""
+
+    def __init__(self, errores=(), filas=None):
+        self.id = 1
+        self.title = "movimientos"
+        self.errores = list(errores)
+        self.filas = filas or [["a", "b"], ["1", "2"]]
+        self.llamadas = 0
+        self.empezada = threading.Event()
+        self.soltar = None
+
+    def _responder(self):
+        self.llamadas += 1
+        self.empezada.set()
+        if self.soltar is not None:
+            self.soltar.wait(5)
+        if self.errores:
+            raise APIError(_RespuestaFalsa(self.errores.pop(0), "error"))
+
+    def get_all_values(self):
+        self._responder()
+        return [list(f) for f in self.filas]
+
+    def append_rows(self, filas, **kwargs):
+        self._responder()
+        self.filas.extend(filas)
+
+
+def _cliente(hoja, **kwargs):
+    sh = SimpleNamespace(id="planilla", worksheets=lambda: [hoja])
+    return ClienteSheets(sh, **kwargs).worksheet(hoja.title)
+
+
+def test_el_balde_deja_pasar_la_rafaga_y_despues_espera_por_la_tasa(reloj):
+    balde = BaldeFichas(cupo_por_minuto=70, capacidad=10)  # una ficha por segundo
+
+    assert [balde.tomar() for _ in range(10)] == [0.0] * 10
+    assert reloj.dormidas == []
+    assert balde.tomar() == pytest.approx(1.0)
+
+    reloj.ahora += 0.25
+    assert balde.tomar() == pytest.approx(0.75)
+
+    # Parado mucho tiempo no junta más que la capacidad
+    reloj.ahora += 3600
+    assert [balde.tomar() for _ in range(10)] == [0.0] * 10
+    assert balde.tomar() == pytest.approx(1.0)
+    assert reloj.dormidas == pytest.approx([1.0, 0.75, 1.0])
+
+
+def test_lecturas_identicas_simultaneas_hacen_una_sola_llamada():
+    hoja = HojaFalsa()
+    hoja.soltar = threading.Event()
+    ws = _cliente(hoja)
+    resultados = []
+
+    def leer():
+        resultados.append(ws.get_all_values())
+
+    hilos = [threading.Thread(target=leer) for _ in range(5)]
+    hilos[0].start()
+    assert hoja.empezada.wait(5)
+    for hilo in hilos[1:]:
+        hilo.start()
+    # Se suelta la respuesta recién cuando los otros cuatro están esperando la misma lectura
+    vuelos = ws._cliente._vuelos
+    limite = time.monotonic() + 5
+    while time.monotonic() < limite and not any(v.esperando == 4 for v in list(vuelos.values())):
+        time.sleep(0.01)
+    hoja.soltar.set()
+    for hilo in hilos:
+        hilo.join(5)
+
+    assert hoja.llamadas == 1
+    assert resultados == [hoja.filas] * 5
+    # Cada hilo recibe su copia
+    resultados[0][0][0] = "cambiado"
+    assert resultados[1][0][0] == "a"
+
+    # Pasada la lectura, la siguiente vuelve a la red
+    ws.get_all_values()
+    assert hoja.llamadas == 2
+
+
+def test_el_429_se_reintenta_con_espera_exponencial(reloj):
+    hoja = HojaFalsa(errores=[429, 429])
+    ws = _cliente(hoja, espera_inicial=1)
+
+    ws.append_rows([["3", "4"]])
+
+    assert hoja.llamadas == 3
+    assert reloj.dormidas == [1, 2]
+    assert hoja.filas[-1] == ["3", "4"]
+
+
+@pytest.mark.parametrize("codigo", [400, 403, 404])
+def test_una_lectura_con_error_que_no_es_de_cupo_ni_del_servidor_no_se_reintenta(reloj, codigo):
+    hoja = HojaFalsa(errores=[codigo])
+    ws = _cliente(hoja)
+
+    with pytest.raises(APIError):
+        ws.get_all_values()
+    assert hoja.llamadas == 1
+    assert reloj.dormidas == []
+
+
+@pytest.mark.parametrize("codigo", [400, 500, 503])
+def test_una_escritura_solo_se_reintenta_ante_429(reloj, codigo):
+    hoja = HojaFalsa(errores=[codigo])
+    ws = _cliente(hoja)
+
+    with pytest.raises(APIError):
+        ws.append_rows([["3", "4"]])
+    assert hoja.llamadas == 1
+    assert reloj.dormidas == []
+    assert len(hoja.filas) == 2
+
+
+def test_desde_la_pagina_los_reintentos_no_pasan_la_espera_interactiva(reloj):
+    hoja = HojaFalsa(errores=[429] * 10)
+    ws = _cliente(hoja, espera_inicial=1, interactivo=lambda: True, espera_interactiva=4)
+
+    with pytest.raises(APIError):
+        ws.get_all_values()
+    # 1 + 2 segundos; el siguiente (4) ya no entra en lo que queda
+    assert reloj.dormidas == [1, 2]
+    assert hoja.llamadas == 3
@@ -0,0 +1,15 @@
+from conversiones import parsear_fechas, parsear_numeros
+
+
+def test_parsear_fechas_normaliza_las_validas_y_deja_las_demas_como_venian():
+    fechas, invalidas = parsear_fechas(["2025-6-1", "2025-06-01 10:00", "", None, "sin fecha", "2025-13-01"])
+
+    assert fechas.tolist() == ["2025-06-01", "2025-06-01", "", "", "sin", "2025-13-01"]
+    assert invalidas.tolist() == [4, 5]
+
+
+def test_parsear_numeros_informa_lo_que_no_es_numero():
+    numeros, invalidos = parsear_numeros(["3", " 2.5 ", "", None, "x"])
+
+    assert numeros.tolist() == [3, 2.5, 0, 0, 0]
+    assert invalidos.tolist() == [4]
@@ -0,0 +1,99 @@
+from diario import Diario
+from tabla import TablaInventario
+
+
+def _lote(cantidad, fv="2030-01-01"):
+    return {'nombre': "x", 'marca': "m", 'cantidad': cantidad, 'fecha_vencimiento': fv,
+            'precio_costo': 1, 'precio_venta': 2}
+
+
+def _sin_vence(tabla, codigo):
+    """Lotes como los anota la app en el diario y los guarda el backend"""
+    return [{k: v for k, v in l.items() if k != 'vence'} for l in tabla.lotes(codigo)]
+
+
+def _estado(tabla):
+    return {c: [(l['fecha_vencimiento'], l['cantidad']) for l in lotes] for c, lotes in tabla.items()}
+
+
+def _reproducir(diario, backend):
+    """Lo que hace la app al arrancar: carga el backend y reaplica lo pendiente en orden"""
+    tabla = TablaInventario()
+    tabla.reemplazar({c: [dict(l) for l in lotes] for c, lotes in backend.items()})
+    for evento in diario.pendientes():
+        for codigo, lotes in evento["lotes"].items():
+            tabla.fijar_lotes(codigo, lotes)
+    return tabla
+
+
+def test_pendientes_sobreviven_al_reinicio(tmp_path):
+    ruta = str(tmp_path / "diario.jsonl")
+    diario = Diario(ruta)
+    a = diario.registrar(lotes={"1": [_lote(5)]}, stock_minimo={}, movimientos=[])
+    b = diario.registrar(lotes={"2": [_lote(3)]}, stock_minimo={}, movimientos=[])
+    diario.confirmar(a)
+
+    assert [e["seq"] for e in Diario(ruta).pendientes()] == [b]
+    # La secuencia sigue desde la última usada
+    assert Diario(ruta).registrar(lotes={}, stock_minimo={}, movimientos=[]) == b + 1
+
+
+def test_reproducir_mezcla_de_confirmadas_y_pendientes(tmp_path):
+    ruta = str(tmp_path / "diario.jsonl")
+    memoria = TablaInventario()
+    backend = {}
+    diario = Diario(ruta)
+
+    def operar(cambios, guardado):
+        for codigo, lotes in cambios.items():
+            memoria.fijar_lotes(codigo, lotes)
+        seq = diario.registrar(lotes={c: _sin_vence(memoria, c) for c in cambios}, stock_minimo={}, movimientos=[])
+        if guardado:
+            # El backend guarda el estado de memoria de esos productos
+            for codigo in cambios:
+                backend[codigo] = _sin_vence(memoria, codigo)
+            diario.confirmar(seq)
+
+    operar({"leche": [_lote(10)]}, guardado=True)
+    operar({"leche": [_lote(7)], "pan": [_lote(4)]}, guardado=False)   # falla la red
+    operar({"leche": [_lote(2)]}, guardado=True)                        # guarda leche, no pan
+    operar({"arroz": [_lote(9, "")]}, guardado=False)
+    operar({"pan": []}, guardado=False)                                 # se vendió todo el pan
+
+    reabierto = Diario(ruta)
+    tabla = _reproducir(reabierto, backend)
+
+    assert _estado(tabla) == _estado(memoria)
+    # La operación pendiente ya no vuelve leche a 7: solo le queda pan
+    assert [sorted(e["lotes"]) for e in reabierto.pendientes()] == [["pan"], ["arroz"], ["pan"]]
+
+
+def test_confirmar_una_operacion_da_por_guardadas_las_anteriores_que_cubre(tmp_path):
+    diario = Diario(str(tmp_path / "diario.jsonl"))
+    a = diario.registrar(lotes={"1": [_lote(1)]}, stock_minimo={"1": 3}, movimientos=[["m"]])
+    diario.registrar(lotes={"2": [_lote(1)]}, stock_minimo={}, movimientos=[])
+    c = diario.registrar(lotes={"1": [_lote(5)], "3": []}, stock_minimo={}, movimientos=[])
+    pendientes = diario.pendientes()
+
+    diario.confirmar(c)
+
+    assert [e["lotes"] for e in diario.pendientes()] == [{"2": [_lote(1)]}]
+    assert a not in [e["seq"] for e in diario.pendientes()]
+    # Los registros ya entregados no cambian
+    assert pendientes[0]["lotes"] == {"1": [_lote(1)]}
+
+
+def test_compactar_y_linea_cortada(tmp_path):
+    ruta = str(tmp_path / "diario.jsonl")
+    diario = Diario(ruta, compactar_cada=4)
+    seqs = [diario.registrar(lotes={str(i): [_lote(i + 1)]}, stock_minimo={}, movimientos=[]) for i in range(3)]
+    diario.confirmar(seqs[0])   # cuarta línea: se compacta
+    with open(ruta, encoding="utf-8") as f:
+        assert len(f.readlines()) == 2
+    with open(ruta, "a", encoding="utf-8") as f:
+        f.write('{"seq": 99, "lotes"')   # caída a mitad de escritura
+
+    reabierto = Diario(ruta)
+    assert [e["seq"] for e in reabierto.pendientes()] == seqs[1:]
+    nuevo = reabierto.registrar(lotes={}, stock_minimo={}, movimientos=[])
+    assert [e["seq"] for e in Diario(ruta).pendientes()] == seqs[1:] + [nuevo]
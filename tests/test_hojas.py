@@ -0,0 +1,115 @@
+import random
+
+import pytest
+
+from hojas import SincronizadorHoja
+from repositorio import inventario_headers
+
+
+class PlanillaEnMemoria:
+    """Una pestaña que aplica los pedidos de batch_update en orden, como la API de Sheets"""
+
+    def __init__(self, filas):
+        self.filas = [list(inventario_headers)] + [list(f) for f in filas]
+        self.id = 0
+        self.pedidos = 0
+
+    def worksheet(self, nombre):
+        return self
+
+    def batch_update(self, cuerpo):
+        self.pedidos += 1
+        for pedido in cuerpo["requests"]:
+            if "updateCells" in pedido:
+                p = pedido["updateCells"]
+                rango = p["range"]
+                valores = [_valor(c) for c in p["rows"][0]["values"]]
+                fila = self.filas[rango["startRowIndex"]]
+                fila[rango["startColumnIndex"]:rango["endColumnIndex"]] = valores
+            elif "deleteDimension" in pedido:
+                rango = pedido["deleteDimension"]["range"]
+                del self.filas[rango["startIndex"]:rango["endIndex"]]
+            elif "appendCells" in pedido:
+                self.filas.extend([_valor(c) for c in fila["values"]] for fila in pedido["appendCells"]["rows"])
+
+
+def _valor(celda):
+    valor = celda["userEnteredValue"]
+    return valor.get("numberValue", valor.get("stringValue"))
+
+
+def _sincronizador():
+    return SincronizadorHoja("inventario", inventario_headers, clave=lambda f: (f[0], f[4]))
+
+
+def _fila(codigo, cantidad, fv=""):
+    return [codigo, f"Producto {codigo}", "Marca", cantidad, fv, 10, 15]
+
+
+def test_actualiza_borra_y_agrega_con_los_indices_correctos():
+    inicial = [_fila(str(i), i) for i in range(6)]
+    hoja = PlanillaEnMemoria(inicial)
+    sync = _sincronizador()
+    sync.registrar(inicial)
+
+    # Se cambia una fila que está debajo de dos borrados y se agrega una nueva
+    nuevas = [inicial[0], inicial[3], _fila("5", 50), _fila("9", 9)]
+    sync.sincronizar(hoja, nuevas)
+
+    assert hoja.filas[1:] == [inicial[0], inicial[3], _fila("5", 50), _fila("9", 9)]
+    assert hoja.pedidos == 1
+    assert sync.sincronizar(hoja, nuevas) == 0
+    assert hoja.pedidos == 1
+
+
+def test_claves_repetidas_se_distinguen_por_aparicion():
+    inicial = [_fila("1", 1), _fila("1", 2), _fila("2", 3)]
+    hoja = PlanillaEnMemoria(inicial)
+    sync = _sincronizador()
+    sync.registrar(inicial)
+
+    sync.sincronizar(hoja, [_fila("1", 1), _fila("2", 3)])
+
+    assert hoja.filas[1:] == [_fila("1", 1), _fila("2", 3)]
+
+
+@pytest.mark.parametrize("semilla", range(5))
+def test_la_hoja_queda_igual_al_estado_local_despues_de_cada_guardado(semilla):
+    rnd = random.Random(semilla)
+    fechas = ["", "2030-01-01", "2030-06-01"]
+    local = {}
+    for i in range(30):
+        local[(str(i), rnd.choice(fechas))] = rnd.randint(1, 9)
+    filas = lambda: [_fila(c, n, fv) for (c, fv), n in local.items()]
+    hoja = PlanillaEnMemoria(filas())
+    sync = _sincronizador()
+    sync.registrar(filas())
+
+    for _ in range(60):
+        for _ in range(rnd.randint(1, 8)):
+            accion = rnd.random()
+            if accion < 0.4 and local:
+                local[rnd.choice(list(local))] = rnd.randint(1, 99)
+            elif accion < 0.7 and local:
+                del local[rnd.choice(list(local))]
+            else:
+                local[(str(rnd.randint(0, 60)), rnd.choice(fechas))] = rnd.randint(1, 9)
+        # El orden de las filas en memoria no tiene por qué coincidir con el de la hoja
+        nuevas = filas()
+        rnd.shuffle(nuevas)
+        sync.sincronizar(hoja, nuevas)
+
+        assert sorted(hoja.filas[1:]) == sorted(nuevas)
+        assert [fila for _, fila in sync.filas] == hoja.filas[1:]
+
+
+def test_si_falla_el_envio_se_olvida_la_hoja():
+    class Caida(PlanillaEnMemoria):
+        def batch_update(self, cuerpo):
+            raise ConnectionError("sin red")
+
+    sync = _sincronizador()
+    sync.registrar([_fila("1", 1)])
+    with pytest.raises(ConnectionError):
+        sync.sincronizar(Caida([_fila("1", 1)]), [_fila("1", 2)])
+    assert not sync.conoce_hoja()
@@ -0,0 +1,69 @@
+import io
+
+import openpyxl
+
+from importacion import exportar, validar_archivo
+
+
+def _csv(texto):
+    return io.BytesIO(texto.encode("utf-8"))
+
+
+def test_errores_con_el_numero_de_fila_del_archivo_entre_bloques():
+    archivo = _csv(
+        "codigo,nombre,cantidad,fecha_vencimiento,precio_costo\n"
+        "1,Leche,5,2030-01-01,10\n"       # fila 2
+        ",Sin codigo,3,,\n"               # fila 3
+        "2,Pan,0,,\n"                     # fila 4
+        ",,,,\n"                          # fila 5: vacía, se saltea
+        "3,Arroz,2,31/12/2030,\n"         # fila 6
+        "4,Azucar,1.5,,-1\n"              # fila 7: dos errores
+        "1,Leche,4,2030-01-01,10\n"       # fila 8
+    )
+
+    lotes, errores = validar_archivo(archivo, "lotes.csv", tamano=2)
+
+    assert errores == [
+        (3, "código vacío"), (4, "cantidad inválida"), (6, "fecha inválida (use AAAA-MM-DD)"),
+        (7, "cantidad inválida"), (7, "precio_costo inválido"),
+    ]
+    # Las filas del mismo lote en bloques distintos se suman
+    assert lotes[["codigo", "cantidad"]].values.tolist() == [["1", 9]]
+
+
+def test_xlsx_con_codigos_numericos_y_filas_vacias():
+    libro = openpyxl.Workbook()
+    ws = libro.active
+    ws.append(["codigo", "nombre", "cantidad"])
+    ws.append([7790001, "Leche", 5])      # fila 2
+    ws.append([None, "Sin codigo", 1])    # fila 3
+    ws.append([None, None, None])         # fila 4: vacía
+    ws.append([7790002, "Pan", "x"])      # fila 5
+    archivo = io.BytesIO()
+    libro.save(archivo)
+    archivo.seek(0)
+
+    lotes, errores = validar_archivo(archivo, "lotes.xlsx")
+
+    assert errores == [(3, "código vacío"), (5, "cantidad inválida")]
+    assert lotes["codigo"].tolist() == ["7790001"]
+
+
+def test_fechas_sin_ceros_se_normalizan_y_se_consolidan():
+    archivo = _csv(
+        "codigo,cantidad,fecha_vencimiento\n"
+        "1,2,2025-6-1\n"
+        "1,3,2025-06-01\n"
+        "2,1,\n"
+    )
+
+    lotes, errores = validar_archivo(archivo, "lotes.csv")
+
+    assert errores == []
+    assert lotes[["codigo", "fecha_vencimiento", "cantidad"]].values.tolist() == [["1", "2025-06-01", 5], ["2", "", 1]]
+
+
+def test_exportar_devuelve_bytes():
+    lotes, _ = validar_archivo(_csv("codigo,cantidad\n1,2\n"), "lotes.csv")
+    for formato in ("csv", "xlsx"):
+        assert isinstance(exportar([lotes], formato), bytes)
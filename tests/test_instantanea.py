@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from historial import HistorialMovimientos
+from instantanea import InstantaneaDisco
+
+
+def _lote(cantidad, fv, costo=10, venta=15, nombre="Leche"):
+    return {'nombre': nombre, 'marca': "La Vaquita", 'cantidad': cantidad, 'fecha_vencimiento': fv,
+            'precio_costo': costo, 'precio_venta': venta}
+
+
+def _consulta(historial):
+    return historial.consultar().sort_values(["timestamp", "codigo"], kind="stable", ignore_index=True)
+
+
+def test_guardar_y_cargar_devuelve_lo_mismo(tmp_path):
+    inventario = {
+        "7790001": [_lote(5, "2030-01-01"), _lote(2, "sin fecha", costo=10.5, venta=12.25)],
+        "ñandú": [_lote(1, "", nombre="Azúcar \"fina\", 1 kg")],
+    }
+    stock_minimo = {"7790001": 3, "ñandú": 1.5}
+    movimientos = HistorialMovimientos([
+        ["2030-01-02T10:00:00", "entrada", "7790001", "Leche", "5", "2030-01-01", "10", "15"],
+        ["2030-01-02 11:30:00", "salida", "7790001", "Leche", 1, "", 10.5, 12.25],
+        ["2029-12-31T23:59:59", "entrada", "ñandú", "Azúcar", "1", "", "", ""],
+        ["mañana", "salida", "7790001", "Leche", "x", "", "10", "15"],   # timestamp y cantidad inválidos
+        ["2030-01-03T08:00:00", "salida", "7790001", "Leche", "2", "", "gratis"],  # fila corta, precio inválido
+    ])
+    movimientos.consultar()   # invalidos() cuenta los meses ya tipados
+    invalidos = movimientos.invalidos()
+    assert invalidos == {"timestamp": 1, "cantidad": 1, "precio_costo": 1}
+
+    disco = InstantaneaDisco(str(tmp_path / "instantanea.npz"), "sqlite:prueba")
+    sello = disco.guardar(inventario, stock_minimo, movimientos, version=7)
+    inv, minimos, movs, sello_leido = disco.cargar()
+
+    assert inv == inventario
+    assert minimos == stock_minimo
+    assert sello_leido == sello and sello["version"] == 7 and sello["movimientos"] == 5
+    cargado = HistorialMovimientos(movs)
+    cargado.consultar()
+    assert cargado.invalidos() == invalidos
+    # El contenido tipado es el mismo, incluidas las filas inválidas
+    assert _consulta(cargado).equals(_consulta(movimientos))
+    assert "mañana" in [f[0] for f in movs]
+
+
+def test_vacia_y_de_otro_origen(tmp_path):
+    ruta = str(tmp_path / "instantanea.npz")
+    InstantaneaDisco(ruta, "sqlite:a").guardar({}, {}, HistorialMovimientos(), version=0)
+
+    assert InstantaneaDisco(ruta, "sqlite:a").cargar()[:3] == ({}, {}, [])
+    with pytest.raises(ValueError):
+        InstantaneaDisco(ruta, "sheets:b").cargar()
+
+
+def test_las_columnas_de_texto_no_ocupan_el_ancho_del_valor_mas_largo(tmp_path):
+    filas = [["2030-01-01T00:00:00", "entrada", str(i), "x", "1", "", "0", "0"] for i in range(1000)]
+    filas[0][3] = "n" * 5000
+    ruta = str(tmp_path / "instantanea.npz")
+    InstantaneaDisco(ruta, "sqlite:a").guardar({}, {}, HistorialMovimientos(filas), version=1)
+
+    with np.load(ruta) as datos:
+        assert datos["mov_nombre"].nbytes < 10000
+        assert datos["mov_timestamp"].nbytes < 25000
@@ -0,0 +1,124 @@
+import threading
+import time
+
+from benchmark import PlanillaFalsa, generar_catalogo
+from repositorio import (
+    EspejoSheets, INVENTARIO_WS, MOVIMIENTOS_WS, RepositorioSheets, RepositorioSQLite,
+    parsear_inventario,
+)
+
+
+def _esperar(condicion, segundos=5):
+    limite = time.monotonic() + segundos
+    while time.monotonic() < limite:
+        if condicion():
+            return True
+        time.sleep(0.02)
+    return condicion()
+
+
+def _inventario_hoja(planilla):
+    return parsear_inventario(planilla._hojas[INVENTARIO_WS].filas[1:])[0]
+
+
+def test_importar_reemplaza_todo_y_esta_vacio(tmp_path):
+    repo = RepositorioSQLite(str(tmp_path / "inventario.db"))
+    assert repo.esta_vacio()
+    inventario, stock_minimo, movimientos = generar_catalogo(60)
+
+    repo.importar(inventario, stock_minimo, movimientos)
+
+    assert not repo.esta_vacio()
+    cargado, minimos, movs = repo.cargar()
+    assert cargado == inventario
+    assert minimos == stock_minimo
+    assert len(movs) == len(movimientos)
+    # Lo importado desde la nube no queda pendiente de exportar
+    assert repo.sin_exportar() == 0
+
+    repo.importar({"1": [inventario[next(iter(inventario))][0]]}, {}, [], exportados=False)
+    assert list(repo.leer_inventario()) == ["1"]
+    assert repo.movimientos_sin_exportar() == ([], [])
+    assert repo.sin_exportar() == 1
+
+
+def test_el_espejo_copia_a_la_planilla_solo_lo_que_cambio(tmp_path):
+    inventario, stock_minimo, movimientos = generar_catalogo(60)
+    planilla = PlanillaFalsa()
+    planilla.cargar(inventario, stock_minimo, movimientos)
+    local = RepositorioSQLite(str(tmp_path / "inventario.db"))
+    local.importar(inventario, stock_minimo, movimientos)
+
+    espejo = EspejoSheets(local, RepositorioSheets(lambda: planilla), espera_inicial=0.01)
+    # Al arrancar lee dónde está cada fila; la planilla ya coincide y no se escribe nada
+    assert _esperar(lambda: planilla.llamadas["values_batch_get"])
+    assert espejo.ultimo_error is None
+    assert _inventario_hoja(planilla) == inventario
+
+    codigo, quitado = list(inventario)[0], list(inventario)[-1]
+    inventario[codigo][0]['cantidad'] += 5
+    del inventario[quitado]
+    local.guardar_inventario(inventario, [codigo, quitado])
+    fila = ["2030-01-01T10:00:00", "salida", codigo, "x", 1, "", 0, 0]
+    local.agregar_movimiento(fila)
+    local.vaciar_movimientos()
+    antes = planilla.llamadas["batch_update"]
+    espejo.notificar()
+
+    assert _esperar(lambda: espejo.pendientes() == 0)
+    assert _inventario_hoja(planilla) == inventario
+    assert planilla._hojas[MOVIMIENTOS_WS].filas[-1] == [str(x) for x in fila]
+    # Una sola llamada con las diferencias, sin reescribir la pestaña
+    assert planilla.llamadas["batch_update"] == antes + 1
+    assert not planilla.llamadas[f"{INVENTARIO_WS}.clear"]
+
+
+def test_el_espejo_no_exporta_una_base_vacia_sobre_una_planilla_con_datos(tmp_path):
+    inventario, stock_minimo, movimientos = generar_catalogo(30)
+    planilla = PlanillaFalsa()
+    planilla.cargar(inventario, stock_minimo, movimientos)
+    filas = [list(f) for f in planilla._hojas[INVENTARIO_WS].filas]
+
+    espejo = EspejoSheets(RepositorioSQLite(str(tmp_path / "vacia.db")), RepositorioSheets(lambda: planilla),
+                          espera_inicial=0.01)
+
+    assert _esperar(lambda: espejo.ultimo_error is not None)
+    assert "vacía" in espejo.ultimo_error
+    assert planilla._hojas[INVENTARIO_WS].filas == filas
+
+
+def test_los_movimientos_encolados_se_escriben_solos_pasado_el_plazo():
+    inventario, stock_minimo, movimientos = generar_catalogo(10)
+    planilla = PlanillaFalsa()
+    planilla.cargar(inventario, stock_minimo, movimientos)
+    hilos = []
+
+    def conectar():
+        hilos.append(threading.current_thread().name)
+        return planilla
+
+    repo = RepositorioSheets(conectar)
+    repo.buffer.max_segundos = 0.2
+    fila = ["2030-01-01T10:00:00", "salida", "1", "x", 1, "", 0, 0]
+    repo.agregar_movimiento(fila)
+    # Encolar no llama a la red
+    assert hilos == [] and repo.movimientos_pendientes() == [[str(x) for x in fila]]
+
+    # Sin más filas ni un vaciado explícito, se escribe igual al vencer el plazo
+    assert _esperar(lambda: not repo.movimientos_pendientes())
+    assert planilla._hojas[MOVIMIENTOS_WS].filas[-1] == [str(x) for x in fila]
+    assert planilla.llamadas[f"{MOVIMIENTOS_WS}.append_rows"] == 1
+    assert hilos == ["vaciar-movimientos"]
+
+
+def test_el_buffer_lleno_se_vacia_fuera_del_hilo_que_encola():
+    planilla = PlanillaFalsa()
+    planilla.cargar({}, {}, [])
+    repo = RepositorioSheets(lambda: planilla)
+    repo.buffer.max_filas = 3
+    for i in range(3):
+        repo.agregar_movimiento(["2030-01-01T10:00:00", "entrada", str(i), "x", 1, "", 0, 0])
+
+    assert _esperar(lambda: planilla.llamadas[f"{MOVIMIENTOS_WS}.append_rows"] == 1)
+    assert [f[2] for f in planilla._hojas[MOVIMIENTOS_WS].filas[1:]] == ["0", "1", "2"]
+    assert repo.error_vaciado is None
@@ -0,0 +1,96 @@
+import random
+from datetime import date, timedelta
+
+from tabla import TablaInventario
+
+
+def _lote(cantidad, fecha_vencimiento="", nombre="x"):
+    return {'nombre': nombre, 'marca': "m", 'cantidad': cantidad, 'fecha_vencimiento': fecha_vencimiento,
+            'precio_costo': 1, 'precio_venta': 2}
+
+
+def _revisar(tabla):
+    """Cada fila viva está en la lista FIFO de su producto, una sola vez y en orden de vencimiento"""
+    vistas = []
+    for pid, filas in enumerate(tabla._fifo):
+        for fila in filas:
+            assert fila < tabla.n
+            assert int(tabla.producto[fila]) == pid
+        claves = [tabla._clave_fifo(f) for f in filas]
+        assert claves == sorted(claves)
+        vistas.extend(filas)
+    assert sorted(vistas) == list(range(tabla.n))
+    assert len(tabla) == sum(1 for filas in tabla._fifo if filas)
+    assert set(tabla._fv_invalidas) <= set(range(tabla.n))
+
+
+def test_borrar_una_fila_del_medio_mueve_la_ultima_y_su_indice():
+    tabla = TablaInventario()
+    tabla.agregar_lote("a", _lote(5, "2030-01-01"))
+    tabla.agregar_lote("b", _lote(7, "2030-02-01"))
+    tabla.agregar_lote("a", _lote(3, "2030-03-01"))
+    tabla.agregar_lote("c", _lote(4, "fecha mala"))
+
+    # La fila 0 (primer lote de "a") se vacía: la última fila ("c") pasa a su lugar
+    tabla.consumir_fifo("a", 5)
+
+    _revisar(tabla)
+    assert tabla.n == 3
+    assert tabla.lotes("a") == [dict(_lote(3, "2030-03-01"), vence=date(2030, 3, 1))]
+    assert [l['cantidad'] for l in tabla.lotes("b")] == [7]
+    assert tabla.lotes("c")[0]['fecha_vencimiento'] == "fecha mala"
+    assert tabla._fifo[tabla._indice["c"]] == [0]
+
+
+def test_consumir_todo_un_producto_lo_saca_del_inventario():
+    tabla = TablaInventario()
+    tabla.agregar_lote("a", _lote(2, "2030-01-01"))
+    tabla.agregar_lote("a", _lote(2, "2030-01-02"))
+    tabla.agregar_lote("b", _lote(1))
+
+    consumidos = tabla.consumir_fifo("a", 10)
+
+    _revisar(tabla)
+    assert [t for _, t in consumidos] == [2, 2]
+    assert "a" not in tabla and list(tabla) == ["b"]
+    assert tabla.unidades() == 1
+
+
+def test_operaciones_al_azar_mantienen_el_indice_consistente():
+    rnd = random.Random(7)
+    codigos = [str(i) for i in range(15)]
+    fechas = [""] + [(date(2030, 1, 1) + timedelta(days=d)).isoformat() for d in range(8)]
+    tabla = TablaInventario(capacidad=4)
+    esperado = {}
+    for _ in range(2000):
+        codigo = rnd.choice(codigos)
+        accion = rnd.random()
+        if accion < 0.5:
+            fv, cantidad = rnd.choice(fechas), rnd.randint(1, 9)
+            tabla.agregar_lote(codigo, _lote(cantidad, fv))
+            lotes = esperado.setdefault(codigo, {})
+            lotes[fv] = lotes.get(fv, 0) + cantidad
+        elif accion < 0.9:
+            cantidad = rnd.randint(1, 20)
+            tabla.consumir_fifo(codigo, cantidad)
+            lotes = esperado.get(codigo, {})
+            # FIFO: primero el vencimiento más cercano, los sin fecha al final
+            for fv in sorted(lotes, key=lambda f: f or "9999"):
+                toma = min(lotes[fv], cantidad)
+                lotes[fv] -= toma
+                cantidad -= toma
+                if not lotes[fv]:
+                    del lotes[fv]
+                if not cantidad:
+                    break
+        else:
+            nuevos = {fv: rnd.randint(1, 9) for fv in rnd.sample(fechas, rnd.randint(0, 3))}
+            tabla.fijar_lotes(codigo, [_lote(c, fv) for fv, c in nuevos.items()])
+            esperado[codigo] = nuevos
+        _revisar(tabla)
+        obtenido = {l['fecha_vencimiento']: l['cantidad'] for l in tabla.lotes(codigo)}
+        assert obtenido == esperado.get(codigo, {})
+
+    assert {c: {l['fecha_vencimiento']: l['cantidad'] for l in lotes} for c, lotes in tabla.items()} == \
+        {c: lotes for c, lotes in esperado.items() if lotes}
+    assert tabla.unidades() == sum(sum(l.values()) for l in esperado.values())
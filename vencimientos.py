@@ -0,0 +1,68 @@
+"""Índice de lotes ordenado por fecha de vencimiento."""
+from bisect import bisect_right, insort
+from datetime import date
+
+
+class IndiceVencimientos:
+    """Lista ordenada de (día, codigo, fecha_vencimiento) que se mantiene al modificar lotes.
+
+    La fecha se parsea una sola vez al indexar el lote, y "lotes que vencen
+    antes de X" es una búsqueda binaria que solo recorre los que cumplen.
+    Las fechas que no se pueden interpretar quedan en `invalidas`.
+    """
+
+    def __init__(self):
+        self._orden = []
+        self._por_codigo = {}
+        self.invalidas = {}
+
+    def __len__(self):
+        return len(self._orden)
+
+    def limpiar(self):
+        self._orden = []
+        self._por_codigo = {}
+        self.invalidas = {}
+
+    def quitar(self, codigo):
+        for clave in self._por_codigo.pop(codigo, ()):
+            i = bisect_right(self._orden, clave) - 1
+            if i >= 0 and self._orden[i] == clave:
+                del self._orden[i]
+        self.invalidas.pop(codigo, None)
+
+    def _indexar(self, codigo, lotes):
+        claves, invalidas = set(), []
+        for lote in lotes:
+            fv = lote.get("fecha_vencimiento")
+            if not fv:
+                continue
+            try:
+                # Los lotes del almacén traen la fecha ya parseada en 'vence'
+                vence = lote.get("vence") or date.fromisoformat(fv)
+                claves.add((vence.toordinal(), codigo, fv))
+            except (ValueError, TypeError):
+                invalidas.append(fv)
+        if claves:
+            self._por_codigo[codigo] = claves
+        if invalidas:
+            self.invalidas[codigo] = invalidas
+        return claves
+
+    def actualizar(self, codigo, lotes):
+        """Reindexa los lotes de un producto"""
+        self.quitar(codigo)
+        for clave in self._indexar(codigo, lotes):
+            insort(self._orden, clave)
+
+    def reconstruir(self, inventario):
+        """Indexa todo el inventario de una vez, con un solo ordenamiento"""
+        self.limpiar()
+        for codigo, lotes in inventario.items():
+            self._orden.extend(self._indexar(codigo, lotes))
+        self._orden.sort()
+
+    def hasta(self, dia):
+        """(dia, codigo, fecha_vencimiento) de los lotes que vencen en `dia` o antes, ordenados"""
+        fin = bisect_right(self._orden, (dia.toordinal(), "\U0010ffff"))
+        return self._orden[:fin]